@@ -0,0 +1,94 @@
+'''
+Date: 2026.10.18 13:13
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:13
+'''
+import struct
+import time
+from typing import Iterator, NamedTuple
+
+MAGIC = b'JTCAP'
+VERSION = 1
+
+# 文件头：魔数、版本、传输方式、开始录制的墙上时间
+_FILE_HEADER = struct.Struct('>5sB4sd')
+# 记录头：距上一条记录的微秒数、连接编号、数据长度，长度为 0 表示连接断开
+_RECORD = struct.Struct('>3I')
+_MAX_DELTA = 0xffffffff
+
+
+class Record(NamedTuple):
+    TIME: float  # 距开始录制的秒数
+    CONNECTION: int
+    DATA: bytes
+
+
+class Recorder(object):
+    '''把服务端收到的原始字节流连同到达时间写入抓包文件
+
+    每条记录只多出 12 字节的记录头，写入经过文件缓冲，不会每次读取都产生一次系统调用，
+    缓冲的数据最多 interval 秒写入一次文件，进程被杀掉时只丢失最后一小段
+    '''
+
+    def __init__(self, path: str, transport: str = 'hex', buffering: int = 1 << 16,
+                 interval: float = 1.0):
+        self.path = path
+        self.interval = interval
+        self._fp = open(path, 'wb', buffering=buffering)
+        self._fp.write(_FILE_HEADER.pack(MAGIC, VERSION, transport.encode().ljust(4), time.time()))
+        self._fp.flush()
+        self._start = self._flushed = time.monotonic()
+        self._ticks = 0
+        self.records = 0
+
+    def record(self, connection: int, data: bytes, now: float = None):
+        now = time.monotonic() if now is None else self._start + now
+        # 按绝对时间取整，累计误差不超过 1 微秒
+        ticks = int((now - self._start) * 1e6)
+        delta = min(max(ticks - self._ticks, 0), _MAX_DELTA)
+        self._ticks += delta
+
+        self._fp.write(_RECORD.pack(delta, connection, len(data)))
+        self._fp.write(data)
+        self.records += 1
+
+        if now - self._flushed >= self.interval:
+            self._flushed = now
+            self._fp.flush()
+
+    def closed(self, connection: int, now: float = None):
+        self.record(connection, b'', now)
+
+    def close(self):
+        self._fp.close()
+
+
+class Capture(object):
+    '''读取 Recorder 写出的抓包文件'''
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as fp:
+            self._data = fp.read()
+
+        if len(self._data) < _FILE_HEADER.size:
+            raise ValueError(f'{path!r} is not a capture file')
+        magic, version, transport, self.started = _FILE_HEADER.unpack_from(self._data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path!r} is not a capture file')
+        self.transport = transport.decode().strip()
+
+    def __iter__(self) -> Iterator[Record]:
+        data, offset, ticks = self._data, _FILE_HEADER.size, 0
+        end = len(data)
+
+        while offset + _RECORD.size <= end:
+            delta, connection, length = _RECORD.unpack_from(data, offset)
+            offset += _RECORD.size
+            # 录制中断时最后一条记录可能不完整
+            if offset + length > end:
+                return
+            ticks += delta
+            yield Record(ticks / 1e6, connection, data[offset:offset + length])
+            offset += length
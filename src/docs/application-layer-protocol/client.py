@@ -17,9 +17,9 @@ with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client:
         client.sendall(b'7e0102000573608155441500015091529468fe7e')
         client.sendall(b'7E010000307360802475620000000000004A435A4E53476574636861726D736D'
                        b'61727430303030303030433132303030300056494E0000000000000000A47E')
-        client.sendall(b'7E0102000573608024756200014900624645A47E')
-        client.sendall(b'7E0200001C73608024756200100000000000100003015834BA06C9D86B002000000124181219164655E27E')
-        client.sendall(b'7E000200007360802475620010E27E')
+        client.sendall(b'7E01020005736080247562000149006246458F7E')
+        client.sendall(b'7E0200001C73608024756200100000000000100003015834BA06C9D86B002000000124181219164655057E')
+        client.sendall(b'7E000200007360802475620010B27E')
 
         # Receive data from the server and shut down
         received = client.recv(1024)
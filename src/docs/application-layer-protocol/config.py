@@ -6,3 +6,11 @@ LastEditTime: 2021.11.15 13:59
 '''
 TCP_HOST = 'localhost'
 TCP_PORT = 12342
+TCP_MAX_CONNECTIONS = 20000
+TCP_TRANSPORT = 'hex'
+LOCATION_STORE = None
+# 一次读取产生的应答攒到这么多字节时提前写出
+TCP_FLUSH_THRESHOLD = 1 << 16
+# 处理函数放到工作线程时的队列容量，为 0 时在读取数据的线程中直接处理
+PIPELINE_CAPACITY = 0
+METRICS_PORT = 12343
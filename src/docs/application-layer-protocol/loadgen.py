@@ -0,0 +1,194 @@
+'''
+Date: 2026.10.18 13:03
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:03
+'''
+import argparse
+import asyncio
+import random
+import struct
+import time
+from binascii import hexlify
+from datetime import datetime
+
+import config
+import transcode
+from protocol import ClientMethod, Header, Location, Parser, ServerMethod
+from transport import TRANSPORTS
+
+_REGISTER_BODY = struct.pack('>2H5s20s7sB', 44, 300, b'LOADG', b'loadgen', b'0000001', 1) + b'TEST'
+_AUTHENTICATION_BODY = b'0123456789'
+_ACK = struct.Struct('>2HB')
+_REGISTER_ACK = struct.Struct('>HB')
+
+
+class ReplyParser(Parser):
+    '''复用 Parser 的分帧，把应答交给模拟终端校验'''
+
+    def __init__(self, terminal: 'Terminal'):
+        super().__init__(send=lambda data: None, hex_encoded=terminal.hex_encoded)
+        self._terminal = terminal
+
+    def _handle(self, packet: bytearray):
+        header, body = self.decode(packet)
+        self._terminal.on_reply(header, body)
+
+
+class Terminal(object):
+
+    def __init__(self, imei: str, stats: 'Stats', hex_encoded: bool, rng: random.Random):
+        self.imei = imei
+        self.hex_encoded = hex_encoded
+        self._stats = stats
+        self.rng = rng
+        self._serial = rng.randrange(0x10000)
+        self._pending = {}
+        self._latitude = rng.uniform(22.4, 22.8)
+        self._longitude = rng.uniform(113.8, 114.4)
+
+    def body(self, method: int) -> bytes:
+        if method == ClientMethod.REGISTER:
+            return _REGISTER_BODY
+        if method == ClientMethod.AUTHENTICATION:
+            return _AUTHENTICATION_BODY
+        if method == ClientMethod.LOCATION_REPORT:
+            self._latitude += self.rng.uniform(-0.0005, 0.0005)
+            self._longitude += self.rng.uniform(-0.0005, 0.0005)
+            return Location(0, 0x0c0003, round(self._latitude, 6), round(self._longitude, 6),
+                            30, self.rng.randrange(1200), self.rng.randrange(360),
+                            datetime.now().replace(microsecond=0)).marshal()
+        return b''
+
+    def frame(self, method: int) -> bytes:
+        self._serial = (self._serial + 1) & 0xffff
+        body = self.body(method)
+        frame = transcode.pack(Header(method, len(body), self.imei, self._serial).marshal() + body)
+        self._pending[self._serial] = (method, time.perf_counter())
+        return hexlify(frame) if self.hex_encoded else bytes(frame)
+
+    def on_reply(self, header: Header, body: memoryview):
+        stats = self._stats
+
+        if header is None or header.IMEI != self.imei:
+            stats.errors += 1
+            return
+
+        if header.METHOD == ServerMethod.COMMON and len(body) >= _ACK.size:
+            serial, method, result = _ACK.unpack_from(body)
+        elif header.METHOD == ServerMethod.REGISTER and len(body) >= _REGISTER_ACK.size:
+            (serial, result), method = _REGISTER_ACK.unpack_from(body), ClientMethod.REGISTER
+        else:
+            stats.errors += 1
+            return
+
+        pending = self._pending.pop(serial, None)
+        if pending is None or pending[0] != method or result != 0:
+            stats.errors += 1
+            return
+
+        stats.latencies.append(time.perf_counter() - pending[1])
+
+    @property
+    def outstanding(self) -> int:
+        return len(self._pending)
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.sent = 0
+        self.errors = 0
+        self.latencies = []
+
+    def report(self, elapsed: float, outstanding: int):
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return float('nan')
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        print(f'sent {self.sent}, replied {len(latencies)}, errors {self.errors}, '
+              f'unanswered {outstanding}')
+        print(f'throughput {len(latencies) / elapsed:,.0f} msg/s over {elapsed:.1f}s')
+        print(f'latency p50 {percentile(0.5):.2f} ms, p99 {percentile(0.99):.2f} ms, '
+              f'p999 {percentile(0.999):.2f} ms, max {percentile(1.0):.2f} ms')
+
+
+async def simulate(terminal: Terminal, args, stats: Stats, methods, weights, start: float):
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    decoder = TRANSPORTS[args.transport](ReplyParser(terminal).put)
+
+    async def receive():
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            decoder.feed(data)
+
+    receiver = asyncio.create_task(receive())
+
+    # 开环发送，每个终端按 rate / terminals 的频率均匀错开
+    interval = args.terminals / args.rate
+    moment = start + terminal.rng.uniform(0, interval)
+    deadline = start + args.duration
+
+    writer.write(terminal.frame(ClientMethod.REGISTER))
+    writer.write(terminal.frame(ClientMethod.AUTHENTICATION))
+    stats.sent += 2
+
+    while moment < deadline:
+        delay = moment - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        writer.write(terminal.frame(terminal.rng.choices(methods, weights)[0]))
+        stats.sent += 1
+        moment += interval
+        await writer.drain()
+
+    # 等待最后一批应答
+    await asyncio.sleep(args.linger)
+    receiver.cancel()
+    writer.close()
+
+
+def parse_mix(text: str):
+    methods, weights = [], []
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        methods.append(ClientMethod[name.strip().upper()])
+        weights.append(float(weight or 1))
+    return methods, weights
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    stats = Stats()
+    methods, weights = parse_mix(args.mix)
+
+    base = rng.getrandbits(40) << 8
+    terminals = [Terminal(f'{base + i:012x}', stats, TRANSPORTS[args.transport].hex_encoded,
+                          random.Random(rng.getrandbits(64))) for i in range(args.terminals)]
+
+    start = time.perf_counter() + 1
+    await asyncio.gather(*(simulate(terminal, args, stats, methods, weights, start)
+                           for terminal in terminals))
+
+    stats.report(args.duration, sum(terminal.outstanding for terminal in terminals))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='simulate a fleet of terminals against server.py')
+    parser.add_argument('--host', default=config.TCP_HOST)
+    parser.add_argument('--port', type=int, default=config.TCP_PORT)
+    parser.add_argument('--transport', choices=TRANSPORTS, default=config.TCP_TRANSPORT)
+    parser.add_argument('--terminals', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=1000, help='messages per second, all terminals')
+    parser.add_argument('--duration', type=float, default=10, help='seconds')
+    parser.add_argument('--linger', type=float, default=2, help='seconds to wait for late replies')
+    parser.add_argument('--mix', default='location_report=8,heartbeat=2',
+                        help='comma separated method=weight, e.g. register=1,heartbeat=5')
+    parser.add_argument('--seed', type=int, default=808)
+
+    asyncio.run(main(parser.parse_args()))
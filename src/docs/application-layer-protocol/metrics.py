@@ -0,0 +1,214 @@
+'''
+Date: 2026.10.18 13:17
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 14:10
+'''
+from typing import Dict, Iterator, List, Tuple
+
+from protocol import ClientMethod
+
+# 每个 2 的幂区间再分成 2 ** (_SUB_BITS - 1) 个子桶，相对误差不超过 1 / 2 ** (_SUB_BITS - 1)
+_SUB_BITS = 6
+_SUB_MASK = (1 << _SUB_BITS) - 1
+
+# 每个消息 ID 的计数器下标
+FRAMES, BYTES, CHECKSUM_FAILURES, MALFORMED, ESCAPES = range(5)
+_COUNTERS = ('frames', 'bytes', 'checksum_failures', 'malformed', 'escapes')
+
+# 耗时攒够这么多个才写入直方图，批量写入省掉了逐个 record 的调用开销
+_BATCH = 1024
+
+
+class Histogram(object):
+    '''HDR 风格的对数线性直方图，记录非负整数，常数时间记录，内存固定'''
+
+    def __init__(self, bits: int = 40):
+        # bits 为能记录的最大值的位数，纳秒为单位时 40 位约 18 分钟
+        self.bits = bits
+        self.counts = [0] * ((bits - _SUB_BITS + 2) << _SUB_BITS)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @staticmethod
+    def _index(value: int) -> int:
+        shift = value.bit_length() - _SUB_BITS
+        if shift <= 0:
+            return value
+        return shift << _SUB_BITS | value >> shift
+
+    @staticmethod
+    def _lowest(index: int) -> int:
+        shift = index >> _SUB_BITS
+        return (index & _SUB_MASK) << shift
+
+    def record(self, value: int):
+        shift = value.bit_length() - _SUB_BITS
+        if shift <= 0:
+            self.counts[value] += 1
+        elif value >> self.bits:
+            value = (1 << self.bits) - 1
+            self.counts[self._index(value)] += 1
+        else:
+            self.counts[shift << _SUB_BITS | value >> shift] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def record_many(self, values: List[int]):
+        '''与逐个 record 结果相同，循环内只剩下标计算，每个值的开销约为 record 的三分之一'''
+        if not values:
+            return
+        highest = max(values)
+        if highest >> self.bits:
+            values = [min(value, (1 << self.bits) - 1) for value in values]
+            highest = (1 << self.bits) - 1
+
+        counts = self.counts
+        for value in values:
+            shift = value.bit_length() - _SUB_BITS
+            if shift <= 0:
+                counts[value] += 1
+            else:
+                counts[shift << _SUB_BITS | value >> shift] += 1
+        self.count += len(values)
+        self.total += sum(values)
+        if highest > self.max:
+            self.max = highest
+
+    def merge(self, other: 'Histogram'):
+        counts = self.counts
+        for i, count in enumerate(other.counts):
+            if count:
+                counts[i] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = self.total = self.max = 0
+
+    def percentile(self, p: float) -> int:
+        '''返回第 p 分位所在桶的下界，p 取 0 到 100'''
+        if not self.count:
+            return 0
+        target = max(1, -(-self.count * p // 100))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._lowest(i), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def buckets(self) -> Iterator[Tuple[int, int]]:
+        '''非空桶的 (下界, 计数)'''
+        for i, count in enumerate(self.counts):
+            if count:
+                yield self._lowest(i), count
+
+
+class Metrics(object):
+    '''网关 Parser 的热路径指标
+
+    Parser 只有在传入 metrics 时才换用带计时的处理函数，不传时没有任何额外开销。
+    多个连接共用一份，事件循环是单线程的，计数不需要加锁。
+    计数器逐帧累加；耗时每 sample 帧只取一帧，攒够 _BATCH 个再批量写入直方图，
+    读取直方图前先调用 commit。直方图的 count 和 total 因此只覆盖被采样的帧
+    '''
+
+    def __init__(self, sample: int = 8):
+        self.counters: Dict[int, List[int]] = {}
+        self.parse = Histogram()
+        self.reply = Histogram()
+        self.sample = sample
+        # 距下一个计时的帧还有几帧，由 Parser 递减
+        self.countdown = 1
+        self._parse: List[int] = []
+        self._reply: List[int] = []
+
+    def _counter(self, method: int) -> List[int]:
+        counter = self.counters.get(method)
+        if counter is None:
+            counter = self.counters[method] = [0] * len(_COUNTERS)
+        return counter
+
+    def frame(self, method: int, size: int, escapes: int):
+        counter = self.counters.get(method) or self._counter(method)
+        counter[FRAMES] += 1
+        counter[BYTES] += size
+        counter[ESCAPES] += escapes
+
+    def timing(self, parse: int, reply: int):
+        pending = self._parse
+        pending.append(parse)
+        self._reply.append(reply)
+        if len(pending) >= _BATCH:
+            self.commit()
+
+    def commit(self):
+        if self._parse:
+            self.parse.record_many(self._parse)
+            self.reply.record_many(self._reply)
+            self._parse.clear()
+            self._reply.clear()
+
+    def malformed(self, method: int):
+        '''校验码正确但消息体无法解码，由 Dispatcher 调用'''
+        self._counter(method)[MALFORMED] += 1
+
+    def invalid(self, packet: bytearray, checksum: bool):
+        # 校验失败时消息 ID 不一定可信，仍按前两个字节归类，便于定位出问题的终端型号
+        method = int.from_bytes(packet[:2], 'big') if len(packet) >= 2 else 0
+        counter = self._counter(method)
+        counter[BYTES] += len(packet) + 2
+        counter[CHECKSUM_FAILURES if checksum else MALFORMED] += 1
+
+    def reset(self):
+        self.counters.clear()
+        self._parse.clear()
+        self._reply.clear()
+        self.parse.reset()
+        self.reply.reset()
+
+    def render(self) -> str:
+        '''Prometheus 文本格式，延迟单位为秒'''
+        self.commit()
+        lines = []
+        for name in _COUNTERS:
+            lines.append(f'# TYPE gateway_{name}_total counter')
+            for method, counter in sorted(self.counters.items()):
+                lines.append(f'gateway_{name}_total{{method="{_name(method)}"}} {counter[_COUNTERS.index(name)]}')
+
+        for name, histogram in (('parse', self.parse), ('reply', self.reply)):
+            metric = f'gateway_{name}_seconds'
+            lines.append(f'# TYPE {metric} summary')
+            for quantile in (50, 90, 99, 99.9, 100):
+                lines.append(f'{metric}{{quantile="{quantile / 100:g}"}} '
+                             f'{histogram.percentile(quantile) / 1e9:.9f}')
+            lines.append(f'{metric}_sum {histogram.total / 1e9:.9f}')
+            lines.append(f'{metric}_count {histogram.count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        '''一行摘要，用于定期写日志'''
+        self.commit()
+        frames = sum(counter[FRAMES] for counter in self.counters.values())
+        failures = sum(counter[CHECKSUM_FAILURES] + counter[MALFORMED] for counter in self.counters.values())
+        return (f'{frames} frames, {failures} invalid, '
+                f'parse p50 {self.parse.percentile(50) / 1e3:.1f} us p99 {self.parse.percentile(99) / 1e3:.1f} us, '
+                f'reply p50 {self.reply.percentile(50) / 1e3:.1f} us p99 {self.reply.percentile(99) / 1e3:.1f} us')
+
+
+def _name(method: int) -> str:
+    try:
+        return ClientMethod(method).name.lower()
+    except ValueError:
+        return f'0x{method:04x}'
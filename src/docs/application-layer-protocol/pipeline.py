@@ -0,0 +1,145 @@
+'''
+Date: 2026.10.18 13:15
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:15
+'''
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Set
+
+from protocol import Dispatcher, Header
+
+
+class Pipeline(object):
+    '''把分发表的处理函数挪到工作线程中执行，网络读取只负责分帧和应答
+
+    接口与 Dispatcher.dispatch 相同，可以直接作为 Parser 的 dispatcher。
+    同一终端的消息总是交给同一个工作线程，保证按到达顺序处理；
+    处理函数之间如果共享状态，需要自行加锁或者只用一个工作线程。
+
+    队列中的消息达到 capacity 条时暂停读取新数据的连接，回落到 low 条以下再恢复。
+    暂停发生在一次读取处理完之后，所以每个连接最多还能多放入一次读取所含的消息
+    '''
+
+    def __init__(self, dispatcher: Dispatcher, workers: int = 1, capacity: int = 1 << 14,
+                 low: int = None, samples: int = 1 << 14):
+        self.capacity = capacity
+        self.low = capacity // 2 if low is None else low
+
+        self._dispatcher = dispatcher
+        self._queues = [queue.SimpleQueue() for _ in range(workers)]
+        self._lock = threading.Lock()
+        self._loop = None
+        self._paused: Set[asyncio.Transport] = set()
+        self._resuming = False
+
+        # 入队计数只在事件循环线程中修改，完成计数只在持锁时修改
+        self.enqueued = 0
+        self.processed = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.pauses = 0
+        # 最近 samples 条消息从入队到处理完成的耗时
+        self.latencies = deque(maxlen=samples)
+
+        self._threads = [threading.Thread(target=self._work, args=(q,), daemon=True)
+                         for q in self._queues]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def depth(self) -> int:
+        return self.enqueued - self.processed
+
+    @property
+    def full(self) -> bool:
+        return self.enqueued - self.processed >= self.capacity
+
+    def dispatch(self, header: Header, body: memoryview):
+        # body 引用的是 transcode.unpack 新建的 bytes，Parser 不会复用，可以直接交给其他线程
+        index = hash(header.IMEI) % len(self._queues) if len(self._queues) > 1 else 0
+        self._queues[index].put((time.perf_counter(), header, body))
+        self.enqueued += 1
+
+        depth = self.enqueued - self.processed
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def pause(self, transport: asyncio.Transport):
+        '''在事件循环线程中调用，队列已满时暂停该连接的读取'''
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        if transport not in self._paused and not transport.is_closing():
+            transport.pause_reading()
+            self._paused.add(transport)
+            self.pauses += 1
+            # 工作线程可能在加入之前就已经把队列处理完，不会再来唤醒
+            if self.depth <= self.low:
+                self._resume()
+
+    def forget(self, transport: asyncio.Transport):
+        self._paused.discard(transport)
+
+    def _resume(self):
+        self._resuming = False
+        if self.depth > self.low:
+            return
+        for transport in self._paused:
+            if not transport.is_closing():
+                transport.resume_reading()
+        self._paused.clear()
+
+    def _work(self, messages: queue.SimpleQueue):
+        dispatch, latencies = self._dispatcher.dispatch, self.latencies
+
+        while True:
+            item = messages.get()
+            if item is None:
+                return
+
+            enqueued, header, body = item
+            try:
+                dispatch(header, body)
+            except Exception:
+                self.errors += 1
+            latencies.append(time.perf_counter() - enqueued)
+
+            with self._lock:
+                self.processed += 1
+                resume = (self._paused and not self._resuming
+                          and self.enqueued - self.processed <= self.low)
+                if resume:
+                    self._resuming = True
+            if resume:
+                self._loop.call_soon_threadsafe(self._resume)
+
+    def stats(self) -> Dict[str, Any]:
+        latencies: List[float] = sorted(self.latencies)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        return {
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'processed': self.processed,
+            'errors': self.errors,
+            'pauses': self.pauses,
+            'paused': len(self._paused),
+            'p50_ms': percentile(0.5),
+            'p99_ms': percentile(0.99),
+            'max_ms': percentile(1.0),
+        }
+
+    def close(self, timeout: float = None):
+        '''等待队列中剩余的消息处理完，再停止工作线程'''
+        for messages in self._queues:
+            messages.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
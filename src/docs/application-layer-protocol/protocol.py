@@ -6,11 +6,78 @@ LastEditTime: 2021.11.13 17:27
 '''
 import socket
 import struct
-from datetime import datetime
+import time
+from binascii import hexlify
+from datetime import datetime, timedelta
 from enum import IntEnum
-from functools import reduce
-from operator import xor
-from typing import NamedTuple, Tuple
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import schema
+import transcode
+
+_REGISTER_RESPONSE = struct.Struct('>2H6sHHBL')
+_COMMON_RESPONSE = struct.Struct('>2H6sH2HB')
+_SERIAL = struct.Struct('>2H')
+# 分包消息的总包数和包序号
+_PACKAGE = struct.Struct('>2H')
+
+# 消息体属性第 13 位为分包标志，置位时消息头后多出总包数和包序号各 2 字节
+SUBPACKAGE = 1 << 13
+
+# 终端上报的时间为 GMT+8
+UTC_OFFSET = 8 * 3600
+_EPOCH = datetime(1970, 1, 1) + timedelta(seconds=UTC_OFFSET)
+_SECOND = timedelta(seconds=1)
+
+# 单字节 BCD 码到数值的映射表，供 bytes.translate 使用
+_BCD = bytes((b >> 4) * 10 + (b & 0x0f) if b < 0xa0 and b & 0x0f < 10 else 0xff for b in range(256))
+
+
+def _bcd_fields(raw: bytes) -> Tuple[int, int, int, int, int, int]:
+    yy, month, day, hour, minute, second = raw.translate(_BCD)
+    if 0xff in (yy, month, day, hour, minute, second):
+        raise ValueError(f'invalid BCD time {raw.hex()!r}')
+    # 与 strptime 的 %y 保持一致
+    return yy + (2000 if yy < 69 else 1900), month, day, hour, minute, second
+
+
+@lru_cache(maxsize=64)
+def bcd_to_datetime(raw: bytes) -> datetime:
+    return datetime(*_bcd_fields(raw))
+
+
+@lru_cache(maxsize=64)
+def bcd_to_epoch(raw: bytes) -> int:
+    return (bcd_to_datetime(raw) - _EPOCH) // _SECOND
+
+
+def datetime_to_bcd(moment: Union[datetime, int]) -> bytes:
+    if isinstance(moment, int):
+        moment = _EPOCH + timedelta(seconds=moment)
+    return bytes((v // 10) << 4 | v % 10 for v in (moment.year % 100, moment.month, moment.day,
+                                                   moment.hour, moment.minute, moment.second))
+
+
+def _bcd_to_datetime64(raw):
+    import numpy as np
+
+    if ((raw >> 4) > 9).any() or ((raw & 0x0f) > 9).any():
+        raise ValueError('invalid BCD time')
+
+    yy, month, day, hour, minute, second = ((raw >> 4) * 10 + (raw & 0x0f)).astype(np.int64).T
+    if ((month < 1) | (month > 12) | (day < 1) |
+            (hour > 23) | (minute > 59) | (second > 59)).any():
+        raise ValueError('invalid BCD time')
+
+    year = yy + np.where(yy < 69, 2000, 1900)
+    months = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    first = months.astype('datetime64[D]')
+    # 与 datetime 一样按当月实际天数校验，闰年的 2 月 29 日合法
+    if (day > ((months + 1).astype('datetime64[D]') - first).astype(np.int64)).any():
+        raise ValueError('invalid BCD time')
+
+    return (first + (day - 1)).astype('datetime64[s]') + (hour * 3600 + minute * 60 + second)
 
 
 class State(IntEnum):
@@ -39,22 +106,22 @@ class ServerMethod(IntEnum):
     LOCATION_QUERY = 0x8201
 
 
+@schema.message(METHOD=schema.U16, LENGTH=schema.U16, IMEI=schema.Hex(6), NUMBER=schema.U16)
 class Header(NamedTuple):
     METHOD: int
     LENGTH: int
     IMEI: str
     NUMBER: int
 
-    def marshal(self) -> bytes:
-        return struct.pack('>2H6BH', self.METHOD, self.LENGTH,
-                           *bytes.fromhex(self.IMEI), self.NUMBER)
-
-    @staticmethod
-    def unmarshal(header: bytes) -> 'Header':
-        obj = struct.unpack('>2H6BH', header)
-        return Header(obj[0], obj[1], bytearray(obj[2:8]).hex(), obj[8])
-
 
+# 经纬度以百万分之一度为单位，时间为 GMT+8 的 BCD 码，unmarshal(epoch=True) 时解码为时间戳
+@schema.message(
+    ALARM_SIGN=schema.U32, STATE=schema.U32,
+    LATITUDE=schema.Scaled(schema.U32, 1000000), LONGITUDE=schema.Scaled(schema.U32, 1000000),
+    ALTITUDE=schema.U16, SPEED=schema.U16, DIRECTION=schema.U16,
+    DATETIME=schema.Converted(schema.Bytes(6), bcd_to_datetime, datetime_to_bcd),
+    variants={'epoch': {'DATETIME': schema.Converted(schema.Bytes(6), bcd_to_epoch, datetime_to_bcd)}},
+)
 class Location(NamedTuple):
     ALARM_SIGN: int
     STATE: int
@@ -63,105 +130,363 @@ class Location(NamedTuple):
     ALTITUDE: int
     SPEED: int
     DIRECTION: int
-    DATETIME: datetime
+    DATETIME: Union[datetime, int]
 
     @staticmethod
-    def unmarshal(location: bytes) -> 'Location':
-        obj = struct.unpack('>4L3H6B', location)
-        return Location(obj[0], obj[1], obj[2] / 1000000, obj[3] / 1000000, obj[4], obj[5], obj[6],
-                        datetime.strptime(bytearray(obj[7:]).hex(), '%y%m%d%H%M%S'))
+    def unmarshal_batch(locations, offsets=None, epoch: bool = False, columnar: bool = False):
+        '''批量解码位置信息，返回 NumPy 结构化数组，columnar 为真时返回按列的字典
+
+        locations 为消息体列表，或者一整块缓冲区加上每条消息体的起始偏移 offsets
+        '''
+        import numpy as np
+
+        raw_dtype = np.dtype([
+            ('ALARM_SIGN', '>u4'), ('STATE', '>u4'), ('LATITUDE', '>u4'), ('LONGITUDE', '>u4'),
+            ('ALTITUDE', '>u2'), ('SPEED', '>u2'), ('DIRECTION', '>u2'), ('DATETIME', 'u1', (6,)),
+        ])
+
+        if offsets is None:
+            lengths = np.fromiter(map(len, locations), dtype=np.intp, count=len(locations))
+            if (lengths < _LOCATION.size).any():
+                raise struct.error(f'unpack_from requires a buffer of at least {_LOCATION.size} bytes')
+            offsets = np.cumsum(lengths) - lengths
+            locations = b''.join(locations)
+
+        offsets = np.asarray(offsets, dtype=np.intp)
+        buffer = np.frombuffer(locations, dtype=np.uint8)
+        raw = buffer[offsets[:, None] + np.arange(_LOCATION.size)].view(raw_dtype).reshape(-1)
+
+        stamps = _bcd_to_datetime64(raw['DATETIME'])
+        columns = {
+            'ALARM_SIGN': raw['ALARM_SIGN'].astype(np.uint32),
+            'STATE': raw['STATE'].astype(np.uint32),
+            'LATITUDE': raw['LATITUDE'] / 1000000,
+            'LONGITUDE': raw['LONGITUDE'] / 1000000,
+            'ALTITUDE': raw['ALTITUDE'].astype(np.uint16),
+            'SPEED': raw['SPEED'].astype(np.uint16),
+            'DIRECTION': raw['DIRECTION'].astype(np.uint16),
+            'DATETIME': stamps.astype(np.int64) - UTC_OFFSET if epoch else stamps,
+        }
+
+        if columnar:
+            return columns
+
+        result = np.empty(len(raw), dtype=[(name, column.dtype) for name, column in columns.items()])
+        for name, column in columns.items():
+            result[name] = column
+        return result
+
+
+_HEADER = Header.schema.struct
+_LOCATION = Location.schema.struct
+
+Handler = Callable[[Header, Any], Any]
+
+
+class Dispatcher(object):
+    '''按消息 ID 查表分发的处理函数注册表
+
+    每个处理函数注册时声明是否需要解码后的消息体，同一消息只解码一次，
+    没有处理函数或者处理函数都不需要消息体时跳过解码，未注册的消息只做通用应答。
+
+    校验码正确但消息体无法解码的消息计入 malformed（传入 metrics 时同时计入该消息 ID 的
+    malformed 计数器），处理函数抛出的异常计入 errors，都不会向上打断连接的读取，
+    Parser 照常应答
+    '''
+
+    # 消息 ID 到消息体解码函数的映射
+    decoders: Dict[int, Callable[[memoryview], Any]] = {
+        ClientMethod.LOCATION_REPORT: Location.unmarshal,
+    }
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.malformed = 0
+        self.errors = 0
+        self._handlers: Dict[int, List[Tuple[Handler, bool]]] = {}
+        # 消息 ID -> (解码函数或 None, ((处理函数, 是否传入解码结果), ...))
+        self._table: Dict[int, Tuple[Optional[Callable], Tuple[Tuple[Handler, bool], ...]]] = {}
+
+    def register(self, method: int, handler: Handler = None, decode: bool = False):
+        '''注册 handler(header, body)，decode 为真时 body 为解码后的对象，否则为原始 memoryview
+
+        省略 handler 时可作为装饰器使用
+        '''
+        if handler is None:
+            return lambda function: self.register(method, function, decode)
+
+        if decode and method not in self.decoders:
+            raise ValueError(f'no decoder for method 0x{method:04x}')
+
+        handlers = self._handlers.setdefault(method, [])
+        handlers.append((handler, decode))
+
+        decoder = self.decoders[method] if any(flag for _, flag in handlers) else None
+        self._table[method] = decoder, tuple(handlers)
+
+        return handler
+
+    def resolve(self, method: int) -> Optional[Tuple[Optional[Callable], Tuple[Tuple[Handler, bool], ...]]]:
+        return self._table.get(method)
+
+    def dispatch(self, header: Header, body: memoryview):
+        entry = self._table.get(header.METHOD)
+        if entry is None:
+            return
+
+        decoder, handlers = entry
+        message = None
+        if decoder is not None:
+            try:
+                message = decoder(body)
+            except (struct.error, ValueError):
+                # 消息体过短或者 BCD 时间非法，这条消息不再交给任何处理函数
+                self.malformed += 1
+                if self.metrics is not None:
+                    self.metrics.malformed(header.METHOD)
+                return
+
+        for handler, decoded in handlers:
+            try:
+                handler(header, message if decoded else body)
+            except Exception:
+                self.errors += 1
+
+
+# 不指定注册表时使用，保持打印位置信息的旧行为
+DISPATCHER = Dispatcher()
+DISPATCHER.register(ClientMethod.LOCATION_REPORT, lambda header, location: print(location), decode=True)
 
 
 class Parser(object):
-    _escape = (
-        (bytearray([0x7d]), bytearray([0x7d, 0x01])),
-        (bytearray([0x7e]), bytearray([0x7d, 0x02])),
-    )
 
-    def __init__(self, client: socket.socket):
+    def __init__(self, client: socket.socket = None, send: Callable[[bytes], Any] = None,
+                 hex_encoded: bool = True, dispatcher: Dispatcher = None,
+                 writev: Callable[[List[bytes]], Any] = None, flush_threshold: int = 1 << 16,
+                 metrics=None, reassembler=None):
         self._client = client
+        self._send = send or client.sendall
+        # 一次写出多段应答。asyncio 传输层传入 writelines，Python 3.12 起用 sendmsg 直接写出各段，
+        # 之前的版本先 join 成一段再 send，多一次拷贝，但同样只有一次系统调用；
+        # 直接使用套接字时用 sendmsg
+        if writev is None and send is None and hasattr(client, 'sendmsg'):
+            writev = self._sendmsg
+        self._writev = writev
+        self._hex_encoded = hex_encoded
+        # 多个连接共用一份注册表
+        self._dispatch = (dispatcher or DISPATCHER).dispatch
         self._packet = bytearray()
         self._state = State.STOP
-        self._table = {
-            State.START: [State.START, State.STOP, State.ESCAPE, State.CONTINUE],
-            State.STOP: [State.START, State.STOP, State.STOP, State.STOP],
-            State.ESCAPE: [State.CONTINUE, State.CONTINUE, State.CONTINUE, State.CONTINUE],
-            State.CONTINUE: [State.START, State.STOP, State.ESCAPE, State.CONTINUE],
-        }
+        self.frames = 0
+
+        # 一次 put 产生的应答攒到一起写出，超过 flush_threshold 字节时提前写出，为 0 时逐条写出
+        self.flush_threshold = flush_threshold
+        self._replies: List[bytes] = []
+        self._pending = 0
+
+        # metrics.Metrics，只有启用时才换成带计时的处理函数，未启用时热路径上没有任何判断
+        self._metrics = metrics
+        if metrics is not None:
+            self._handle = self._measured
+
+        # reassembly.Reassembler，多个连接共用时总内存上限对所有终端生效，不传时收到分包再创建
+        self._reassembler = reassembler
+
+    def _sendmsg(self, buffers: List[bytes]):
+        sent = self._client.sendmsg(buffers)
+        if sent < sum(map(len, buffers)):
+            self._client.sendall(b''.join(buffers)[sent:])
+
+    def flush(self):
+        replies = self._replies
+        if not replies:
+            return
+
+        self._replies, self._pending = [], 0
+        if len(replies) == 1:
+            self._send(replies[0])
+        elif self._writev is not None:
+            self._writev(replies)
+        else:
+            self._send(b''.join(replies))
+
+    def _escaped(self) -> bool:
+        # 包尾连续 0x7d 的个数为奇数时，下一个字节属于转义序列
+        packet = self._packet
+        if not packet or packet[-1] != Symbol.ESCAPE:
+            return False
+        return (len(packet) - len(packet.rstrip(b'\x7d'))) & 1 == 1
+
+    def _reply(self, header: Header):
+        reply = self.respond(header, self._hex_encoded)
+        self._replies.append(reply)
+        self._pending += len(reply)
+        if self._pending >= self.flush_threshold:
+            self.flush()
+
+    def _segment(self, header: Header, body: memoryview):
+        '''每个分包都单独应答，收齐后再按完整消息分发'''
+        if len(body) < _PACKAGE.size:
+            return
+
+        if self._reassembler is None:
+            from reassembly import Reassembler
+            self._reassembler = Reassembler()
+
+        total, index = _PACKAGE.unpack_from(body)
+        message = self._reassembler.add(header, total, index, body[_PACKAGE.size:])
+        if message is not None:
+            self._dispatch(*message)
+        self._reply(header)
+
+    def _handle(self, packet: bytearray):
+        header, body = self.decode(packet)
+        if header is None:
+            return
+
+        if header.LENGTH & SUBPACKAGE:
+            self._segment(header, body)
+            return
+
+        self._dispatch(header, body)
+
+        # 与 _reply 相同，热路径上展开以省掉一次方法调用
+        reply = self.respond(header, self._hex_encoded)
+        self._replies.append(reply)
+        self._pending += len(reply)
+        if self._pending >= self.flush_threshold:
+            self.flush()
+
+    def _measured(self, packet: bytearray):
+        # 计数器逐帧累加，计时每 metrics.sample 帧取一帧，四次取时钟是启用指标后最大的开销
+        metrics = self._metrics
+        metrics.countdown -= 1
+        timed = not metrics.countdown
+        if timed:
+            metrics.countdown = metrics.sample
+            clock = time.perf_counter_ns
+            start = clock()
+
+        header, body = self.decode(packet)
+        if header is None:
+            metrics.invalid(packet, transcode.unpack(packet) is None)
+            return
+        if timed:
+            parsed = clock()
+
+        if header.LENGTH & SUBPACKAGE:
+            # 分包的应答时间里包含了重组和分发
+            self._segment(header, body)
+            if timed:
+                dispatched = parsed
+        else:
+            self._dispatch(header, body)
+            if timed:
+                dispatched = clock()
+            self._reply(header)
 
-    def _get_index(self, symbol):
-        if Symbol.START != Symbol.STOP:
-            return {
-                Symbol.START: 0,
-                Symbol.STOP: 1,
-                Symbol.ESCAPE: 2,
-            }.get(symbol, 3)
-
-        if self._state != State.STOP:
-            return {
-                Symbol.STOP: 1,
-                Symbol.ESCAPE: 2,
-            }.get(symbol, 3)
-
-        if self._state != State.START:
-            return {
-                Symbol.START: 0,
-                Symbol.ESCAPE: 2,
-            }.get(symbol, 3)
-
-    def _put(self, symbol: int):
-        self._state = self._table[self._state][self._get_index(symbol)]
-
-        if self._state == State.START:
-            self._packet.clear()
-        elif self._state == State.STOP:
-            if self._packet:
-                header, response, body = self.parse(self._packet)
+        # 转义后的长度减去消息头、消息体和校验码的长度即为转义多出的字节数
+        metrics.frame(header.METHOD, len(packet) + 2, len(packet) - _HEADER.size - len(body) - 1)
+        if timed:
+            metrics.timing(parsed - start, clock() - dispatched)
+
+    def put(self, symbols: bytes):
+        try:
+            self._put(symbols)
+        finally:
+            # 后面的帧出错时，前面已经攒下的应答也要发出去
+            if self._replies:
+                self.flush()
+
+    def _put(self, symbols: bytes):
+        view = memoryview(symbols)
+        i, n = 0, len(symbols)
+
+        while i < n:
+            j = symbols.find(Symbol.STOP, i)
+
+            if self._state == State.STOP:
+                # 帧外的字节直接丢弃
+                if j < 0:
+                    return
+                self._packet.clear()
+                self._state = State.START
+                i = j + 1
+                continue
+
+            if j < 0:
+                self._packet += view[i:]
+                return
 
-                if header.METHOD == ClientMethod.LOCATION_REPORT:
-                    body = Location.unmarshal(body[:28])
-                    print(body)
+            self._packet += view[i:j]
+            i = j + 1
 
-                if response:
-                    self._client.sendall(self.combine(response))
+            if self._escaped():
+                self._packet.append(Symbol.STOP)
+                continue
 
+            self._state = State.STOP
+            if self._packet:
+                self.frames += 1
+                self._handle(self._packet)
                 self._packet.clear()
-        elif self._state >= State.ESCAPE:
-            self._packet.append(symbol)
 
-    def put(self, symbols: bytes):
-        for symbol in symbols:
-            self._put(symbol)
+    @staticmethod
+    def decode(packet: bytearray) -> Tuple[Header, memoryview]:
+        # 逆转义并校验，校验失败的消息不做应答
+        packet = transcode.unpack(packet)
+
+        if packet is None or len(packet) < _HEADER.size:
+            return None, memoryview(b'')
+
+        return Header.unmarshal(packet), memoryview(packet)[_HEADER.size:]
 
     @staticmethod
-    def parse(packet: bytearray) -> Tuple[Header, bytes, bytearray]:
-        # 逆转义
-        for key, value in Parser._escape:
-            packet = packet.replace(value, key)
+    def parse(packet: bytearray) -> Tuple[Header, bytes, memoryview]:
+        header, body = Parser.decode(packet)
+        if header is None:
+            return Header(0, 0, '', 0), b'', body
 
-        if len(packet) < 12:
-            return Header(0, 0, '', 0), b'', bytearray()
+        return header, Parser.response(header), body
 
-        header = Header.unmarshal(packet[0:12])
-        body = packet[12:]
+    @staticmethod
+    def response(header: Header) -> bytes:
+        imei = bytes.fromhex(header.IMEI)
+        # 6s 会把长度不对的 IMEI 截断或者补零，与改用 struct 之前一样直接报错
+        if len(imei) != 6:
+            raise struct.error(f'IMEI must be 6 bytes, got {header.IMEI!r}')
 
         if header.METHOD == ClientMethod.REGISTER:
-            response_body = struct.pack('>HBL', header.NUMBER, 0, 20211115)
-            response = Header(ServerMethod.REGISTER, len(response_body),
-                              header.IMEI, header.NUMBER).marshal() + response_body
-        else:
-            response_body = struct.pack('>2HB', header.NUMBER, header.METHOD, 0)
-            response = Header(ServerMethod.COMMON, len(response_body),
-                              header.IMEI, header.NUMBER).marshal() + response_body
+            return _REGISTER_RESPONSE.pack(ServerMethod.REGISTER, 7, imei, header.NUMBER,
+                                           header.NUMBER, 0, 20211115)
 
-        return header, response, body
+        return _COMMON_RESPONSE.pack(ServerMethod.COMMON, 5, imei, header.NUMBER,
+                                     header.NUMBER, header.METHOD, 0)
 
     @staticmethod
-    def combine(body: bytes) -> bytes:
-        body = bytearray([*body, reduce(xor, body)])
+    @lru_cache(maxsize=1 << 16)
+    def _template(method: int, imei: str) -> Tuple[bytes, bytes]:
+        # 应答中的两个流水号异或后相互抵消，校验码与流水号无关，可以和其余部分一起预先算好
+        response = Parser.response(Header(method, 0, imei, 0))
+        checksum = transcode.checksum(response)
+
+        prefix = transcode.escape(response[:_HEADER.size - 2])
+        suffix = transcode.escape(response[_HEADER.size + 2:] + bytes([checksum]))
+
+        return bytes([Symbol.START]) + prefix, suffix + bytes([Symbol.STOP])
+
+    @staticmethod
+    def respond(header: Header, hex_encoded: bool = True) -> bytes:
+        '''与 combine(response(header)) 的结果逐字节相同，hex_encoded 为假时返回未经十六进制编码的报文'''
+        prefix, suffix = Parser._template(header.METHOD, header.IMEI)
+
+        serial = _SERIAL.pack(header.NUMBER, header.NUMBER)
+        if Symbol.ESCAPE in serial or Symbol.START in serial:
+            serial = transcode.escape(serial)
 
-        # 转义
-        for key, value in Parser._escape:
-            body = body.replace(key, value)
+        frame = b''.join((prefix, serial, suffix))
+        return hexlify(frame) if hex_encoded else frame
 
-        return bytearray([Symbol.START, *body, Symbol.STOP]).hex().encode('ascii')
+    @staticmethod
+    def combine(body: bytes) -> bytes:
+        return hexlify(transcode.pack(body))
@@ -0,0 +1,258 @@
+'''
+Date: 2026.10.18 13:21
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 14:09
+'''
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from protocol import SUBPACKAGE, Header
+
+# 每条未完成消息除缓冲区外的固定开销：Pending 对象、消息头、键和字典项，按实测取整
+ENTRY_OVERHEAD = 512
+
+
+class Pending(object):
+    '''一条尚未收齐的分包消息
+
+    除最后一包外各包长度相同，收到第一个非末尾的分包后按 total * size 一次性分配缓冲区，
+    之后每包直接拷贝到自己的位置。长度不一致的分包退回按序号保存，收齐后拼接一次。
+    allocated 从一开始就计入 seen 的 total 字节和 ENTRY_OVERHEAD
+    '''
+
+    __slots__ = ('header', 'total', 'received', 'seen', 'size', 'buffer', 'last', 'segments',
+                 'created', 'allocated')
+
+    def __init__(self, header: Header, total: int, now: float):
+        self.header = header
+        self.total = total
+        self.received = 0
+        self.seen = bytearray(total)
+        self.size = 0
+        self.buffer = None
+        self.last = None
+        self.segments: Optional[Dict[int, bytes]] = None
+        self.created = now
+        self.allocated = total + ENTRY_OVERHEAD
+
+    def add(self, index: int, data: memoryview) -> int:
+        '''放入第 index 包，返回新增占用的字节数'''
+        self.seen[index - 1] = 1
+        self.received += 1
+        before = self.allocated
+
+        if self.segments is None:
+            if index == self.total:
+                if self.buffer is None:
+                    # 还不知道每包多长，先单独保存
+                    self.last = bytes(data)
+                    self.allocated += len(data)
+                elif len(data) <= self.size:
+                    offset = (index - 1) * self.size
+                    self.buffer[offset:offset + len(data)] = data
+                    self.last = len(data)
+                else:
+                    self._fallback(index)
+            elif self.buffer is None:
+                self.size = len(data)
+                self.buffer = bytearray(self.size * self.total)
+                self.allocated += len(self.buffer)
+                self.buffer[(index - 1) * self.size:index * self.size] = data
+                if self.last is not None:
+                    if len(self.last) <= self.size:
+                        offset = (self.total - 1) * self.size
+                        self.buffer[offset:offset + len(self.last)] = self.last
+                        self.allocated -= len(self.last)
+                        self.last = len(self.last)
+                    else:
+                        self._fallback()
+            elif len(data) == self.size:
+                self.buffer[(index - 1) * self.size:index * self.size] = data
+            else:
+                self._fallback(index)
+
+        if self.segments is not None and index not in self.segments:
+            self.segments[index] = bytes(data)
+            self.allocated += len(data)
+
+        return self.allocated - before
+
+    def _fallback(self, skip: int = None):
+        '''分包长度不一致，把已经放进缓冲区的分包拆出来按序号保存，skip 为尚未放入的分包'''
+        segments = {}
+        if self.buffer is not None:
+            for i in range(1, self.total):
+                if self.seen[i - 1] and i != skip:
+                    segments[i] = bytes(self.buffer[(i - 1) * self.size:i * self.size])
+            if isinstance(self.last, int):
+                offset = (self.total - 1) * self.size
+                segments[self.total] = bytes(self.buffer[offset:offset + self.last])
+        if isinstance(self.last, bytes):
+            segments[self.total] = self.last
+
+        self.segments = segments
+        self.buffer = None
+        self.last = None
+        self.allocated = self.total + ENTRY_OVERHEAD + sum(map(len, segments.values()))
+
+    def assemble(self) -> memoryview:
+        if self.segments is not None:
+            return memoryview(b''.join(self.segments[i] for i in range(1, self.total + 1)))
+        return memoryview(self.buffer)[:(self.total - 1) * self.size + self.last]
+
+
+class Reassembler(object):
+    '''分包消息重组，以 (IMEI, 消息 ID, 首包流水号) 为键
+
+    JT808 的各分包使用连续的流水号，首包流水号由当前流水号减去包序号推出。
+    超过 ttl 秒仍未收齐的消息被丢弃。所有未完成消息占用的内存（含每条的固定开销）不超过
+    capacity 字节，条数不超过 limit，超出时从最早开始的消息丢起；
+    单个终端最多同时有 per_terminal 条未完成消息，超出时新消息直接丢弃
+    '''
+
+    def __init__(self, capacity: int = 64 << 20, ttl: float = 60, history: int = 4096,
+                 limit: int = 4096, per_terminal: int = 8):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.history = history
+        self.limit = limit
+        self.per_terminal = per_terminal
+        self.allocated = 0
+        self._pending: 'OrderedDict[Tuple[str, int, int], Pending]' = OrderedDict()
+        # 每个终端未完成的消息数
+        self._terminals: Dict[str, int] = {}
+        # 最近收齐的消息，收齐后才到的重传分包不再重新开一个缓冲区
+        self._completed: 'OrderedDict[Tuple[str, int, int], None]' = OrderedDict()
+
+        self.completed = 0
+        self.expired = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.invalid = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, header: Header, total: int, index: int, data: memoryview,
+            now: float = None) -> Optional[Tuple[Header, memoryview]]:
+        '''放入一个分包，收齐时返回以首包流水号为准的消息头和完整消息体，否则返回 None'''
+        # 除末包外的空分包无法确定每包长度
+        if not 1 <= index <= total or (index < total and not data):
+            self.invalid += 1
+            return None
+
+        now = time.monotonic() if now is None else now
+        self.expire(now, limit=2)
+
+        serial = (header.NUMBER - index + 1) & 0xffff
+        key = header.IMEI, header.METHOD, serial
+        pending = self._pending.get(key)
+
+        if pending is None:
+            if key in self._completed:
+                self.duplicates += 1
+                return None
+            if total == 1:
+                self.completed += 1
+                return header._replace(LENGTH=header.LENGTH & ~SUBPACKAGE), data
+            if self._terminals.get(header.IMEI, 0) >= self.per_terminal:
+                self.dropped += 1
+                return None
+            if not self._admit(key, total, index, len(data), None):
+                return None
+            pending = self._pending[key] = Pending(
+                header._replace(LENGTH=header.LENGTH & ~SUBPACKAGE, NUMBER=serial), total, now)
+            self.allocated += pending.allocated
+            self._terminals[header.IMEI] = self._terminals.get(header.IMEI, 0) + 1
+        elif pending.total != total:
+            self.invalid += 1
+            return None
+        elif pending.seen[index - 1]:
+            # 终端重传
+            self.duplicates += 1
+            return None
+        elif not self._admit(key, total, index, len(data), pending):
+            return None
+
+        self.allocated += pending.add(index, data)
+
+        if pending.received == total:
+            self._drop(key)
+            self.completed += 1
+            self._completed[key] = None
+            if len(self._completed) > self.history:
+                self._completed.popitem(last=False)
+            return pending.header, pending.assemble()
+
+        if self.allocated > self.capacity:
+            self._shrink(key)
+        return None
+
+    def _drop(self, key: Tuple[str, int, int]) -> Pending:
+        pending = self._pending.pop(key)
+        self.allocated -= pending.allocated
+        count = self._terminals[key[0]] - 1
+        if count:
+            self._terminals[key[0]] = count
+        else:
+            del self._terminals[key[0]]
+        return pending
+
+    def _admit(self, key: Tuple[str, int, int], total: int, index: int, size: int,
+               pending: Optional[Pending]) -> bool:
+        '''分配内存之前检查上限
+
+        total 由终端填写，不可信。新消息要计入 seen、固定开销和第一次分配的缓冲区，
+        末包先到时按实际长度计；超过 capacity 的消息直接丢弃，不分配任何内存；
+        放得下时先丢弃最早的其他消息腾出空间，再分配
+        '''
+        if pending is None:
+            required = total + ENTRY_OVERHEAD + (size if index == total else size * total)
+            if len(self._pending) >= self.limit:
+                self._shrink(key, count=self.limit - 1)
+        elif pending.buffer is not None:
+            # 缓冲区已经分配，只会原地拷贝，长度不一致时退回按包保存由 add 之后的检查兜底
+            return True
+        elif pending.segments is not None:
+            required = size
+        else:
+            # 之前只收到末包，这次分配整块缓冲区
+            required = size * total
+
+        if required <= self.capacity - self.allocated:
+            return True
+
+        if required > self.capacity:
+            if pending is not None:
+                self._drop(key)
+            self.dropped += 1
+            return False
+
+        self._shrink(key, required)
+        # 当前消息已保存的末包也放不下时，当前消息同样被丢弃
+        return pending is None or key in self._pending
+
+    def _shrink(self, current: Tuple[str, int, int], required: int = 0, count: int = None):
+        # 优先丢弃最早的其他消息，只剩当前消息仍超出时连它一起丢弃
+        while self._pending and (self.allocated + required > self.capacity or
+                                 count is not None and len(self._pending) > count):
+            for key in self._pending:
+                if key != current:
+                    break
+            self._drop(key)
+            self.dropped += 1
+
+    def expire(self, now: float = None, limit: int = None) -> int:
+        '''丢弃超时的消息，按开始时间排序，只需检查队首'''
+        now = time.monotonic() if now is None else now
+        count = 0
+        while self._pending and (limit is None or count < limit):
+            key, pending = next(iter(self._pending.items()))
+            if now - pending.created < self.ttl:
+                break
+            self._drop(key)
+            count += 1
+        self.expired += count
+        return count
@@ -0,0 +1,128 @@
+'''
+Date: 2026.10.18 13:19
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 14:00
+'''
+import struct
+from typing import Any, Callable, Dict, NamedTuple, Union
+
+# 表达式模板中用 {} 代表字段的值，也可以直接给出转换函数
+Converter = Union[str, Callable[[Any], Any], None]
+
+
+class Field(NamedTuple):
+    FORMAT: str
+    DECODE: Converter = None
+    ENCODE: Converter = None
+
+
+U8 = Field('B')
+U16 = Field('H')
+U32 = Field('L')
+
+
+def Bytes(size: int) -> Field:
+    return Field(f'{size}s')
+
+
+def Hex(size: int) -> Field:
+    '''定长字节串，解码为十六进制字符串，例如 BCD 编码的终端手机号
+
+    编码时长度必须正好是 size 字节，struct 的 s 格式会把长度不对的值截断或补零。
+    检查展开在表达式里，省掉一次函数调用
+    '''
+    return Field(f'{size}s', '{}.hex()',
+                 f'(_h if len(_h := _fromhex({{0}})) == {size} else _wrong_size({{0}}, {size}))')
+
+
+def _wrong_size(value: str, size: int):
+    raise struct.error(f'expected {size} bytes, got {value!r}')
+
+
+def Scaled(field: Field, factor: int) -> Field:
+    '''按 factor 缩放的整数，例如以百万分之一度为单位的经纬度'''
+    return Field(field.FORMAT, f'{{}} / {factor}', f'_round({{}} * {factor})')
+
+
+def Converted(field: Field, decode: Callable, encode: Callable) -> Field:
+    return Field(field.FORMAT, decode, encode)
+
+
+class Codec(object):
+    '''由字段布局一次性生成的编解码函数
+
+    整条消息只调用一次 unpack_from / pack，各字段的偏移都固定在 struct 格式里，
+    字段转换直接展开成生成函数中的表达式，生成的源码保存在 source 中便于排查
+    '''
+
+    def __init__(self, cls, fields: Dict[str, Field], variants: Dict[str, Dict[str, Field]] = None):
+        missing = set(cls._fields) ^ set(fields)
+        if missing:
+            raise ValueError(f'{cls.__name__} fields do not match the schema: {sorted(missing)}')
+
+        self.cls = cls
+        self.fields = [fields[name] for name in cls._fields]
+        self.struct = struct.Struct('>' + ''.join(field.FORMAT for field in self.fields))
+        self.size = self.struct.size
+
+        namespace = {'_unpack': self.struct.unpack_from, '_pack': self.struct.pack, '_cls': cls,
+                     '_new': tuple.__new__, '_fromhex': bytes.fromhex, '_round': round,
+                     '_wrong_size': _wrong_size}
+        variants = variants or {}
+        for variant in variants.values():
+            for name, field in variant.items():
+                if field.FORMAT != fields[name].FORMAT:
+                    raise ValueError(f'variant of {name} must keep the format {fields[name].FORMAT!r}')
+
+        # 只有一个字段时也要保持元组语法
+        values = ', '.join(f'v{i}' for i in range(len(self.fields))) + (',' if len(self.fields) == 1 else '')
+        lines = [f'def unmarshal(data, offset=0{"".join(f", {flag}=False" for flag in variants)}):',
+                 f'    {values} = _unpack(data, offset)']
+        for flag, variant in variants.items():
+            layout = [variant.get(name, field) for name, field in zip(cls._fields, self.fields)]
+            lines.append(f'    if {flag}:')
+            lines.append(f'        return _new(_cls, ({self._expressions(layout, "DECODE", flag, namespace)}))')
+        lines.append(f'    return _new(_cls, ({self._expressions(self.fields, "DECODE", "", namespace)}))')
+
+        lines += ['',
+                  'def marshal(self):',
+                  f'    {values} = self',
+                  f'    return _pack({self._expressions(self.fields, "ENCODE", "", namespace)})']
+
+        self.source = '\n'.join(lines) + '\n'
+        exec(compile(self.source, f'<schema {cls.__name__}>', 'exec'), namespace)
+        self.unmarshal = namespace['unmarshal']
+        self.marshal = namespace['marshal']
+
+    @staticmethod
+    def _expressions(fields, attribute: str, prefix: str, namespace: Dict[str, Any]) -> str:
+        expressions = []
+        for i, field in enumerate(fields):
+            converter = getattr(field, attribute)
+            if converter is None:
+                expressions.append(f'v{i}')
+            elif callable(converter):
+                name = f'_{attribute.lower()}_{prefix}{i}'
+                namespace[name] = converter
+                expressions.append(f'{name}(v{i})')
+            else:
+                expressions.append(converter.format(f'v{i}'))
+        return ', '.join(expressions) + (',' if len(expressions) == 1 else '')
+
+
+def message(variants: Dict[str, Dict[str, Field]] = None, **fields: Field):
+    '''NamedTuple 的类装饰器，按字段布局生成 marshal 和 unmarshal
+
+    variants 为解码时的可选变体，例如 {'epoch': {'DATETIME': ...}}，
+    生成的 unmarshal 多出同名的关键字参数，为真时改用变体中的字段转换
+    '''
+
+    def decorator(cls):
+        codec = Codec(cls, fields, variants)
+        cls.schema = codec
+        cls.marshal = codec.marshal
+        cls.unmarshal = staticmethod(codec.unmarshal)
+        return cls
+
+    return decorator
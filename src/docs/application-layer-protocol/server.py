@@ -4,36 +4,367 @@ Description: Omit
 LastEditors: Rustle Karl
 LastEditTime: 2021.11.15 12:57
 '''
-import socketserver
-import socket
-from protocol import Parser
-from binascii import unhexlify
+import asyncio
+import multiprocessing
+import os
+import signal
+import time
+from capture import Recorder
+from metrics import Metrics
+from pipeline import Pipeline
+from protocol import ClientMethod, Dispatcher, Parser
+from reassembly import Reassembler
+from session import SessionTable
+from spatial import GridIndex
+from store import LocationStore
+from transport import TRANSPORTS
 from pkgs.logger import log
 
 
-class RequestHandler(socketserver.BaseRequestHandler):
+class RequestHandler(asyncio.Protocol):
 
-    def handle(self):
-        client: socket.socket = self.request
-        address = self.client_address
-        parser = Parser(client)
+    def __init__(self, server: 'Server'):
+        self._server = server
+        self._transport = None
+        self._address = None
+        self._parser = None
+        self._decoder = None
+        self._id = 0
 
-        log.debug('Connected by %s:%d.' % address)
+    def connection_made(self, transport: asyncio.Transport):
+        self._address = transport.get_extra_info('peername')[:2]
 
+        if self._server.connections >= self._server.max_connections:
+            log.warning('Refused %s:%d, too many connections.' % self._address)
+            transport.close()
+            return
+
+        self._server.connections += 1
+        self._server.accepted += 1
+        self._id = self._server.accepted
+        self._transport = transport
+        decoder = TRANSPORTS[self._server.transport]
+        self._parser = Parser(send=transport.write, hex_encoded=decoder.hex_encoded,
+                              dispatcher=self._server.pipeline or self._server.dispatcher,
+                              writev=transport.writelines,
+                              flush_threshold=self._server.flush_threshold,
+                              metrics=self._server.metrics, reassembler=self._server.reassembler)
+        self._decoder = decoder(self._parser.put)
+
+        log.debug('Connected by %s:%d.' % self._address)
+
+    def data_received(self, data: bytes):
+        if self._parser:
+            # 按读取逐条记日志的代价太高，吞吐和延迟由 --metrics 汇总
+            log.debug('[recv] %r', data)
+            if self._server.recorder is not None:
+                self._server.recorder.record(self._id, data)
+            frames = self._parser.frames
+            self._decoder.feed(data)
+            self._server.frames += self._parser.frames - frames
+
+            pipeline = self._server.pipeline
+            if pipeline is not None and pipeline.full:
+                pipeline.pause(self._transport)
+
+    def connection_lost(self, exc):
+        if self._transport:
+            self._server.connections -= 1
+            if self._server.pipeline is not None:
+                self._server.pipeline.forget(self._transport)
+            self._transport = None
+            if self._server.recorder is not None:
+                self._server.recorder.closed(self._id)
+            log.debug('Disconnected by %s:%d.' % self._address)
+
+
+class Server(object):
+
+    def __init__(self, host: str, port: int, max_connections: int, transport: str = 'hex',
+                 store: str = None, flush_threshold: int = 1 << 16, capture: str = None,
+                 pipeline: int = 0, metrics: bool = False, metrics_port: int = None):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.transport = transport
+        self.flush_threshold = flush_threshold
+        self.connections = 0
+        self.accepted = 0
+        self.frames = 0
+        self.sessions = SessionTable()
+        # 各终端的最新位置，用于批量回答位置查询
+        self.spatial = GridIndex()
+        self.store = LocationStore(store) if store else None
+        # 所有连接共用一个分包重组缓冲区，总内存有上限
+        self.reassembler = Reassembler()
+        self.metrics = Metrics() if metrics else None
+        self.dispatcher = self.handlers()
+        # 录下收到的原始字节流，供 tests/replay.py 离线回放
+        self.recorder = Recorder(capture, transport) if capture else None
+        # pipeline 为队列容量，处理函数共享会话表等状态，只用一个工作线程
+        self.pipeline = Pipeline(self.dispatcher, capacity=pipeline) if pipeline else None
+        # 在该端口上以 Prometheus 文本格式提供指标
+        self.metrics_port = metrics_port if metrics else None
+        self._reporter = None
+        self._exposer = None
+        self._housekeeper = None
+
+    def handlers(self) -> Dispatcher:
+        '''会话表、轨迹存储和空间索引都作为处理函数注册到分发表中'''
+        dispatcher = Dispatcher(self.metrics)
+
+        for method in (ClientMethod.REGISTER, ClientMethod.AUTHENTICATION, ClientMethod.HEARTBEAT):
+            dispatcher.register(method, lambda header, body: self.sessions.update(header))
+        dispatcher.register(ClientMethod.LOCATION_REPORT, self.sessions.update, decode=True)
+        dispatcher.register(ClientMethod.LOCATION_REPORT,
+                            lambda header, location: self.spatial.update(header.IMEI, location), decode=True)
+        if self.store is not None:
+            # 存储直接写入原始消息体，不需要解码
+            dispatcher.register(ClientMethod.LOCATION_REPORT,
+                                lambda header, body: self.store.append(header.IMEI, body))
+
+        return dispatcher
+
+    def close(self):
+        # 先处理完队列中的消息再关闭存储
+        if self.pipeline is not None:
+            self.pipeline.close()
+        if self._reporter is not None:
+            self._reporter.cancel()
+        if self._housekeeper is not None:
+            self._housekeeper.cancel()
+        if self._exposer is not None:
+            self._exposer.close()
+        if self.store is not None:
+            self.store.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    async def report(self, interval: float = 5):
+        while True:
+            await asyncio.sleep(interval)
+            if self.pipeline is not None:
+                stats = self.pipeline.stats()
+                log.info('[pipeline] depth {depth}, max {max_depth}, processed {processed}, '
+                         'pauses {pauses}, latency p50 {p50_ms:.2f} ms, p99 {p99_ms:.2f} ms, '
+                         'max {max_ms:.2f} ms'.format(**stats))
+            if self.metrics is not None:
+                log.info(f'[metrics] {self.metrics.summary()}')
+
+    async def housekeep(self, interval: float = 1):
+        # 没有新分包到达时也要按时丢弃未收齐的消息，没有新位置汇报时也要按时落盘，
+        # 终端都不活跃时也要按时清理过期会话
+        malformed = errors = 0
         while True:
+            await asyncio.sleep(interval)
+            expired = self.reassembler.expire()
+            if expired:
+                log.warning(f'Expired {expired} incomplete sub-package messages.')
+            # 分发时吞掉的异常在这里汇总成一条日志
+            dispatcher = self.dispatcher
+            if dispatcher.malformed > malformed or dispatcher.errors > errors:
+                log.warning(f'{dispatcher.malformed - malformed} malformed messages, '
+                            f'{dispatcher.errors - errors} handler errors.')
+                malformed, errors = dispatcher.malformed, dispatcher.errors
+            if self.store is not None:
+                self.store.tick()
+            # 一次最多清理这么多，大批终端同时下线时分摊到多轮，不长时间占住事件循环
+            self.sessions.expire(limit=1 << 16)
+
+    async def expose(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        '''任意 HTTP 请求都返回全部指标'''
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        body = self.metrics.render().encode()
+        writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                     b'Content-Length: %d\r\n\r\n' % len(body) + body)
+        await writer.drain()
+        writer.close()
+
+    async def start(self, reuse_port: bool = False) -> asyncio.AbstractServer:
+        loop = asyncio.get_running_loop()
+        if self._housekeeper is None:
+            self._housekeeper = loop.create_task(self.housekeep())
+        if (self.pipeline is not None or self.metrics is not None) and self._reporter is None:
+            self._reporter = loop.create_task(self.report())
+        if self.metrics_port is not None and self._exposer is None:
+            self._exposer = await asyncio.start_server(self.expose, self.host, self.metrics_port)
+        return await loop.create_server(lambda: RequestHandler(self), self.host, self.port,
+                                        backlog=1024, reuse_port=reuse_port)
+
+    async def serve_forever(self):
+        try:
+            async with await self.start() as server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+    async def serve_worker(self, counter, grace: float):
+        '''作为 SO_REUSEPORT 工作进程运行，收到 SIGTERM 后停止接受连接并等待已有连接断开'''
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+
+        server = await self.start(reuse_port=True)
+        reported = 0
+
+        while not stop.is_set():
             try:
-                recv = client.recv(1024)
-                if recv:
-                    log.info(f'[recv] {repr(recv)}')
-                    parser.put(unhexlify(recv))
-            except ConnectionError:
-                break
+                await asyncio.wait_for(stop.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+
+            with counter.get_lock():
+                counter.value += self.frames - reported
+            reported = self.frames
 
-        log.debug('Disconnected by %s:%d.' % address)
+        server.close()
+        deadline = loop.time() + grace
+        while self.connections and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+
+        with counter.get_lock():
+            counter.value += self.frames - reported
+
+        self.close()
+
+
+def run_worker(host: str, port: int, max_connections: int, transport: str, store: str,
+               flush_threshold: int, capture: str, pipeline: int, metrics: bool, counter, grace: float):
+    # 由启动进程统一处理中断和重启信号
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    # 段文件只追加，每个工作进程单独一个目录
+    if store:
+        store = os.path.join(store, f'worker-{os.getpid()}')
+    if capture:
+        capture = f'{capture}.{os.getpid()}'
+
+    log.debug(f'Worker {os.getpid()} started.')
+    # 工作进程各自汇总指标并定期写日志，不提供拉取端口
+    server = Server(host, port, max_connections, transport, store, flush_threshold, capture,
+                    pipeline, metrics)
+    asyncio.run(server.serve_worker(counter, grace))
+    log.debug(f'Worker {os.getpid()} stopped.')
+
+
+class Launcher(object):
+    '''启动 N 个共享监听端口的工作进程，SIGHUP 逐个平滑重启，并定期汇总吞吐量'''
+
+    def __init__(self, host: str, port: int, max_connections: int, transport: str, store: str,
+                 flush_threshold: int, capture: str, pipeline: int, metrics: bool, workers: int,
+                 interval: float = 5, grace: float = 10):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.transport = transport
+        self.store = store
+        self.flush_threshold = flush_threshold
+        self.capture = capture
+        self.pipeline = pipeline
+        self.metrics = metrics
+        self.workers = workers
+        self.interval = interval
+        self.grace = grace
+
+        self._context = multiprocessing.get_context('fork')
+        self._counter = self._context.Value('Q', 0)
+        self._processes = []
+        self._restart = False
+        self._stop = False
+
+    def _spawn(self) -> multiprocessing.Process:
+        process = self._context.Process(
+            target=run_worker, daemon=True,
+            args=(self.host, self.port, self.max_connections, self.transport, self.store,
+                  self.flush_threshold, self.capture, self.pipeline, self.metrics, self._counter,
+                  self.grace),
+        )
+        process.start()
+        return process
+
+    def _retire(self, process: multiprocessing.Process):
+        process.terminate()
+        process.join(self.grace + 1)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    def restart(self):
+        # 先启动新进程再停止旧进程，端口上始终有进程在接受连接
+        for i, process in enumerate(self._processes):
+            self._processes[i] = self._spawn()
+            self._retire(process)
+
+    def run(self):
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, '_restart', True))
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, '_stop', True))
+
+        self._processes = [self._spawn() for _ in range(self.workers)]
+        log.info(f'Started {self.workers} workers on {self.host}:{self.port}.')
+
+        last_count, last_time = 0, time.monotonic()
+
+        try:
+            while not self._stop:
+                time.sleep(self.interval)
+
+                if self._restart:
+                    self._restart = False
+                    log.info('Restarting workers.')
+                    self.restart()
+
+                for i, process in enumerate(self._processes):
+                    if not process.is_alive():
+                        log.warning(f'Worker {process.pid} exited with {process.exitcode}, respawning.')
+                        self._processes[i] = self._spawn()
+
+                count, now = self._counter.value, time.monotonic()
+                log.info(f'[throughput] {(count - last_count) / (now - last_time):,.0f} frames/s, '
+                         f'{count} frames total, {len(self._processes)} workers')
+                last_count, last_time = count, now
+        except KeyboardInterrupt:
+            pass
+
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            self._retire(process)
 
 
 if __name__ == '__main__':
+    import argparse
     import config
 
-    server = socketserver.ThreadingTCPServer((config.TCP_HOST, config.TCP_PORT), RequestHandler)
-    server.serve_forever()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of SO_REUSEPORT worker processes, 0 for one per CPU')
+    parser.add_argument('--transport', choices=TRANSPORTS, default=config.TCP_TRANSPORT,
+                        help='hex for ASCII hex encoded terminals, raw for binary ones')
+    parser.add_argument('--store', default=config.LOCATION_STORE,
+                        help='directory to persist location reports into')
+    parser.add_argument('--flush-threshold', type=int, default=config.TCP_FLUSH_THRESHOLD,
+                        help='bytes of pending replies that force a write, 0 to write each reply')
+    parser.add_argument('--capture', default=None,
+                        help='file to record inbound traffic into, suffixed with the pid per worker')
+    parser.add_argument('--pipeline', type=int, default=config.PIPELINE_CAPACITY,
+                        help='handle messages on a worker thread with a queue of this many messages, '
+                             '0 to handle them inline')
+    parser.add_argument('--metrics', action='store_true',
+                        help='collect per-method counters and latency histograms, logged every 5 s')
+    parser.add_argument('--metrics-port', type=int, default=config.METRICS_PORT,
+                        help='serve the metrics over HTTP on this port, only with --workers 1')
+    args = parser.parse_args()
+
+    if args.workers == 1:
+        server = Server(config.TCP_HOST, config.TCP_PORT, config.TCP_MAX_CONNECTIONS,
+                        args.transport, args.store, args.flush_threshold, args.capture, args.pipeline,
+                        args.metrics, args.metrics_port)
+        asyncio.run(server.serve_forever())
+    else:
+        Launcher(config.TCP_HOST, config.TCP_PORT, config.TCP_MAX_CONNECTIONS, args.transport,
+                 args.store, args.flush_threshold, args.capture, args.pipeline, args.metrics,
+                 args.workers or os.cpu_count()).run()
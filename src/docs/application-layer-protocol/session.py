@@ -0,0 +1,102 @@
+'''
+Date: 2026.10.18 13:04
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:57
+'''
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from protocol import ClientMethod, Header, Location
+
+
+class Session(object):
+    '''单个终端的状态，用 __slots__ 省掉每个对象的 __dict__'''
+
+    __slots__ = ('imei', 'registered', 'authenticated', 'serial', 'location', 'last_seen')
+
+    def __init__(self, imei: bytes):
+        self.imei = imei
+        self.registered = False
+        self.authenticated = False
+        self.serial = 0
+        self.location = None
+        self.last_seen = 0.0
+
+    def __repr__(self):
+        return (f'Session(imei={self.imei.hex()!r}, registered={self.registered}, '
+                f'authenticated={self.authenticated}, serial={self.serial}, '
+                f'location={self.location!r}, last_seen={self.last_seen})')
+
+
+class SessionTable(object):
+    '''以 6 字节 IMEI 为键的终端会话表
+
+    按最近活跃时间排序，超过 ttl 秒未活跃或者超出 capacity 时从最久未活跃的一端淘汰。
+    update 顺带淘汰队首的两个过期会话，没有新消息时需要定时调用 expire；
+    两者可以在不同线程中调用
+    '''
+
+    def __init__(self, capacity: int = 1 << 20, ttl: float = 3600):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, imei: bytes):
+        return imei in self._sessions
+
+    def get(self, imei: bytes) -> Optional[Session]:
+        return self._sessions.get(imei)
+
+    def update(self, header: Header, location: Location = None, now: float = None) -> Session:
+        now = time.monotonic() if now is None else now
+        imei = bytes.fromhex(header.IMEI)
+        sessions = self._sessions
+
+        with self._lock:
+            session = sessions.get(imei)
+            if session is None:
+                session = sessions[imei] = Session(imei)
+                if len(sessions) > self.capacity:
+                    sessions.popitem(last=False)
+            else:
+                sessions.move_to_end(imei)
+            session.last_seen = now
+
+            # 每次更新顺带淘汰队首过期的会话，均摊下来是 O(1)
+            self._expire(now, 2)
+
+        session.serial = header.NUMBER
+        if header.METHOD == ClientMethod.LOCATION_REPORT:
+            session.location = location
+        elif header.METHOD == ClientMethod.REGISTER:
+            session.registered = True
+        elif header.METHOD == ClientMethod.AUTHENTICATION:
+            session.authenticated = True
+
+        return session
+
+    def expire(self, now: float = None, limit: int = None) -> int:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return self._expire(now, limit)
+
+    def _expire(self, now: float, limit: int = None) -> int:
+        deadline = now - self.ttl
+        sessions = self._sessions
+        count = 0
+
+        while sessions and (limit is None or count < limit):
+            imei, session = next(iter(sessions.items()))
+            if session.last_seen >= deadline:
+                break
+            del sessions[imei]
+            count += 1
+
+        return count
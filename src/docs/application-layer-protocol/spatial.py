@@ -0,0 +1,114 @@
+'''
+Date: 2026.10.18 13:07
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:07
+'''
+from math import cos, radians
+from typing import Dict, List, Tuple
+
+from protocol import Location
+
+# 每纬度对应的距离，单位米
+_METERS_PER_DEGREE = 111320.0
+# 行号左移后与列号拼成一个整数作为网格键，经度格子数不会超过 2 ** 20
+# 协议中的经纬度都是无符号数，南纬西经由状态位表示，所以行列号都不为负
+_SHIFT = 20
+
+
+class GridIndex(object):
+    '''按经纬度划分等大网格，维护每个终端最新位置的空间索引
+
+    位置汇报到达时只需把终端从旧格子移到新格子，矩形和半径查询只检查覆盖到的格子
+    '''
+
+    def __init__(self, cell: float = 0.01):
+        self.cell = cell
+        self._cells: Dict[int, Dict[str, Location]] = {}
+        self._positions: Dict[str, Tuple[int, Location]] = {}
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _key(self, latitude: float, longitude: float) -> int:
+        return int(latitude // self.cell) << _SHIFT | int(longitude // self.cell)
+
+    def get(self, imei: str) -> Location:
+        position = self._positions.get(imei)
+        return position[1] if position else None
+
+    def update(self, imei: str, location: Location):
+        key = self._key(location.LATITUDE, location.LONGITUDE)
+        position = self._positions.get(imei)
+
+        if position is not None and position[0] != key:
+            cell = self._cells[position[0]]
+            del cell[imei]
+            if not cell:
+                del self._cells[position[0]]
+
+        cell = self._cells.get(key)
+        if cell is None:
+            cell = self._cells[key] = {}
+        cell[imei] = location
+        self._positions[imei] = key, location
+
+    def remove(self, imei: str):
+        position = self._positions.pop(imei, None)
+        if position is not None:
+            cell = self._cells[position[0]]
+            del cell[imei]
+            if not cell:
+                del self._cells[position[0]]
+
+    def within(self, min_latitude: float, min_longitude: float,
+               max_latitude: float, max_longitude: float) -> List[Tuple[str, Location]]:
+        '''矩形查询，边界包含在内'''
+        row_low, row_high = int(min_latitude // self.cell), int(max_latitude // self.cell)
+        col_low, col_high = int(min_longitude // self.cell), int(max_longitude // self.cell)
+        result = []
+
+        # 查询范围很大时直接遍历有终端的格子
+        if (row_high - row_low + 1) * (col_high - col_low + 1) > len(self._cells):
+            keys = [key for key in self._cells
+                    if row_low <= key >> _SHIFT <= row_high
+                    and col_low <= key & ((1 << _SHIFT) - 1) <= col_high]
+        else:
+            keys = [row << _SHIFT | col
+                    for row in range(row_low, row_high + 1)
+                    for col in range(col_low, col_high + 1)]
+
+        for key in keys:
+            cell = self._cells.get(key)
+            if not cell:
+                continue
+
+            row, col = key >> _SHIFT, key & ((1 << _SHIFT) - 1)
+            if row_low < row < row_high and col_low < col < col_high:
+                # 完全落在矩形内部的格子不用逐个比较
+                result.extend(cell.items())
+                continue
+
+            for imei, location in cell.items():
+                if (min_latitude <= location.LATITUDE <= max_latitude
+                        and min_longitude <= location.LONGITUDE <= max_longitude):
+                    result.append((imei, location))
+
+        return result
+
+    def nearby(self, latitude: float, longitude: float, radius: float) -> List[Tuple[str, Location]]:
+        '''半径查询，radius 单位为米，距离按等距矩形投影近似计算'''
+        scale = cos(radians(latitude))
+        delta_latitude = radius / _METERS_PER_DEGREE
+        delta_longitude = radius / (_METERS_PER_DEGREE * max(scale, 1e-6))
+        limit = delta_latitude * delta_latitude
+
+        result = []
+        for imei, location in self.within(latitude - delta_latitude, longitude - delta_longitude,
+                                          latitude + delta_latitude, longitude + delta_longitude):
+            dy = location.LATITUDE - latitude
+            dx = (location.LONGITUDE - longitude) * scale
+            if dx * dx + dy * dy <= limit:
+                result.append((imei, location))
+
+        return result
@@ -0,0 +1,213 @@
+'''
+Date: 2026.10.18 13:05
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:50
+'''
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from typing import Dict, Iterator, List, Tuple
+
+from protocol import Location, bcd_to_epoch
+
+# IMEI 6 字节 + 时间戳 4 字节 + 原始位置信息 28 字节
+_RECORD = struct.Struct('>6sI28s')
+_KEY = struct.Struct('>6sI28x')
+_LOCATION_OFFSET = 10
+_DATETIME = slice(22, 28)
+
+
+class Segment(object):
+    '''一个定长记录的段文件，以及按块划分的稀疏索引
+
+    每 block 条记录为一块，索引只记录每个 IMEI 出现在哪些块里，以及每块的时间范围
+    '''
+
+    def __init__(self, path: str, block: int):
+        self.path = path
+        self.block = block
+        self.count = 0
+        self.start = 0xffffffff
+        self.stop = 0
+        self.blocks: Dict[bytes, array] = {}
+        self.ranges: List[List[int]] = []
+        self._mmap = None
+        self._mapped = 0
+
+    def index(self, imei: bytes, epoch: int):
+        number = self.count // self.block
+        if number == len(self.ranges):
+            self.ranges.append([epoch, epoch])
+        else:
+            bounds = self.ranges[number]
+            if epoch < bounds[0]:
+                bounds[0] = epoch
+            elif epoch > bounds[1]:
+                bounds[1] = epoch
+
+        blocks = self.blocks.get(imei)
+        if blocks is None:
+            self.blocks[imei] = array('I', (number,))
+        elif blocks[-1] != number:
+            blocks.append(number)
+
+        if epoch < self.start:
+            self.start = epoch
+        if epoch > self.stop:
+            self.stop = epoch
+        self.count += 1
+
+    def view(self) -> mmap.mmap:
+        size = self.count * _RECORD.size
+        if self._mmap is None or self._mapped < size:
+            # 旧的映射不能在这里关闭，未结束的 scan 还持有它的 memoryview，
+            # 只丢掉引用，等最后一个读者释放后由垃圾回收关闭
+            with open(self.path, 'rb') as fp:
+                self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped = size
+        return self._mmap
+
+    def scan(self, imei: bytes, start: int, stop: int) -> Iterator[Tuple[int, Location]]:
+        blocks = self.blocks.get(imei)
+        if not blocks or stop < self.start or start > self.stop:
+            return
+
+        data = self.view()
+        size = self.block * _RECORD.size
+
+        for number in blocks:
+            low, high = self.ranges[number]
+            if stop < low or start > high:
+                continue
+
+            offset = number * size
+            end = min(offset + size, self.count * _RECORD.size)
+            with memoryview(data)[offset:end] as view:
+                for i, (key, epoch) in enumerate(_KEY.iter_unpack(view)):
+                    if key == imei and start <= epoch <= stop:
+                        yield epoch, Location.unmarshal(
+                            data, offset + i * _RECORD.size + _LOCATION_OFFSET)
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # 仍有查询在读，留给垃圾回收
+                pass
+            self._mmap = None
+
+
+class LocationStore(object):
+    '''只追加的位置信息存储
+
+    位置汇报先攒成一批再整块写入段文件，段写满 segment 条记录后换新文件，
+    查询某辆车一段时间内的轨迹只需要按索引扫描相关的块
+
+    攒够 batch 条，或者距上次写入超过 interval 秒时写入，后者只在 append 和 tick 中检查，
+    没有新数据时需要定时调用 tick，否则最后一批会一直留在内存中。
+    append、flush 和 tick 可以在不同线程中调用
+    '''
+
+    def __init__(self, directory: str, segment: int = 1 << 20, block: int = 256,
+                 batch: int = 4096, interval: float = 1.0):
+        self.directory = directory
+        self.segment = segment
+        self.block = block
+        self.batch = batch
+        self.interval = interval
+
+        self._segments: List[Segment] = []
+        self._pending = bytearray()
+        self._keys: List[Tuple[bytes, int]] = []
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.seg'):
+                self._load(os.path.join(directory, name))
+
+    def _load(self, path: str):
+        segment = Segment(path, self.block)
+        with open(path, 'r+b') as fp:
+            data = fp.read()
+            # 截掉写了一半的记录，后续追加才能对齐
+            usable = len(data) - len(data) % _RECORD.size
+            if usable < len(data):
+                fp.truncate(usable)
+        for imei, epoch in _KEY.iter_unpack(memoryview(data)[:usable]):
+            segment.index(imei, epoch)
+        self._segments.append(segment)
+
+    def _current(self) -> Segment:
+        if not self._segments or self._segments[-1].count >= self.segment:
+            path = os.path.join(self.directory, f'{len(self._segments):08d}.seg')
+            self._segments.append(Segment(path, self.block))
+        return self._segments[-1]
+
+    def __len__(self):
+        return sum(segment.count for segment in self._segments) + len(self._keys)
+
+    def append(self, imei: str, location: bytes):
+        '''location 为 0x0200 消息体，至少 28 字节，时间早于 1970 年的记录无法存储'''
+        key = bytes.fromhex(imei)
+        epoch = bcd_to_epoch(bytes(location[_DATETIME]))
+        if not 0 <= epoch <= 0xffffffff:
+            raise ValueError(f'timestamp {epoch} out of range for the store')
+
+        with self._lock:
+            self._pending += key
+            self._pending += epoch.to_bytes(4, 'big')
+            self._pending += location[:28]
+            self._keys.append((key, epoch))
+
+            if len(self._keys) >= self.batch or time.monotonic() - self._flushed >= self.interval:
+                self._flush()
+
+    def tick(self):
+        '''距上次写入超过 interval 秒时写入积攒的记录'''
+        if self._keys and time.monotonic() - self._flushed >= self.interval:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._flushed = time.monotonic()
+        view = memoryview(self._pending)
+        written = 0
+
+        while written < len(self._keys):
+            segment = self._current()
+            count = min(self.segment - segment.count, len(self._keys) - written)
+
+            with open(segment.path, 'ab') as fp:
+                fp.write(view[written * _RECORD.size:(written + count) * _RECORD.size])
+            for imei, epoch in self._keys[written:written + count]:
+                segment.index(imei, epoch)
+
+            written += count
+
+        view.release()
+        self._pending.clear()
+        self._keys.clear()
+
+    def query(self, imei: str, start: int, stop: int) -> Iterator[Tuple[int, Location]]:
+        '''按时间戳闭区间 [start, stop] 查询某个终端的轨迹，按写入顺序返回 (epoch, Location)'''
+        if self._keys:
+            self.flush()
+
+        key = bytes.fromhex(imei)
+        for segment in self._segments:
+            yield from segment.scan(key, start, stop)
+
+    def close(self):
+        self.flush()
+        for segment in self._segments:
+            segment.close()
@@ -0,0 +1,89 @@
+'''
+Date: 2026.10.18 12:53
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:51
+'''
+import random
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from protocol import Location
+
+
+def random_locations(count: int, seed: int = 808):
+    rng = random.Random(seed)
+    start = datetime(2021, 11, 15)
+
+    return [Location(
+        rng.getrandbits(32), rng.getrandbits(32),
+        rng.randrange(90000000) / 1000000, rng.randrange(180000000) / 1000000,
+        rng.getrandbits(16), rng.getrandbits(16), rng.randrange(360),
+        start + timedelta(seconds=rng.randrange(365 * 86400)),
+    ) for _ in range(count)]
+
+
+def check_round_trip(count: int = 5000):
+    locations = random_locations(count)
+    bodies = [location.marshal() for location in locations]
+
+    # 消息体后面通常还跟着附加信息和校验码
+    buffer = b''.join(body + b'\x01\x04\x00\x00\x00\x00' for body in bodies)
+    offsets = range(0, len(buffer), len(bodies[0]) + 6)
+
+    for epoch in (False, True):
+        expect = [Location.unmarshal(body, epoch=epoch) for body in bodies]
+        assert [Location.unmarshal(Location.marshal(location)) for location in locations] == locations
+
+        array = Location.unmarshal_batch(bodies, epoch=epoch)
+        columns = Location.unmarshal_batch(buffer, offsets, epoch=epoch, columnar=True)
+
+        for i, location in enumerate(expect):
+            for name, value in zip(Location._fields, location):
+                got = array[name][i].item(), columns[name][i].item()
+                assert got == (value, value), (i, name, got, value)
+
+
+def check_invalid():
+    body = bytearray(random_locations(1)[0].marshal())
+    body[-5] = 0x13  # 13 月
+
+    for bodies in ([bytes(body)], [bytes(body[:20])]):
+        try:
+            Location.unmarshal_batch(bodies)
+        except Exception:
+            continue
+        raise AssertionError(bodies)
+
+    # 逐条解码拒绝不存在的日期，批量解码也必须拒绝，不能顺延到下个月
+    for stamp, valid in ((b'\x21\x02\x30', False), (b'\x21\x04\x31', False), (b'\x21\x02\x29', False),
+                         (b'\x20\x02\x29', True), (b'\x00\x02\x29', True), (b'\x21\x12\x31', True)):
+        body[-6:-3] = stamp
+        for decode in (Location.unmarshal, lambda data: Location.unmarshal_batch([data])):
+            try:
+                decode(bytes(body))
+            except ValueError:
+                assert not valid, (stamp.hex(), decode)
+            else:
+                assert valid, (stamp.hex(), decode)
+
+
+if __name__ == '__main__':
+    check_round_trip()
+    check_invalid()
+
+    bodies = [location.marshal() for location in random_locations(100000)]
+
+    start = time.perf_counter()
+    for body in bodies:
+        Location.unmarshal(body)
+    scalar = len(bodies) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    array = Location.unmarshal_batch(bodies)
+    batch = len(bodies) / (time.perf_counter() - start)
+
+    assert isinstance(array, np.ndarray)
+    print(f'scalar {scalar:>12,.0f} rec/s  batch {batch:>12,.0f} rec/s  x{batch / scalar:.1f}')
@@ -0,0 +1,64 @@
+'''
+Date: 2026.10.18 12:53
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 12:53
+'''
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from protocol import UTC_OFFSET, bcd_to_datetime, bcd_to_epoch
+
+
+def to_bcd(moment: datetime) -> bytes:
+    return bytes.fromhex(moment.strftime('%y%m%d%H%M%S'))
+
+
+def strptime(raw: bytes) -> datetime:
+    return datetime.strptime(raw.hex(), '%y%m%d%H%M%S')
+
+
+def check(rounds: int = 10000):
+    rng = random.Random(808)
+    tz = timezone(timedelta(seconds=UTC_OFFSET))
+    start = datetime(1969, 1, 1)
+
+    for _ in range(rounds):
+        raw = to_bcd(start + timedelta(seconds=rng.randrange(100 * 365 * 86400)))
+        moment = strptime(raw)
+        assert bcd_to_datetime(raw) == moment, raw.hex()
+        assert bcd_to_epoch(raw) == int(moment.replace(tzinfo=tz).timestamp()), raw.hex()
+
+    for raw in (b'\x21\x13\x01\x00\x00\x00', b'\x21\x01\x01\x00\x00\x0a'):
+        try:
+            bcd_to_datetime(raw)
+        except ValueError:
+            continue
+        raise AssertionError(raw.hex())
+
+
+def bench(func, samples, seconds: float = 0.5) -> float:
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for raw in samples:
+            func(raw)
+        count += len(samples)
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    check()
+
+    now = datetime(2021, 11, 15, 14, 0, 0)
+    # 同一秒内的突发上报与每条时间都不同两种情况
+    burst = [to_bcd(now + timedelta(seconds=i // 100)) for i in range(1000)]
+    spread = [to_bcd(now + timedelta(seconds=i)) for i in range(1000)]
+
+    for name, samples in (('burst', burst), ('spread', spread)):
+        old = bench(strptime, samples)
+        new = bench(bcd_to_datetime.__wrapped__, samples)
+        hot = bench(bcd_to_datetime, samples)
+        epoch = bench(bcd_to_epoch, samples)
+        print(f'{name:<6} strptime {old:>10,.0f}/s  decoder {new:>10,.0f}/s  '
+              f'cached {hot:>10,.0f}/s  epoch {epoch:>10,.0f}/s')
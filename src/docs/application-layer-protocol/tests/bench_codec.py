@@ -0,0 +1,77 @@
+'''
+Date: 2026.10.18 12:52
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:01
+'''
+import struct
+import time
+from binascii import unhexlify
+from datetime import datetime
+
+from protocol import ClientMethod, Header, Location, Parser, ServerMethod
+
+FRAMES = {
+    'REGISTER': unhexlify(b'010000307360802475620000000000004A435A4E53476574636861726D736D'
+                          b'61727430303030303030433132303030300056494E0000000000000000A4'),
+    'AUTHENTICATION': unhexlify(b'0102000573608155441500015091529468fe'),
+    'LOCATION_REPORT': unhexlify(b'0200001C73608024756200100000000000100003015834BA06C9D86B'
+                                 b'00200000012418121916465505'),
+    'HEARTBEAT': unhexlify(b'000200007360802475620010B2'),
+}
+
+
+def legacy_parse(packet: bytearray):
+    '''格式串版本，用作对照'''
+    for key, value in ((b'\x7d', b'\x7d\x01'), (b'\x7e', b'\x7d\x02')):
+        packet = packet.replace(value, key)
+
+    obj = struct.unpack('>2H6BH', packet[0:12])
+    header = Header(obj[0], obj[1], bytearray(obj[2:8]).hex(), obj[8])
+    body = packet[12:]
+
+    if header.METHOD == ClientMethod.REGISTER:
+        response_body = struct.pack('>HBL', header.NUMBER, 0, 20211115)
+        response = struct.pack('>2H6BH', ServerMethod.REGISTER, len(response_body),
+                               *bytes.fromhex(header.IMEI), header.NUMBER) + response_body
+    else:
+        response_body = struct.pack('>2HB', header.NUMBER, header.METHOD, 0)
+        response = struct.pack('>2H6BH', ServerMethod.COMMON, len(response_body),
+                               *bytes.fromhex(header.IMEI), header.NUMBER) + response_body
+
+    if header.METHOD == ClientMethod.LOCATION_REPORT:
+        obj = struct.unpack('>4L3H6B', body[:28])
+        body = Location(obj[0], obj[1], obj[2] / 1000000, obj[3] / 1000000, obj[4], obj[5], obj[6],
+                        datetime.strptime(bytearray(obj[7:]).hex(), '%y%m%d%H%M%S'))
+
+    return header, response, body
+
+
+def parse(packet: bytearray):
+    header, response, body = Parser.parse(packet)
+    if header.METHOD == ClientMethod.LOCATION_REPORT:
+        body = Location.unmarshal(body)
+    return header, response, body
+
+
+def bench(func, packet: bytearray, seconds: float = 0.5) -> float:
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for _ in range(1000):
+            func(packet)
+        count += 1000
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    for name, frame in FRAMES.items():
+        packet = bytearray(frame)
+        old, new = legacy_parse(packet), parse(packet)
+        assert old[0] == new[0] and old[1] == new[1], name
+        assert Header.unmarshal(old[0].marshal()) == old[0], name
+        if isinstance(old[2], Location):
+            assert old[2] == new[2], name
+
+        old = bench(legacy_parse, packet)
+        new = bench(parse, packet)
+        print(f'{name:<16} legacy {old:>10,.0f} msg/s  struct.Struct {new:>10,.0f} msg/s  x{new / old:.2f}')
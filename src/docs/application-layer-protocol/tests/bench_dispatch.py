@@ -0,0 +1,128 @@
+'''
+Date: 2026.10.18 13:09
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 14:10
+'''
+import argparse
+import time
+from binascii import unhexlify
+
+import transcode
+from metrics import MALFORMED, Metrics
+from protocol import ClientMethod, Dispatcher, Header, Location, Parser, Symbol
+
+FRAMES = {
+    'register': unhexlify(
+        b'010000307360802475620000000000004A435A4E53476574636861726D736D'
+        b'61727430303030303030433132303030300056494E0000000000000000A4'),
+    'authentication': unhexlify(b'01020005736080247562000149006246458F'),
+    'location_report': unhexlify(
+        b'0200001C73608024756200100000000000100003015834BA06C9D86B'
+        b'00200000012418121916465505'),
+    'heartbeat': unhexlify(b'000200007360802475620010B2'),
+    'unknown': unhexlify(b'0f0000007360802475620010bf'),
+}
+
+
+class LegacyParser(Parser):
+    '''改造前 _handle 中的 if 分支写法，位置汇报之外的消息不做处理'''
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.handler = lambda header, message: None
+
+    def _handle(self, packet: bytearray):
+        header, body = self.decode(packet)
+        if header is None:
+            return
+
+        location = None
+        if header.METHOD == ClientMethod.LOCATION_REPORT:
+            location = Location.unmarshal(body)
+
+        self.handler(header, location)
+        self._send(self.respond(header, self._hex_encoded))
+
+
+def check():
+    calls = []
+    dispatcher = Dispatcher()
+    dispatcher.register(ClientMethod.LOCATION_REPORT, lambda header, location: calls.append(location),
+                        decode=True)
+    dispatcher.register(ClientMethod.LOCATION_REPORT, lambda header, body: calls.append(bytes(body)))
+
+    @dispatcher.register(ClientMethod.HEARTBEAT)
+    def heartbeat(header, body):
+        calls.append(header.METHOD)
+
+    replies = []
+    parser = Parser(send=replies.append, hex_encoded=False, dispatcher=dispatcher)
+    for frame in FRAMES.values():
+        parser._handle(bytearray(frame))
+    parser.flush()
+
+    body = FRAMES['location_report'][12:-1]
+    assert calls == [Location.unmarshal(body), body, ClientMethod.HEARTBEAT]
+    # 未注册的消息照常应答
+    assert len(replies) == 1 and replies[0].count(Symbol.STOP) == 2 * len(FRAMES)
+
+    try:
+        dispatcher.register(ClientMethod.HEARTBEAT, heartbeat, decode=True)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('decode without decoder should be rejected')
+
+    # 消息体解码失败或者处理函数出错都只影响这一条消息，同一次读取中的其他消息照常应答
+    metrics = Metrics()
+    dispatcher = Dispatcher(metrics)
+    dispatcher.register(ClientMethod.LOCATION_REPORT, lambda header, location: None, decode=True)
+    dispatcher.register(ClientMethod.AUTHENTICATION, lambda header, body: 1 / 0)
+    heartbeat = transcode.pack(Header(ClientMethod.HEARTBEAT, 0, '736080247562', 1).marshal())
+    short = transcode.pack(Header(ClientMethod.LOCATION_REPORT, 4, '736080247562', 2).marshal() + b'\0' * 4)
+    replies = []
+    parser = Parser(send=replies.append, hex_encoded=False, dispatcher=dispatcher, metrics=metrics)
+    parser.put(heartbeat + short + b'\x7e' + FRAMES['authentication'] + b'\x7e' + heartbeat)
+    assert len(replies) == 1 and replies[0].count(Symbol.STOP) == 2 * 4, replies
+    assert dispatcher.malformed == 1 and dispatcher.errors == 1
+    assert metrics.counters[ClientMethod.LOCATION_REPORT][MALFORMED] == 1
+
+
+def bench(parser: Parser, frame: bytes, count: int) -> float:
+    handle, packet = parser._handle, bytearray(frame)
+    start = time.perf_counter()
+    for _ in range(count):
+        handle(packet)
+    return (time.perf_counter() - start) / count * 1e9
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=200000)
+    args = parser.parse_args()
+
+    check()
+
+    noop = lambda header, message: None
+    sink = lambda data: None
+    empty = Dispatcher()
+    raw = Dispatcher()
+    decoded = Dispatcher()
+    for method in ClientMethod:
+        raw.register(method, noop)
+    for method in ClientMethod:
+        decoded.register(method, noop, decode=method in Dispatcher.decoders)
+
+    parsers = {
+        'legacy if': LegacyParser(send=sink, hex_encoded=False, flush_threshold=0),
+        'no handlers': Parser(send=sink, hex_encoded=False, flush_threshold=0, dispatcher=empty),
+        'raw handler': Parser(send=sink, hex_encoded=False, flush_threshold=0, dispatcher=raw),
+        'decoded handler': Parser(send=sink, hex_encoded=False, flush_threshold=0, dispatcher=decoded),
+    }
+    parsers['legacy if'].handler = noop
+
+    print(f'{"ns/frame":<16}' + ''.join(f'{name:>17}' for name in FRAMES))
+    for name, instance in parsers.items():
+        print(f'{name:<16}' + ''.join(f'{bench(instance, frame, args.count):17.0f}'
+                                      for frame in FRAMES.values()))
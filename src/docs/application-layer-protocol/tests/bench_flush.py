@@ -0,0 +1,116 @@
+'''
+Date: 2026.10.18 13:10
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 14:09
+'''
+import argparse
+import socket
+import threading
+import time
+from binascii import unhexlify
+
+from protocol import Dispatcher, Parser
+
+FRAMES = unhexlify(
+    b'7E01020005736080247562000149006246458F7E'
+    b'7E0200001C73608024756200100000000000100003015834BA06C9D86B002000000124181219164655057E'
+    b'7E000200007360802475620010B27E'
+    b'7E0200001C73608024756200110000000000100003015834BA06C9D86B002000000124181219164656077E'
+)
+COUNT = 4
+
+
+class CountingSocket(socket.socket):
+    '''统计写系统调用次数'''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = 0
+
+    def sendall(self, data, *args):
+        self.calls += 1
+        return super().sendall(data, *args)
+
+    def sendmsg(self, buffers, *args):
+        self.calls += 1
+        return super().sendmsg(buffers, *args)
+
+
+def pair():
+    left, right = socket.socketpair()
+    sock = CountingSocket(left.family, left.type, fileno=left.detach())
+    return sock, right
+
+
+def drain(sock: socket.socket, received: bytearray):
+    while True:
+        data = sock.recv(1 << 20)
+        if not data:
+            return
+        received += data
+
+
+class FailingDispatcher(object):
+    '''第二条消息的处理出错'''
+
+    def __init__(self):
+        self.count = 0
+
+    def dispatch(self, header, body):
+        self.count += 1
+        if self.count == 2:
+            raise ValueError('handler failed')
+
+
+def check():
+    # 同一次读取中后面的帧出错，前面攒下的应答照样发出
+    replies = []
+    parser = Parser(send=replies.append, hex_encoded=False, dispatcher=FailingDispatcher())
+    try:
+        parser.put(FRAMES)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('the handler error should propagate')
+    assert len(replies) == 1 and replies[0].count(b'\x7e') == 2, replies
+
+
+def run(batches: int, pipeline: int, flush_threshold: int):
+    sock, peer = pair()
+    received = bytearray()
+    reader = threading.Thread(target=drain, args=(peer, received))
+    reader.start()
+
+    # 每次 put 模拟一次读取，里面包含 pipeline 组连续发送的消息
+    chunk = FRAMES * pipeline
+    parser = Parser(sock, hex_encoded=False, dispatcher=Dispatcher(), flush_threshold=flush_threshold)
+    start = time.perf_counter()
+    for _ in range(batches):
+        parser.put(chunk)
+    elapsed = time.perf_counter() - start
+
+    sock.shutdown(socket.SHUT_WR)
+    reader.join()
+    sock.close()
+    peer.close()
+    return sock.calls, bytes(received), elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=200000)
+    args = parser.parse_args()
+
+    check()
+
+    print(f'{"pipeline":>8} {"mode":>10} {"syscalls/msg":>13} {"msgs/s":>11}')
+    for pipeline in (1, 4, 16, 64):
+        batches = args.messages // (COUNT * pipeline)
+        messages = batches * COUNT * pipeline
+        results = {}
+        for mode, threshold in (('each', 0), ('coalesced', 1 << 16)):
+            calls, received, elapsed = run(batches, pipeline, threshold)
+            results[mode] = received
+            print(f'{pipeline * COUNT:>8} {mode:>10} {calls / messages:>13.3f} {messages / elapsed:>11,.0f}')
+        assert results['each'] == results['coalesced']
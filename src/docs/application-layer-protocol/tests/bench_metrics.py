@@ -0,0 +1,128 @@
+'''
+Date: 2026.10.18 13:17
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:55
+'''
+import argparse
+import io
+import logging
+import random
+import time
+from binascii import unhexlify
+
+import transcode
+from metrics import Histogram, Metrics
+from protocol import ClientMethod, Dispatcher, Header, Parser
+
+FRAMES = unhexlify(
+    b'7E01020005736080247562000149006246458F7E'
+    b'7E0200001C73608024756200100000000000100003015834BA06C9D86B002000000124181219164655057E'
+    b'7E000200007360802475620010B27E'
+    b'7E0200001C73608024756200110000000000100003015834BA06C9D86B002000000124181219164656077E'
+    b'7E000200007360802475620011B37E'
+)
+
+
+def check():
+    rng = random.Random(808)
+    values = [int(rng.lognormvariate(10, 2)) for _ in range(100000)]
+    histogram = Histogram()
+    for value in values:
+        histogram.record(value)
+
+    values.sort()
+    for p in (1, 50, 90, 99, 99.9, 100):
+        expect = values[max(0, int(-(-len(values) * p // 100)) - 1)]
+        found = histogram.percentile(p)
+        assert found <= expect and expect - found <= expect / 32, (p, expect, found)
+    assert histogram.count == len(values) and histogram.max == values[-1]
+
+    metrics = Metrics(sample=1)
+    parser = Parser(send=lambda data: None, hex_encoded=False, dispatcher=Dispatcher(), metrics=metrics)
+    parser.put(FRAMES)
+    # 校验码错误
+    parser.put(unhexlify(b'7E000200007360802475620010B47E'))
+    counters = metrics.counters
+    assert counters[ClientMethod.LOCATION_REPORT][0] == 2
+    assert counters[ClientMethod.HEARTBEAT][0] == 2 and counters[ClientMethod.HEARTBEAT][2] == 1
+    assert counters[ClientMethod.HEARTBEAT][4] == 0
+    # 流水号 0x7e7d 转义后多出两个字节
+    parser.put(transcode.pack(Header(ClientMethod.HEARTBEAT, 0, '736080247562', 0x7e7d).marshal()))
+    assert counters[ClientMethod.HEARTBEAT][0] == 3 and counters[ClientMethod.HEARTBEAT][4] == 2
+    assert metrics.parse.count == 0
+    metrics.commit()
+    assert metrics.parse.count == metrics.reply.count == 6
+
+    # 采样时计数器不受影响，每 sample 帧计时一次
+    metrics = Metrics(sample=4)
+    parser = Parser(send=lambda data: None, hex_encoded=False, dispatcher=Dispatcher(), metrics=metrics)
+    for _ in range(4):
+        parser.put(FRAMES)
+    assert metrics.counters[ClientMethod.LOCATION_REPORT][0] == 8
+    assert 'parse p50 0.0 us' not in metrics.summary() and metrics.parse.count == 5
+
+    # 批量写入与逐个写入的结果相同，超出范围的值同样截断
+    single, batch = Histogram(bits=20), Histogram(bits=20)
+    values = [rng.randrange(1 << 22) for _ in range(5000)]
+    for value in values:
+        single.record(value)
+    batch.record_many(values)
+    assert (batch.counts, batch.count, batch.total, batch.max) == \
+        (single.counts, single.count, single.total, single.max)
+
+
+def bench(parser: Parser, data: bytes, seconds: float = 1.0) -> float:
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        parser.put(data)
+        count += 1
+    return count * 5 / (time.perf_counter() - start)
+
+
+class LoggingParser(Parser):
+    '''改造前 server.py 每次读取都格式化一条 info 日志'''
+
+    def __init__(self, log: logging.Logger, **kwargs):
+        super().__init__(**kwargs)
+        self._log = log
+
+    def put(self, symbols: bytes):
+        self._log.info(f'[recv] {repr(symbols)}')
+        super().put(symbols)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=4, help='per parser, over all rounds')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    check()
+
+    log = logging.getLogger('bench')
+    log.addHandler(logging.StreamHandler(io.StringIO()))
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+    options = dict(send=lambda data: None, hex_encoded=False, dispatcher=Dispatcher())
+    parsers = (
+        ('no metrics', Parser(**options)),
+        ('metrics', Parser(metrics=Metrics(), **options)),
+        ('metrics, time all', Parser(metrics=Metrics(sample=1), **options)),
+        ('info log per read', LoggingParser(log, **options)),
+    )
+    # 交替运行多轮取最好成绩，减少机器负载波动的影响
+    best = [0.0] * len(parsers)
+    for _ in range(args.rounds):
+        for i, (name, instance) in enumerate(parsers):
+            best[i] = max(best[i], bench(instance, FRAMES, args.seconds / args.rounds))
+    for (name, instance), rate in zip(parsers, best):
+        print(f'{name:<18} {rate:>10,.0f} frames/s')
+
+    histogram = Histogram()
+    values = [random.randrange(1 << 30) for _ in range(1000000)]
+    start = time.perf_counter()
+    for value in values:
+        histogram.record(value)
+    print(f'histogram record {(time.perf_counter() - start) / len(values) * 1e9:.0f} ns')
@@ -0,0 +1,56 @@
+'''
+Date: 2026.10.18 13:15
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:15
+'''
+import argparse
+import asyncio
+import logging
+import time
+
+import loadgen
+from pkgs.logger import log
+from protocol import ClientMethod
+from server import Server
+
+
+async def run(args, pipeline: int):
+    server = Server(args.host, args.port, 1 << 20, 'hex', pipeline=pipeline)
+    # 模拟写数据库等较慢的业务处理
+    server.dispatcher.register(ClientMethod.LOCATION_REPORT,
+                               lambda header, location: time.sleep(args.delay / 1000), decode=True)
+
+    listener = await server.start()
+    try:
+        await loadgen.main(args)
+    finally:
+        listener.close()
+        await listener.wait_closed()
+        server.close()
+
+    if server.pipeline is not None:
+        print('pipeline: depth {depth}, max depth {max_depth}, processed {processed}, pauses {pauses}, '
+              'end-to-end p50 {p50_ms:.2f} ms, p99 {p99_ms:.2f} ms, max {max_ms:.2f} ms'
+              .format(**server.pipeline.stats()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ack latency with a slow handler, inline vs pipelined')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12352)
+    parser.add_argument('--transport', default='hex')
+    parser.add_argument('--terminals', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=1000, help='messages per second, all terminals')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--linger', type=float, default=2)
+    parser.add_argument('--mix', default='location_report=8,heartbeat=2')
+    parser.add_argument('--seed', type=int, default=808)
+    parser.add_argument('--delay', type=float, default=0.5, help='ms spent in the slow handler')
+    parser.add_argument('--capacity', type=int, default=1024)
+    args = parser.parse_args()
+
+    log.setLevel(logging.WARNING)
+    for name, capacity in (('inline', 0), ('pipeline', args.capacity)):
+        print(f'--- {name}')
+        asyncio.run(run(args, capacity))
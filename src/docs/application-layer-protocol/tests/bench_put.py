@@ -0,0 +1,110 @@
+'''
+Date: 2026.10.18 12:51
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:01
+'''
+import random
+import time
+from binascii import unhexlify
+
+from protocol import Parser, State, Symbol
+
+FRAMES = unhexlify(
+    b'7e0102000573608155441500015091529468fe7e'
+    b'7E010000307360802475620000000000004A435A4E53476574636861726D736D'
+    b'61727430303030303030433132303030300056494E0000000000000000A47E'
+    b'7E01020005736080247562000149006246458F7E'
+    b'7E000200007360802475620010B27E'
+)
+
+
+class LegacyParser(Parser):
+    '''逐字节状态机，用作对照'''
+
+    _table = {
+        State.START: [State.START, State.STOP, State.ESCAPE, State.CONTINUE],
+        State.STOP: [State.START, State.STOP, State.STOP, State.STOP],
+        State.ESCAPE: [State.CONTINUE, State.CONTINUE, State.CONTINUE, State.CONTINUE],
+        State.CONTINUE: [State.START, State.STOP, State.ESCAPE, State.CONTINUE],
+    }
+
+    def _get_index(self, symbol):
+        if self._state != State.STOP:
+            return {
+                Symbol.STOP: 1,
+                Symbol.ESCAPE: 2,
+            }.get(symbol, 3)
+
+        return {
+            Symbol.START: 0,
+            Symbol.ESCAPE: 2,
+        }.get(symbol, 3)
+
+    def _put(self, symbol: int):
+        self._state = self._table[self._state][self._get_index(symbol)]
+
+        if self._state == State.START:
+            self._packet.clear()
+        elif self._state == State.STOP:
+            if self._packet:
+                self._handle(self._packet)
+                self._packet.clear()
+        elif self._state >= State.ESCAPE:
+            self._packet.append(symbol)
+
+    def put(self, symbols: bytes):
+        for symbol in symbols:
+            self._put(symbol)
+
+
+def collect(cls):
+    frames = []
+    parser = cls(send=lambda data: None)
+    parser._handle = lambda packet: frames.append(bytes(packet))
+    return parser, frames
+
+
+def check(rounds: int = 2000):
+    rng = random.Random(808)
+    alphabet = b'\x7e\x7d\x01\x02\x30'
+
+    for _ in range(rounds):
+        stream = bytes(rng.choice(alphabet) for _ in range(rng.randint(0, 64)))
+        old, old_frames = collect(LegacyParser)
+        new, new_frames = collect(Parser)
+
+        old.put(stream)
+        pos = 0
+        while pos < len(stream):
+            step = rng.randint(1, 8)
+            new.put(stream[pos:pos + step])
+            pos += step
+
+        assert old_frames == new_frames, stream.hex()
+        assert old._packet == new._packet, stream.hex()
+
+
+def bench(cls, stream: bytes, chunk: int, seconds: float = 1.0) -> float:
+    chunks = [stream[i:i + chunk] for i in range(0, len(stream), chunk)]
+    parser, _ = collect(cls)
+    parser._handle = lambda packet: None
+
+    total, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for data in chunks:
+            parser.put(data)
+        total += len(stream)
+
+    return total / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    check()
+
+    stream = FRAMES * 256
+    for chunk in (64, 1024, 65536):
+        old = bench(LegacyParser, stream, chunk)
+        new = bench(Parser, stream, chunk)
+        print(f'chunk={chunk:>6}  legacy {old / 1e6:8.2f} MB/s  '
+              f'scanner {new / 1e6:8.2f} MB/s  x{new / old:.1f}')
@@ -0,0 +1,146 @@
+'''
+Date: 2026.10.18 13:21
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 14:09
+'''
+import argparse
+import os
+import random
+import struct
+import time
+import tracemalloc
+
+import transcode
+from protocol import SUBPACKAGE, Dispatcher, Header, Parser
+from reassembly import ENTRY_OVERHEAD, Reassembler
+
+# 多媒体数据上传
+METHOD = 0x0801
+IMEI = '736080247562'
+
+
+def segments(data: bytes, size: int, serial: int = 1):
+    total = -(-len(data) // size)
+    for i in range(total):
+        chunk = data[i * size:(i + 1) * size]
+        header = Header(METHOD, SUBPACKAGE | len(chunk), IMEI, (serial + i) & 0xffff)
+        yield i + 1, transcode.pack(header.marshal() + struct.pack('>2H', total, i + 1) + chunk)
+
+
+def check():
+    rng = random.Random(808)
+
+    # 乱序、重传、末包先到
+    for size in (1, 7, 1023):
+        data = os.urandom(rng.randrange(1, 50000))
+        frames = list(segments(data, size, serial=0xfff0))
+        rng.shuffle(frames)
+        frames += rng.sample(frames, min(5, len(frames) - 1))
+
+        received, replies = [], []
+        dispatcher = Dispatcher()
+        dispatcher.register(METHOD, lambda header, body: received.append((header, bytes(body))))
+        parser = Parser(send=replies.append, hex_encoded=False, dispatcher=dispatcher)
+        parser.put(b''.join(frame for _, frame in frames))
+
+        assert len(received) == 1 and received[0][1] == data, size
+        assert received[0][0].NUMBER == 0xfff0 and not received[0][0].LENGTH & SUBPACKAGE
+        assert len(parser._reassembler) == 0 and parser._reassembler.allocated == 0
+        # 每个分包都有应答
+        assert b''.join(replies).count(b'\x7e') == 2 * len(frames)
+
+    # 分包长度不一致
+    reassembler = Reassembler()
+    header = Header(METHOD, SUBPACKAGE, IMEI, 10)
+    parts = [b'a' * 5, b'b' * 3, b'c' * 8]
+    for index in (3, 1):
+        assert reassembler.add(header._replace(NUMBER=9 + index), 3, index, memoryview(parts[index - 1])) is None
+    _, body = reassembler.add(header._replace(NUMBER=11), 3, 2, memoryview(parts[1]))
+    assert bytes(body) == b''.join(parts) and reassembler.allocated == 0
+
+    # 超时和内存上限，每条消息还要计入 seen 和固定开销
+    reassembler = Reassembler(capacity=2 * (1200 + 4 + ENTRY_OVERHEAD), ttl=10)
+    for serial in range(0, 40, 4):
+        reassembler.add(header._replace(NUMBER=serial), 4, 1, memoryview(b'x' * 300), now=serial)
+    assert reassembler.allocated <= reassembler.capacity and reassembler.dropped == 8 and len(reassembler) == 2
+    assert reassembler.expire(now=45) == 1 and reassembler.expire(now=60) == 1
+    assert reassembler.allocated == 0
+
+    # 包总数由终端填写，超过上限的消息在分配缓冲区之前就被丢弃
+    reassembler = Reassembler(capacity=1 << 20)
+    tracemalloc.start()
+    for serial in range(50):
+        reassembler.add(header._replace(NUMBER=serial), 65535, 1, memoryview(b'x' * 1000), now=0)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < 1 << 20, peak
+    assert reassembler.allocated == 0 and len(reassembler) == 0 and reassembler.dropped == 50
+
+    # 放得下但超出剩余空间时，先丢弃最早的其他消息再分配
+    reassembler = Reassembler(capacity=10000)
+    reassembler.add(header._replace(NUMBER=0), 8, 1, memoryview(b'x' * 1000), now=0)
+    reassembler.add(header._replace(NUMBER=100), 6, 1, memoryview(b'y' * 1000), now=1)
+    assert reassembler.allocated == 6000 + 6 + ENTRY_OVERHEAD and len(reassembler) == 1
+    assert reassembler.dropped == 1
+
+    # 只发末包、消息体为空也要计入占用；单个终端和总的未完成消息数都有上限
+    reassembler = Reassembler(capacity=1 << 20)
+    tracemalloc.start()
+    for serial in range(5000):
+        reassembler.add(header._replace(NUMBER=serial), 65535, 65535, memoryview(b''), now=0)
+    for terminal in range(5000):
+        reassembler.add(header._replace(IMEI=f'{terminal:012x}'), 65535, 65535, memoryview(b''), now=0)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < 2 << 20, peak
+    assert 0 < reassembler.allocated <= reassembler.capacity
+    assert len(reassembler) == reassembler.capacity // (65535 + ENTRY_OVERHEAD)
+    assert sum(key[0] == IMEI for key in reassembler._pending) <= reassembler.per_terminal
+
+    reassembler = Reassembler(limit=3)
+    for terminal in range(5):
+        reassembler.add(header._replace(IMEI=f'{terminal:012x}'), 2, 2, memoryview(b'x'), now=0)
+    assert len(reassembler) == 3 and reassembler.dropped == 2
+
+    # 除末包外的空分包无法确定每包长度
+    reassembler = Reassembler()
+    assert reassembler.add(header, 4, 1, memoryview(b''), now=0) is None
+    assert reassembler.invalid == 1 and len(reassembler) == 0 and reassembler.allocated == 0
+
+
+def naive(frames) -> bytes:
+    '''按到达顺序把分包追加到 bytes 上，每追加一包都复制一遍已有数据'''
+    data = b''
+    for frame in frames:
+        data += bytes(transcode.unpack(frame)[16:])
+    return data
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=1 << 20, help='bytes per upload')
+    parser.add_argument('--segment', type=int, default=1023)
+    args = parser.parse_args()
+
+    check()
+
+    data = os.urandom(args.size)
+    frames = [frame for _, frame in segments(data, args.segment)]
+    stream = b''.join(frames)
+
+    received = []
+    dispatcher = Dispatcher()
+    dispatcher.register(METHOD, lambda header, body: received.append(len(body)))
+    instance = Parser(send=lambda reply: None, hex_encoded=False, dispatcher=dispatcher)
+
+    start = time.perf_counter()
+    instance.put(stream)
+    elapsed = time.perf_counter() - start
+    assert received == [len(data)]
+    print(f'{len(frames)} segments, {args.size / elapsed / 1e6:.1f} MB/s through Parser with reassembly')
+
+    start = time.perf_counter()
+    assert naive(frames) == data
+    elapsed = time.perf_counter() - start
+    print(f'naive in-order concatenation {args.size / elapsed / 1e6:.1f} MB/s')
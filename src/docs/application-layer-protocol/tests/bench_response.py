@@ -0,0 +1,60 @@
+'''
+Date: 2026.10.18 12:58
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:58
+'''
+import random
+import struct
+import time
+
+from protocol import ClientMethod, Header, Parser
+
+
+def check(rounds: int = 20000):
+    rng = random.Random(808)
+    methods = [*ClientMethod, 0x7d7e, 0x0704]
+    # 流水号和 IMEI 里特意混入需要转义的字节
+    choices = [0x00, 0x01, 0x02, 0x7d, 0x7e, 0x55, 0xff]
+
+    for _ in range(rounds):
+        imei = bytes(rng.choice(choices) for _ in range(6)).hex()
+        number = rng.choice(choices) << 8 | rng.choice(choices)
+        header = Header(rng.choice(methods), 0, imei, number)
+
+        expect = Parser.combine(Parser.response(header))
+        assert Parser.respond(header) == expect, header
+
+    # 长度不对的 IMEI 不能被截断或补零后继续应答
+    for imei in ('0102030405', '01020304050607'):
+        for func in (Parser.response, Parser.respond):
+            try:
+                func(Header(ClientMethod.HEARTBEAT, 0, imei, 1))
+            except struct.error:
+                continue
+            raise AssertionError((func, imei))
+
+
+def bench(func, headers, seconds: float = 1.0) -> float:
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for header in headers:
+            func(header)
+        count += len(headers)
+    return count / (time.perf_counter() - start)
+
+
+def combine(header: Header) -> bytes:
+    return Parser.combine(Parser.response(header))
+
+
+if __name__ == '__main__':
+    check()
+
+    rng = random.Random(808)
+    terminals = [rng.getrandbits(48).to_bytes(6, 'big').hex() for _ in range(1000)]
+    headers = [Header(ClientMethod.HEARTBEAT, 0, rng.choice(terminals), i & 0xffff) for i in range(10000)]
+
+    old = bench(combine, headers)
+    new = bench(Parser.respond, headers)
+    print(f'combine {old:>10,.0f} resp/s  template {new:>10,.0f} resp/s  x{new / old:.1f}')
@@ -0,0 +1,121 @@
+'''
+Date: 2026.10.18 13:19
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 14:00
+'''
+import argparse
+import random
+import struct
+import time
+from datetime import datetime, timedelta
+
+import schema
+from protocol import ClientMethod, Header, Location, bcd_to_datetime, bcd_to_epoch, datetime_to_bcd
+
+_HEADER = struct.Struct('>2H6sH')
+_LOCATION = struct.Struct('>4L3H6s')
+
+
+# 改用 schema 生成之前的手写版本
+def header_marshal(self: Header) -> bytes:
+    return _HEADER.pack(self.METHOD, self.LENGTH, bytes.fromhex(self.IMEI), self.NUMBER)
+
+
+def header_unmarshal(header: bytes, offset: int = 0) -> Header:
+    method, length, imei, number = _HEADER.unpack_from(header, offset)
+    return Header(method, length, imei.hex(), number)
+
+
+def location_marshal(self: Location) -> bytes:
+    return _LOCATION.pack(self.ALARM_SIGN, self.STATE, round(self.LATITUDE * 1000000),
+                          round(self.LONGITUDE * 1000000), self.ALTITUDE, self.SPEED,
+                          self.DIRECTION, datetime_to_bcd(self.DATETIME))
+
+
+def location_unmarshal(location: bytes, offset: int = 0, epoch: bool = False) -> Location:
+    obj = _LOCATION.unpack_from(location, offset)
+    return Location(obj[0], obj[1], obj[2] / 1000000, obj[3] / 1000000, obj[4], obj[5], obj[6],
+                    bcd_to_epoch(obj[7]) if epoch else bcd_to_datetime(obj[7]))
+
+
+def samples(count: int):
+    rng = random.Random(808)
+    start = datetime(2021, 11, 15)
+    headers = [Header(rng.choice((0x0100, 0x0102, 0x0200, 0x0002)), rng.randrange(1024),
+                      f'{rng.getrandbits(48):012x}', rng.randrange(0x10000)) for _ in range(count)]
+    locations = [Location(rng.getrandbits(32), rng.getrandbits(32), round(rng.uniform(0, 90), 6),
+                          round(rng.uniform(0, 180), 6), rng.randrange(9000), rng.randrange(2000),
+                          rng.randrange(360), start + timedelta(seconds=rng.randrange(86400)))
+                 for _ in range(count)]
+    return headers, locations
+
+
+def check():
+    headers, locations = samples(5000)
+
+    for header in headers:
+        data = header_marshal(header)
+        assert Header.marshal(header) == data
+        assert Header.unmarshal(data) == header_unmarshal(data) == header
+        assert Header.unmarshal(b'\x00' + data, 1) == header
+
+    for location in locations:
+        data = location_marshal(location)
+        assert location.marshal() == data
+        assert Location.unmarshal(data) == location_unmarshal(data) == location
+        assert Location.unmarshal(data, epoch=True) == location_unmarshal(data, epoch=True)
+
+    # 单字段消息和布局不匹配
+    class Single(tuple):
+        _fields = ('VALUE',)
+
+    codec = schema.Codec(Single, {'VALUE': schema.U16})
+    assert codec.unmarshal(b'\x01\x02') == (0x0102,) and codec.marshal((0x0102,)) == b'\x01\x02'
+    try:
+        schema.Codec(Single, {'OTHER': schema.U16})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('mismatched schema should be rejected')
+
+    # 与手写编码一样拒绝长度不对的 IMEI，不截断也不补零
+    for imei in ('0102030405', '01020304050607'):
+        try:
+            Header(ClientMethod.HEARTBEAT, 0, imei, 1).marshal()
+        except struct.error:
+            continue
+        raise AssertionError(imei)
+
+
+def bench(function, items, repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            function(item)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items) * 1e9
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=100000)
+    args = parser.parse_args()
+
+    check()
+
+    headers, locations = samples(args.count)
+    header_data = [header.marshal() for header in headers]
+    location_data = [location.marshal() for location in locations]
+
+    print(f'{"ns/op":<26} {"hand-written":>12} {"generated":>10}')
+    for name, old, new, items in (
+            ('Header.unmarshal', header_unmarshal, Header.unmarshal, header_data),
+            ('Header.marshal', header_marshal, Header.marshal, headers),
+            ('Location.unmarshal', location_unmarshal, Location.unmarshal, location_data),
+            ('Location.unmarshal epoch', lambda data: location_unmarshal(data, epoch=True),
+             lambda data: Location.unmarshal(data, epoch=True), location_data),
+            ('Location.marshal', location_marshal, Location.marshal, locations),
+    ):
+        print(f'{name:<26} {bench(old, items):>12.0f} {bench(new, items):>10.0f}')
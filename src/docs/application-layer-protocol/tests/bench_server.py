@@ -0,0 +1,99 @@
+'''
+Date: 2026.10.18 12:54
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:01
+'''
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import resource
+import time
+from binascii import unhexlify
+
+from protocol import Parser
+
+HEARTBEAT = b'7E000200007360802475620010B27E'
+
+
+def rss(pid: int) -> int:
+    with open(f'/proc/{pid}/status') as fp:
+        for line in fp:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def raise_nofile():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def run_server(host: str, port: int):
+    from pkgs.logger import log
+    from server import Server
+
+    raise_nofile()
+    log.setLevel(logging.WARNING)
+    asyncio.run(Server(host, port, 1 << 20).serve_forever())
+
+
+async def connect(host: str, port: int, count: int, concurrency: int = 500):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            return await asyncio.open_connection(host, port)
+
+    return await asyncio.gather(*(one() for _ in range(count)))
+
+
+async def ping_pong(streams, seconds: float) -> int:
+    reply = Parser.combine(Parser.parse(bytearray(unhexlify(HEARTBEAT)[1:-1]))[1])
+    deadline = time.perf_counter() + seconds
+    counts = [0] * len(streams)
+
+    async def loop(i, reader, writer):
+        while time.perf_counter() < deadline:
+            writer.write(HEARTBEAT)
+            assert await reader.readexactly(len(reply)) == reply
+            counts[i] += 1
+
+    await asyncio.gather(*(loop(i, reader, writer) for i, (reader, writer) in enumerate(streams)))
+    return sum(counts)
+
+
+async def main(args):
+    process = multiprocessing.Process(target=run_server, args=(args.host, args.port), daemon=True)
+    process.start()
+    await asyncio.sleep(1)
+
+    base = rss(process.pid)
+    start = time.perf_counter()
+    streams = await connect(args.host, args.port, args.connections)
+    await asyncio.sleep(1)
+    idle = rss(process.pid)
+
+    print(f'{args.connections} connections in {time.perf_counter() - start:.2f}s, '
+          f'server rss {base / 1e6:.1f} MB -> {idle / 1e6:.1f} MB, '
+          f'{(idle - base) / args.connections / 1024:.2f} KB per idle connection')
+
+    count = await ping_pong(streams, args.seconds)
+    print(f'{count / args.seconds:,.0f} msg/s over {args.connections} connections')
+
+    for _, writer in streams:
+        writer.close()
+    process.terminate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12343)
+    parser.add_argument('--connections', type=int, default=10000)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    raise_nofile()
+    asyncio.run(main(args))
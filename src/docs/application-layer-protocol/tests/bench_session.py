@@ -0,0 +1,81 @@
+'''
+Date: 2026.10.18 13:04
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:57
+'''
+import argparse
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from protocol import ClientMethod, Header, Location
+from session import SessionTable
+
+
+def check():
+    table = SessionTable(capacity=3, ttl=10)
+    location = Location(0, 0, 22.5, 113.9, 30, 0, 0, datetime(2021, 11, 15))
+
+    table.update(Header(ClientMethod.REGISTER, 0, '000000000001', 1), now=0)
+    table.update(Header(ClientMethod.AUTHENTICATION, 0, '000000000001', 2), now=1)
+    table.update(Header(ClientMethod.LOCATION_REPORT, 0, '000000000001', 3), location, now=2)
+
+    session = table.get(bytes.fromhex('000000000001'))
+    assert session.registered and session.authenticated
+    assert session.serial == 3 and session.location == location
+
+    # 超出容量淘汰最久未活跃的终端
+    for i in range(2, 5):
+        table.update(Header(ClientMethod.HEARTBEAT, 0, f'{i:012x}', 1), now=3)
+    assert len(table) == 3 and bytes.fromhex('000000000001') not in table
+
+    # 过期淘汰，更新时顺带清理队首，其余由 expire 清理
+    table.update(Header(ClientMethod.HEARTBEAT, 0, f'{9:012x}', 1), now=20)
+    assert len(table) == 1
+    assert table.expire(now=40) == 1 and len(table) == 0
+
+    # 服务端定时清理时限制每次的数量，分多轮清空
+    table = SessionTable(capacity=100, ttl=10)
+    for i in range(50):
+        table.update(Header(ClientMethod.HEARTBEAT, 0, f'{i:012x}', 1), now=0)
+    assert table.expire(now=20, limit=32) == 32 and len(table) == 18
+    assert table.expire(now=20, limit=32) == 18 and len(table) == 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=1000000)
+    args = parser.parse_args()
+
+    check()
+
+    start = datetime(2021, 11, 15)
+    headers = [Header(ClientMethod.LOCATION_REPORT, 28, f'{i:012x}', i & 0xffff)
+               for i in range(args.entries)]
+
+    tracemalloc.start()
+    table = SessionTable(capacity=args.entries, ttl=3600)
+    before = tracemalloc.get_traced_memory()[0]
+
+    # 每个终端上报的位置各不相同，会话各自持有一份解码后的 Location
+    locations = [Location(0, 0x0c0003, 22.557882 + i / 1e6, 113.891435, 32, 0, 292,
+                          start + timedelta(seconds=i)) for i in range(args.entries)]
+    decoded = tracemalloc.get_traced_memory()[0]
+
+    now = time.perf_counter()
+    for header, location in zip(headers, locations):
+        table.update(header, location, now=now)
+    insert = time.perf_counter() - now
+
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    now = time.perf_counter()
+    for header, location in zip(headers, locations):
+        table.update(header, location, now=now)
+    update = time.perf_counter() - now
+
+    print(f'{len(table):,} sessions, {(after - decoded) / len(table):.0f} bytes per session '
+          f'+ {(decoded - before) / len(table):.0f} bytes per location, {(after - before) / 1e6:.1f} MB total')
+    print(f'insert {len(headers) / insert:,.0f}/s (under tracemalloc)  update {len(headers) / update:,.0f}/s')
@@ -0,0 +1,90 @@
+'''
+Date: 2026.10.18 13:07
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:07
+'''
+import argparse
+import random
+import time
+from datetime import datetime
+from math import cos, radians
+
+from protocol import Location
+from spatial import GridIndex
+
+# 深圳附近
+REGION = (22.4, 113.7, 22.9, 114.6)
+NOW = datetime(2021, 11, 15)
+
+
+def location(rng: random.Random) -> Location:
+    return Location(0, 0, round(rng.uniform(REGION[0], REGION[2]), 6),
+                    round(rng.uniform(REGION[1], REGION[3]), 6), 30, 0, 0, NOW)
+
+
+def check(count: int = 20000):
+    rng = random.Random(808)
+    index = GridIndex(cell=0.02)
+    latest = {}
+
+    for i in range(count * 2):
+        imei = f'{rng.randrange(count):012x}'
+        latest[imei] = location(rng)
+        index.update(imei, latest[imei])
+
+    for _ in range(200):
+        lat, lon = rng.uniform(REGION[0], REGION[2]), rng.uniform(REGION[1], REGION[3])
+        span = rng.choice((0.001, 0.05, 1.0))
+        box = (lat, lon, lat + span, lon + span)
+        expect = {imei for imei, loc in latest.items()
+                  if box[0] <= loc.LATITUDE <= box[2] and box[1] <= loc.LONGITUDE <= box[3]}
+        assert {imei for imei, _ in index.within(*box)} == expect
+
+        radius = rng.choice((100, 1000, 10000))
+        scale = cos(radians(lat))
+        expect = {imei for imei, loc in latest.items()
+                  if ((loc.LATITUDE - lat) ** 2 + ((loc.LONGITUDE - lon) * scale) ** 2) ** 0.5
+                  * 111320 <= radius * (1 + 1e-9)}
+        assert {imei for imei, _ in index.nearby(lat, lon, radius)} == expect
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vehicles', type=int, default=500000)
+    parser.add_argument('--cell', type=float, default=0.01)
+    args = parser.parse_args()
+
+    check()
+
+    rng = random.Random(808)
+    imeis = [f'{i:012x}' for i in range(args.vehicles)]
+    locations = [location(rng) for _ in range(args.vehicles)]
+    index = GridIndex(cell=args.cell)
+
+    start = time.perf_counter()
+    for imei, loc in zip(imeis, locations):
+        index.update(imei, loc)
+    elapsed = time.perf_counter() - start
+    print(f'{len(index):,} vehicles inserted, {args.vehicles / elapsed:,.0f} updates/s')
+
+    moves = [(rng.choice(imeis), location(rng)) for _ in range(200000)]
+    start = time.perf_counter()
+    for imei, loc in moves:
+        index.update(imei, loc)
+    elapsed = time.perf_counter() - start
+    print(f'moves {len(moves) / elapsed:,.0f} updates/s')
+
+    for name, query, params in (
+            ('bbox 1 km', index.within, lambda lat, lon: (lat, lon, lat + 0.009, lon + 0.01)),
+            ('bbox 5 km', index.within, lambda lat, lon: (lat, lon, lat + 0.045, lon + 0.05)),
+            ('radius 500 m', index.nearby, lambda lat, lon: (lat, lon, 500)),
+            ('radius 2 km', index.nearby, lambda lat, lon: (lat, lon, 2000)),
+    ):
+        points = [params(rng.uniform(REGION[0], REGION[2]), rng.uniform(REGION[1], REGION[3]))
+                  for _ in range(1000)]
+        found, start = 0, time.perf_counter()
+        for point in points:
+            found += len(query(*point))
+        elapsed = time.perf_counter() - start
+        print(f'{name:<13} {elapsed / len(points) * 1e6:8.1f} us/query, {found / len(points):.0f} hits')
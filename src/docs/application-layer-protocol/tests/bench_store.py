@@ -0,0 +1,121 @@
+'''
+Date: 2026.10.18 13:05
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:50
+'''
+import argparse
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from protocol import Location
+from store import LocationStore
+
+START = datetime(2021, 11, 15)
+
+
+def body(second: int, vehicle: int = 0) -> bytes:
+    return Location(0, 0x0c0003, 22.5 + vehicle / 1e6, 113.9, 30, 600, 90,
+                    START + timedelta(seconds=second)).marshal()
+
+
+def check():
+    rng = random.Random(808)
+    with tempfile.TemporaryDirectory() as directory:
+        store = LocationStore(directory, segment=1000, block=16, batch=64)
+        records = []
+        for i in range(5000):
+            imei, second = f'{rng.randrange(50):012x}', i // 10 + rng.randrange(-3, 4)
+            data = body(second, i)
+            store.append(imei, data)
+            records.append((imei, Location.unmarshal(data, epoch=True)))
+
+        def expect(imei, start, stop):
+            return [(location.DATETIME, Location.unmarshal(location.marshal()))
+                    for key, location in records if key == imei and start <= location.DATETIME <= stop]
+
+        base = records[0][1].DATETIME
+        for _ in range(100):
+            imei = f'{rng.randrange(50):012x}'
+            start = base + rng.randrange(500)
+            stop = start + rng.randrange(100)
+            assert list(store.query(imei, start, stop)) == expect(imei, start, stop)
+
+        # 重新打开后从段文件重建索引
+        store.close()
+        store = LocationStore(directory, segment=1000, block=16, batch=64)
+        assert len(store) == len(records)
+        assert list(store.query('000000000007', base, base + 600)) == expect('000000000007', base, base + 600)
+        store.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # 查询进行到一半时继续写入，后一次查询重新映射段文件，前一个查询仍能读完
+        store = LocationStore(directory, block=4, batch=1 << 20)
+        for i in range(8):
+            store.append('000000000001', body(i))
+        first = store.query('000000000001', 0, 0xffffffff)
+        assert next(first)[0] == Location.unmarshal(body(0), epoch=True).DATETIME
+        for i in range(8, 16):
+            store.append('000000000001', body(i))
+        assert len(list(store.query('000000000001', 0, 0xffffffff))) == 16
+        assert len(list(first)) == 7
+        store.close()
+
+        # 早于 1970 年的时间戳放不进 4 字节无符号字段
+        try:
+            store.append('000000000001', Location(0, 0, 0, 0, 0, 0, 0, datetime(1969, 12, 31)).marshal())
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('pre-1970 timestamp accepted')
+        assert len(store) == 16
+
+        # 没有新数据时由 tick 按 interval 写入
+        store = LocationStore(directory, batch=1 << 20, interval=0.05)
+        store.append('000000000002', body(0))
+        store.tick()
+        assert store._keys
+        time.sleep(0.06)
+        store.tick()
+        assert not store._keys
+        store.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=100000000)
+    parser.add_argument('--vehicles', type=int, default=100000)
+    parser.add_argument('--rate', type=int, default=10000, help='records per simulated second')
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--directory', default=None)
+    args = parser.parse_args()
+
+    check()
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        store = LocationStore(directory)
+        imeis = [f'{i:012x}' for i in range(args.vehicles)]
+
+        start = time.perf_counter()
+        data = None
+        for i in range(args.records):
+            if i % args.rate == 0:
+                data = body(i // args.rate)
+            store.append(imeis[i % args.vehicles], data)
+        store.flush()
+        elapsed = time.perf_counter() - start
+        print(f'ingest {args.records:,} records in {elapsed:.1f}s, {args.records / elapsed:,.0f} rec/s')
+
+        # 查询最后一小时的轨迹
+        stop = Location.unmarshal(data, epoch=True).DATETIME
+        rng = random.Random(808)
+        found, start = 0, time.perf_counter()
+        for _ in range(args.queries):
+            found += sum(1 for _ in store.query(rng.choice(imeis), stop - 3600, stop))
+        elapsed = time.perf_counter() - start
+        print(f'{args.queries} last-hour track queries, {elapsed / args.queries * 1000:.2f} ms each, '
+              f'{found / args.queries:.0f} points per track')
+
+        store.close()
@@ -0,0 +1,74 @@
+'''
+Date: 2026.10.18 13:01
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:01
+'''
+import random
+import time
+from functools import reduce
+from operator import xor
+
+import transcode
+
+_ESCAPE = (
+    (b'\x7d', b'\x7d\x01'),
+    (b'\x7e', b'\x7d\x02'),
+)
+
+
+def legacy_unpack(frame: bytes) -> bytearray:
+    '''两遍 replace 加 reduce，用作对照'''
+    packet = bytearray(frame[1:-1])
+    for key, value in _ESCAPE:
+        packet = packet.replace(value, key)
+    reduce(xor, packet[:-1])
+    return packet[:-1]
+
+
+def legacy_pack(payload: bytes) -> bytearray:
+    body = bytearray([*payload, reduce(xor, payload)])
+    for key, value in _ESCAPE:
+        body = body.replace(key, value)
+    return bytearray([0x7e, *body, 0x7e])
+
+
+def check(rounds: int = 5000):
+    rng = random.Random(808)
+
+    for _ in range(rounds):
+        payload = bytes(rng.choice(b'\x7d\x7e\x01\x02\x30') for _ in range(rng.randint(1, 64)))
+        frame = transcode.pack(payload)
+
+        assert frame == legacy_pack(payload), payload.hex()
+        assert transcode.unpack(frame) == payload, payload.hex()
+
+        broken = bytearray(frame)
+        broken[-2] ^= 0x40
+        assert transcode.unpack(broken) is None, payload.hex()
+
+
+def bench(func, data, seconds: float = 1.0) -> float:
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        func(data)
+        count += 1
+    return count * len(data) / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    check()
+
+    rng = random.Random(808)
+    for size in (1 << 10, 1 << 16, 1 << 20):
+        payload = rng.randbytes(size)
+        frame = bytes(transcode.pack(payload))
+
+        rows = (
+            ('unpack', legacy_unpack, transcode.unpack, frame),
+            ('pack', legacy_pack, transcode.pack, payload),
+        )
+        for name, old, new, data in rows:
+            old, new = bench(old, data), bench(new, data)
+            print(f'{size >> 10:>5} KB {name:<6}  legacy {old / 1e6:8.2f} MB/s  '
+                  f'transcode {new / 1e6:8.2f} MB/s  x{new / old:.1f}')
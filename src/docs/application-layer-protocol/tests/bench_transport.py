@@ -0,0 +1,100 @@
+'''
+Date: 2026.10.18 13:02
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:10
+'''
+import random
+import time
+from binascii import hexlify, unhexlify
+
+from protocol import Parser
+from transport import HexTransport, RawTransport
+
+FRAMES = unhexlify(
+    b'7e0102000573608155441500015091529468fe7e'
+    b'7E010000307360802475620000000000004A435A4E53476574636861726D736D'
+    b'61727430303030303030433132303030300056494E0000000000000000A47E'
+    b'7E01020005736080247562000149006246458F7E'
+    b'7E000200007360802475620010B27E'
+)
+
+
+def split(data: bytes, rng: random.Random):
+    pos = 0
+    while pos < len(data):
+        step = rng.randint(1, 1500)
+        yield data[pos:pos + step]
+        pos += step
+
+
+def run(cls, stream: bytes, chunks):
+    frames, replies = [], []
+    parser = Parser(send=replies.append, hex_encoded=cls.hex_encoded)
+    handle = parser._handle
+    parser._handle = lambda packet: (frames.append(bytes(packet)), handle(packet))
+    decoder = cls(parser.put)
+    for chunk in chunks:
+        decoder.feed(chunk)
+    return frames, replies
+
+
+def check():
+    rng = random.Random(808)
+    stream = FRAMES * 64
+
+    expect = run(RawTransport, stream, [stream])
+    assert len(expect[0]) == 4 * 64 and len(expect[1]) == 1
+
+    # 十六进制模式下任意位置切分，包括落在半个字节上
+    text = hexlify(stream)
+    for _ in range(50):
+        frames, replies = run(HexTransport, text, list(split(text, rng)))
+        assert frames == expect[0]
+        # 应答按每次 put 合并写出，切分方式不同时只比较拼接后的字节
+        assert unhexlify(b''.join(replies)) == b''.join(expect[1])
+
+    for _ in range(50):
+        frames, replies = run(RawTransport, stream, list(split(stream, rng)))
+        assert frames == expect[0] and b''.join(replies) == b''.join(expect[1])
+
+
+def bench(cls, data: bytes, seconds: float = 1.0) -> float:
+    chunks = [data[i:i + 1023] for i in range(0, len(data), 1023)]
+    decoder = cls(lambda frame: None)
+
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for chunk in chunks:
+            decoder.feed(chunk)
+        count += len(data)
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    check()
+
+    stream = FRAMES * 1024
+    text = hexlify(stream)
+
+    def legacy(data):
+        unhexlify(data)
+
+    # 原来的写法对奇数长度的读取直接抛出异常，这里的切分都是偶数长度
+    chunks = [text[i:i + 1024] for i in range(0, len(text), 1024)]
+    count, start = 0, time.perf_counter()
+    while time.perf_counter() - start < 1:
+        for chunk in chunks:
+            legacy(chunk)
+        count += len(text)
+    print(f'unhexlify   {count / (time.perf_counter() - start) / 1e6:8.2f} MB/s of hex input')
+
+    print(f'hex stage   {bench(HexTransport, text) / 1e6:8.2f} MB/s of hex input, odd 1023-byte reads')
+    print(f'raw stage   {bench(RawTransport, stream) / 1e6:8.2f} MB/s of binary input')
+
+    for cls, data in ((HexTransport, text), (RawTransport, stream)):
+        chunks = [data[i:i + 1023] for i in range(0, len(data), 1023)]
+        start = time.perf_counter()
+        frames, _ = run(cls, data, chunks)
+        elapsed = time.perf_counter() - start
+        print(f'{cls.__name__:<13} + Parser {len(frames) / elapsed:>10,.0f} frames/s')
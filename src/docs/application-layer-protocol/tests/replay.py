@@ -0,0 +1,186 @@
+'''
+Date: 2026.10.18 13:13
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:57
+'''
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+from capture import Capture, Recorder
+from protocol import ClientMethod, Dispatcher, Parser
+from transport import TRANSPORTS
+
+# 与服务端一样解码位置汇报，但不做持久化等业务处理
+DISPATCHER = Dispatcher()
+DISPATCHER.register(ClientMethod.LOCATION_REPORT, lambda header, location: None, decode=True)
+
+
+class TimedParser(Parser):
+    '''按消息 ID 统计解码、分发和应答的耗时
+
+    处理流程仍是 Parser._handle，这里只给 decode、分发和 respond 套上计时，
+    分包重组、按 flush_threshold 提前写出等行为与服务端一致
+    '''
+
+    def __init__(self, timings, **kwargs):
+        super().__init__(**kwargs)
+        self._timings = timings
+
+        dispatch = self._dispatch
+
+        def timed(header, body):
+            start = time.perf_counter()
+            dispatch(header, body)
+            timings[header.METHOD][2] += time.perf_counter() - start
+
+        self._dispatch = timed
+
+    def decode(self, packet: bytearray):
+        start = time.perf_counter()
+        header, body = Parser.decode(packet)
+        elapsed = time.perf_counter() - start
+
+        timing = self._timings['invalid' if header is None else header.METHOD]
+        timing[0] += 1
+        timing[1] += elapsed
+        return header, body
+
+    def respond(self, header, hex_encoded: bool = True) -> bytes:
+        start = time.perf_counter()
+        reply = Parser.respond(header, hex_encoded)
+        self._timings[header.METHOD][3] += time.perf_counter() - start
+        return reply
+
+
+def replay(capture: Capture, pace: float = 0, parser=Parser, **kwargs):
+    '''把抓包按连接喂给各自的 Parser，pace 为回放倍速，0 表示不等待'''
+    cls = TRANSPORTS[capture.transport]
+    decoders, parsers = {}, []
+    size = 0
+    begin = time.perf_counter()
+
+    for moment, connection, data in capture:
+        if pace:
+            delay = moment / pace - (time.perf_counter() - begin)
+            if delay > 0:
+                time.sleep(delay)
+
+        decoder = decoders.get(connection)
+        if not data:
+            decoders.pop(connection, None)
+            continue
+        if decoder is None:
+            instance = parser(send=lambda reply: None, hex_encoded=cls.hex_encoded,
+                              dispatcher=DISPATCHER, **kwargs)
+            parsers.append(instance)
+            decoder = decoders[connection] = cls(instance.put)
+
+        size += len(data)
+        decoder.feed(data)
+
+    elapsed = time.perf_counter() - begin
+    frames = sum(instance.frames for instance in parsers)
+    return frames, size, elapsed
+
+
+def name(method) -> str:
+    if isinstance(method, str):
+        return method
+    try:
+        return ClientMethod(method).name.lower()
+    except ValueError:
+        return f'0x{method:04x}'
+
+
+def synthesize(path: str, transport: str, terminals: int, messages: int, rate: float, seed: int):
+    '''没有生产环境抓包时，用 loadgen 的模拟终端生成一份'''
+    from loadgen import Stats, Terminal, parse_mix
+
+    rng = random.Random(seed)
+    methods, weights = parse_mix('location_report=8,heartbeat=2')
+    hex_encoded = TRANSPORTS[transport].hex_encoded
+    fleet = [Terminal(f'{0x736080000000 + i:012x}', Stats(), hex_encoded, random.Random(rng.getrandbits(64)))
+             for i in range(terminals)]
+
+    recorder = Recorder(path, transport)
+    moment = 0.0
+    for i, terminal in enumerate(fleet):
+        data = terminal.frame(ClientMethod.REGISTER) + terminal.frame(ClientMethod.AUTHENTICATION)
+        recorder.record(i, data, now=moment)
+
+    for _ in range(messages):
+        moment += rng.expovariate(rate)
+        i = rng.randrange(terminals)
+        # 偶尔一次读到几条连续发送的消息
+        count = 1 if rng.random() < 0.9 else rng.randint(2, 8)
+        data = b''.join(fleet[i].frame(rng.choices(methods, weights)[0]) for _ in range(count))
+        recorder.record(i, data, now=moment)
+
+    for i in range(terminals):
+        recorder.closed(i, now=moment)
+    recorder.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='replay a capture recorded by server.py --capture')
+    parser.add_argument('capture')
+    parser.add_argument('--pace', type=float, default=0,
+                        help='replay at this multiple of the recorded pacing, 0 for max speed')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', help='json file of a previous run to compare frames/s against')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    parser.add_argument('--save', help='write this run as a baseline json file')
+    parser.add_argument('--synthesize', type=int, default=0, metavar='MESSAGES',
+                        help='first write a synthetic capture of this many reads to the capture path')
+    parser.add_argument('--terminals', type=int, default=1000)
+    parser.add_argument('--transport', choices=TRANSPORTS, default='hex')
+    args = parser.parse_args()
+
+    if args.synthesize:
+        synthesize(args.capture, args.transport, args.terminals, args.synthesize, 1000, 808)
+
+    capture = Capture(args.capture)
+
+    # 吞吐量取多次回放中最好的一次
+    best = None
+    for _ in range(args.repeat):
+        frames, size, elapsed = replay(capture, args.pace)
+        if best is None or elapsed < best[2]:
+            best = frames, size, elapsed
+    frames, size, elapsed = best
+    print(f'{frames:,} frames, {size / 1e6:.1f} MB in {elapsed:.3f}s: '
+          f'{frames / elapsed:,.0f} frames/s, {size / elapsed / 1e6:.1f} MB/s')
+
+    tracemalloc.start()
+    replay(capture)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'allocations: peak {peak / 1024:,.0f} KiB, retained {current / 1024:,.0f} KiB, '
+          f'{current / max(frames, 1):.1f} B/frame retained')
+
+    timings = defaultdict(lambda: [0, 0.0, 0.0, 0.0])
+    replay(capture, parser=TimedParser, timings=timings)
+    total = sum(sum(timing[1:]) for timing in timings.values()) or 1
+    print(f'{"method":<18} {"frames":>9} {"decode us":>10} {"dispatch us":>12} {"reply us":>9} {"share":>6}')
+    for method, (count, decode, dispatch, reply) in timings.items():
+        print(f'{name(method):<18} {count:>9,} {decode / count * 1e6:>10.2f} {dispatch / count * 1e6:>12.2f} '
+              f'{reply / count * 1e6:>9.2f} {(decode + dispatch + reply) / total:>6.1%}')
+
+    result = {'frames': frames, 'bytes': size, 'frames_per_second': frames / elapsed}
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump(result, fp, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        ratio = result['frames_per_second'] / baseline['frames_per_second']
+        print(f'{ratio:.2f}x baseline')
+        if ratio < 1 - args.tolerance:
+            sys.exit(1)
@@ -0,0 +1,107 @@
+'''
+Date: 2026.10.18 13:01
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:01
+'''
+from functools import reduce
+from operator import xor
+from typing import Optional
+
+FLAG = 0x7e
+ESCAPE = 0x7d
+
+# 转义后的第二个字节到原字节
+_UNESCAPE = {0x01: ESCAPE, 0x02: FLAG}
+_ESCAPE = {ESCAPE: b'\x7d\x01', FLAG: b'\x7d\x02'}
+
+
+def checksum(data: bytes) -> int:
+    '''逐字节异或，把整段数据当成大整数对半折叠，全部运算都在 C 层完成'''
+    width = len(data)
+    if width < 64:
+        # 短消息直接逐字节异或更快
+        return reduce(xor, data, 0)
+
+    value = int.from_bytes(data, 'big')
+    while width > 1:
+        half = (width + 1) >> 1
+        value = (value >> (half << 3)) ^ (value & ((1 << (half << 3)) - 1))
+        width = half
+
+    return value
+
+
+def unescape(data: bytes, start: int = 0, stop: int = None) -> bytearray:
+    '''0x7d 0x01 -> 0x7d，0x7d 0x02 -> 0x7e，其余字节原样保留'''
+    output = bytearray()
+    view = memoryview(data)
+    i, n = start, len(data) if stop is None else stop
+
+    while True:
+        j = data.find(ESCAPE, i, n)
+        if j < 0 or j + 1 >= n:
+            output += view[i:n]
+            return output
+
+        output += view[i:j]
+        value = _UNESCAPE.get(data[j + 1])
+        if value is None:
+            output.append(ESCAPE)
+            i = j + 1
+        else:
+            output.append(value)
+            i = j + 2
+
+
+def escape(data: bytes) -> bytearray:
+    output = bytearray()
+    view = memoryview(data)
+    i = 0
+    j, k = data.find(ESCAPE), data.find(FLAG)
+
+    while j >= 0 or k >= 0:
+        p = k if j < 0 or 0 <= k < j else j
+        output += view[i:p]
+        output += _ESCAPE[data[p]]
+        i = p + 1
+
+        if p == j:
+            j = data.find(ESCAPE, i)
+        else:
+            k = data.find(FLAG, i)
+
+    output += view[i:]
+    return output
+
+
+def unpack(frame: bytes) -> Optional[bytearray]:
+    '''去掉首尾标识位、逆转义并校验，返回不含校验码的消息，校验失败返回 None'''
+    start, stop = 0, len(frame)
+    if stop and frame[0] == FLAG:
+        start += 1
+    if stop > start and frame[stop - 1] == FLAG:
+        stop -= 1
+
+    if frame.find(ESCAPE, start, stop) >= 0:
+        payload = unescape(frame, start, stop)
+    else:
+        payload = frame[start:stop]
+        if not isinstance(payload, bytearray):
+            payload = bytearray(payload)
+    if not payload or checksum(payload) != 0:
+        return None
+
+    # 消息体与校验码一起异或结果为 0
+    del payload[-1]
+    return payload
+
+
+def pack(payload: bytes) -> bytearray:
+    '''追加校验码、转义并加上首尾标识位'''
+    frame = bytearray((FLAG,))
+    frame += escape(payload) if ESCAPE in payload or FLAG in payload else payload
+    value = checksum(payload)
+    frame += _ESCAPE.get(value, bytes((value,)))
+    frame.append(FLAG)
+    return frame
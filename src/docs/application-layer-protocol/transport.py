@@ -0,0 +1,51 @@
+'''
+Date: 2026.10.18 13:02
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:02
+'''
+from binascii import a2b_hex
+from typing import Any, Callable
+
+
+class HexTransport(object):
+    '''终端以 ASCII 十六进制发送报文，TCP 分段可能落在半个字节上，落单的字符留到下一次读取'''
+
+    hex_encoded = True
+
+    def __init__(self, sink: Callable[[bytes], Any]):
+        self._sink = sink
+        self._nibble = b''
+
+    def feed(self, data: bytes):
+        start = 0
+
+        if self._nibble:
+            if not data:
+                return
+            self._sink(a2b_hex(self._nibble + bytes(data[:1])))
+            self._nibble = b''
+            start = 1
+
+        view = memoryview(data)[start:]
+        end = len(view) & ~1
+        if end < len(view):
+            self._nibble = bytes(view[end:])
+        if end:
+            # a2b_hex 直接读取 memoryview，不复制输入
+            self._sink(a2b_hex(view[:end]))
+
+
+class RawTransport(object):
+    '''终端直接发送二进制报文'''
+
+    hex_encoded = False
+
+    def __init__(self, sink: Callable[[bytes], Any]):
+        self.feed = sink
+
+
+TRANSPORTS = {
+    'hex': HexTransport,
+    'raw': RawTransport,
+}
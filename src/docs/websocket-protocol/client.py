@@ -10,7 +10,14 @@ from threading import Lock
 from typing import Union
 from random import randbytes
 
-from common import WebSocketProtocol, log, parse_http_headers
+from common import (
+    WebSocketDecoder,
+    WebSocketError,
+    WebSocketProtocol,
+    log,
+    parse_http_headers,
+)
+from deflate import COMPRESSION_THRESHOLD, PerMessageDeflate
 
 log = log.getChild("client")
 
@@ -20,7 +27,7 @@ websocket_upgrade_template_client = (
     "Sec-WebSocket-Key: {0}\r\n"
     "Connection: Upgrade\r\n"
     "Upgrade: websocket\r\n"
-    "Sec-WebSocket-Extensions: permessage-deflate; client_max_window_bits\r\n"
+    "{2}"
     "Host: {1}\r\n\r\n"
 )
 
@@ -34,8 +41,26 @@ class WebSocketClient(WebSocketProtocol):
     lock = Lock()
     closed = False
 
-    def __init__(self, host: str = "localhost", port: Union[str, int] = 8089):
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: Union[str, int] = 8089,
+        compression: bool = True,
+        window_bits: int = 15,
+        context_takeover: bool = True,
+        compression_threshold: int = COMPRESSION_THRESHOLD,
+        compression_level: int = 6,
+    ):
         self._host, self._port = host, port
+        # permessage-deflate is offered when compression is set, window_bits and
+        # context_takeover apply to what this client compresses
+        self.compression = compression
+        self.window_bits = window_bits
+        self.context_takeover = context_takeover
+        self.compression_threshold = compression_threshold
+        self.compression_level = compression_level
+        # Frames sent by servers must not be masked
+        self.decoder = WebSocketDecoder(masked=False)
         self.connect(host, port)
 
     def __str__(self):
@@ -91,13 +116,27 @@ class WebSocketClient(WebSocketProtocol):
 
             if data:
                 log.info(f"{self} recv {data!r}")
-                frame = self.unpack_data_to_frame(data)
+                try:
+                    frames = self.decoder.feed(data)
+                except WebSocketError as e:
+                    log.error(f"{self} {e}")
+                    self.close()
+                    break
+
+                for frame in frames:
+                    self.handle_frame(frame)
 
     def handshake(self) -> bool:
+        extensions = ""
+        if self.compression:
+            offer = PerMessageDeflate.offer(self.window_bits, self.context_takeover)
+            extensions = f"Sec-WebSocket-Extensions: {offer}\r\n"
+
         self._send(
             websocket_upgrade_template_client.format(
                 base64.b64encode(randbytes(16)).decode("utf-8"),
                 self.remote_address,
+                extensions,
             ).encode("utf-8")
         )
 
@@ -105,13 +144,34 @@ class WebSocketClient(WebSocketProtocol):
         data = self.client.recv(self.buffer_size)
         log.info(f"{self} recv {data!r}")
 
-        headers = parse_http_headers(data.decode("utf-8"), from_request=False)
+        response, _, data = data.partition(b"\r\n\r\n")
+        headers = parse_http_headers(response.decode("utf-8"), from_request=False)
+
+        try:
+            self.extension = PerMessageDeflate.from_response(
+                headers.get("Sec-WebSocket-Extensions"),
+                self.window_bits,
+                self.context_takeover,
+                self.compression_threshold,
+                self.compression_level,
+            )
+        except WebSocketError as e:
+            log.error(f"{self} {e}")
+            return False
+
+        if self.extension is not None and not self.compression:
+            log.error(f"{self} server enabled an extension that was not offered")
+            return False
+
+        self.decoder.extension = self.extension
+
+        # Frames sent right after the handshake may share the read with the response
+        if data:
+            for frame in self.decoder.feed(data):
+                self.handle_frame(frame)
 
         return True
 
     def _send(self, data):
         log.info(f"{self} will send {data!r}")
-        self.client.send(data)
-
-    def send_message(self, message):
-        pass
+        self.client.sendall(data)
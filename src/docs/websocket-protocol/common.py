@@ -5,10 +5,17 @@ LastEditors: Rustle Karl
 LastEditTime: 2022.03.12 08:02
 """
 import logging
+import struct
 from enum import IntEnum
 from io import StringIO
 from random import randbytes
 from dataclasses import dataclass
+from typing import List, Optional, Union
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -17,6 +24,12 @@ logging.basicConfig(
 
 log = logging.getLogger("websocket")
 
+# Largest message, after reassembly of fragments, a decoder accepts by default
+MAX_MESSAGE_SIZE = 1 << 20
+
+_UINT16 = struct.Struct("!H")
+_UINT64 = struct.Struct("!Q")
+
 
 def parse_http_headers(content: str, from_request=True) -> dict:
     fp = StringIO(content)
@@ -34,6 +47,51 @@ def parse_http_headers(content: str, from_request=True) -> dict:
     return headers
 
 
+# Below this size the per-call overhead of the word-wise paths outweighs the loop
+MASK_LOOP_LIMIT = 8
+# Above this size a NumPy uint32 view beats the big-integer XOR, when NumPy is installed
+MASK_NUMPY_LIMIT = 1 << 12
+
+
+def _mask_loop(data: bytes, key: bytes) -> bytes:
+    """Reference implementation, one byte at a time"""
+    return bytes(b ^ key[i & 3] for i, b in enumerate(data))
+
+
+def _mask_int(data: bytes, key: bytes) -> bytes:
+    """XOR the whole payload as one big integer against the key repeated to its length"""
+    n = len(data)
+    keys = (key * (n // 4 + 1))[:n]
+    return (int.from_bytes(data, "little") ^ int.from_bytes(keys, "little")).to_bytes(
+        n, "little"
+    )
+
+
+def _mask_numpy(data: bytes, key: bytes) -> bytes:
+    """XOR four bytes at a time through a uint32 view, the tail byte by byte"""
+    n = len(data)
+    words = n >> 2
+    out = bytearray(n)
+    numpy.bitwise_xor(
+        numpy.frombuffer(data, dtype=numpy.uint32, count=words),
+        numpy.frombuffer(key, dtype=numpy.uint32)[0],
+        out=numpy.frombuffer(out, dtype=numpy.uint32, count=words),
+    )
+    for i in range(words << 2, n):
+        out[i] = data[i] ^ key[i & 3]
+    return bytes(out)
+
+
+def mask(data: bytes, key: bytes) -> bytes:
+    """Mask or unmask a payload with a 4-byte masking key (RFC 6455, section 5.3)"""
+    n = len(data)
+    if n < MASK_LOOP_LIMIT:
+        return _mask_loop(data, key)
+    if numpy is not None and n >= MASK_NUMPY_LIMIT:
+        return _mask_numpy(data, key)
+    return _mask_int(data, key)
+
+
 class WebSocketOpcode(IntEnum):
     """Indicates the type of frame"""
 
@@ -45,16 +103,35 @@ class WebSocketOpcode(IntEnum):
     PongFrame = 10
 
 
+class WebSocketStatusCode(IntEnum):
+    """Status codes sent in a close frame"""
+
+    NormalClosure = 1000
+    GoingAway = 1001
+    ProtocolError = 1002
+    PolicyViolation = 1008
+    MessageTooBig = 1009
+
+
+class WebSocketError(Exception):
+    """The peer violated the protocol, code is the status to close the connection with"""
+
+    def __init__(self, message: str, code: int = WebSocketStatusCode.ProtocolError):
+        super().__init__(message)
+        self.code = code
+
+
 @dataclass()
 class WebSocketFrame(object):
     """Represents a WebSocket data frame"""
 
     FIN: int = 1  # 1 bit
+    RSV1: int = 0  # 1 bit, set on compressed messages by permessage-deflate
     Opcode: int = 0  # 4 bit
     MASK: int = 1  # 1 bit
     PayloadLength: int = 0  # 7 bit
 
-    ExtendedPayloadLength: int = 0  # 16 bit
+    ExtendedPayloadLength: int = 0  # 16 or 64 bit
     MaskingKey: bytes = b""  # 16 bit
     PayloadData: bytes = b""
 
@@ -62,6 +139,7 @@ class WebSocketFrame(object):
         return (
             "<class WebSocketFrame:"
             f"FIN={self.FIN}, "
+            f"RSV1={self.RSV1}, "
             f"Opcode={self.Opcode}, "
             f"MASK={self.MASK}, "
             f"PayloadLength={self.PayloadLength}, "
@@ -77,36 +155,32 @@ class WebSocketProtocol(object):
 
     GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
 
-    buffer_size: int = 1024
+    buffer_size: int = 1 << 16
+    # Clients mask every frame they send, servers never do
+    mask_frames: int = 1
+    # Negotiated permessage-deflate state, see deflate.PerMessageDeflate
+    extension = None
 
     @staticmethod
     def unpack_data_to_frame(data: bytes) -> WebSocketFrame:
-        frame = WebSocketFrame()
-
-        frame.FIN = data[0] >> 7
-        frame.Opcode = data[0] & 15
-        frame.MASK = data[1] >> 7
-        frame.PayloadLength = data[1] & 127
-
-        if frame.PayloadLength == 126:
-            frame.ExtendedPayloadLength = data[2:4]
-            frame.MaskingKey = data[4:8]
-            frame.PayloadData = data[8:]
-        elif frame.PayloadLength == 127:
-            frame.ExtendedPayloadLength = data[2:10]
-            frame.MaskingKey = data[10:14]
-            frame.PayloadData = data[14:]
-        else:
-            frame.ExtendedPayloadLength = 0
-            frame.MaskingKey = data[2:6]
-            frame.PayloadData = data[6:]
+        header = _parse_header(data, 0, len(data))
+        if header is None:
+            raise WebSocketError("incomplete frame header")
+
+        b0, b1, length, key, start = header
+        frame = WebSocketFrame(
+            FIN=b0 >> 7,
+            RSV1=b0 >> 6 & 1,
+            Opcode=b0 & 15,
+            MASK=b1 >> 7,
+            PayloadLength=b1 & 127,
+            ExtendedPayloadLength=length if b1 & 127 >= 126 else 0,
+            MaskingKey=key,
+            PayloadData=bytes(data[start : start + length]),
+        )
 
         if frame.MASK:
-            payload_data = bytearray()
-            for i in range(len(frame.PayloadData)):
-                chunk = frame.PayloadData[i] ^ frame.MaskingKey[i % 4]
-                payload_data.append(chunk)
-            frame.PayloadData = bytes(payload_data)
+            frame.PayloadData = mask(frame.PayloadData, frame.MaskingKey)
 
         log.debug(frame)
         # log.debug(WebSocketProtocol.pack_frame_to_data(frame))
@@ -115,23 +189,56 @@ class WebSocketProtocol(object):
 
     @staticmethod
     def pack_frame_to_data(frame: WebSocketFrame) -> bytes:
+        payload = frame.PayloadData
+        length = len(payload)
+
         data = bytearray()
-        data.append(frame.FIN << 7 | frame.Opcode)
-        data.append(frame.MASK << 7 | frame.PayloadLength)
+        data.append(frame.FIN << 7 | frame.RSV1 << 6 | frame.Opcode)
+
+        if length < 126:
+            frame.PayloadLength, frame.ExtendedPayloadLength = length, 0
+            data.append(frame.MASK << 7 | length)
+        elif length < 1 << 16:
+            frame.PayloadLength, frame.ExtendedPayloadLength = 126, length
+            data.append(frame.MASK << 7 | 126)
+            data.extend(_UINT16.pack(length))
+        else:
+            frame.PayloadLength, frame.ExtendedPayloadLength = 127, length
+            data.append(frame.MASK << 7 | 127)
+            data.extend(_UINT64.pack(length))
+
+        if frame.MASK:
+            if not frame.MaskingKey:
+                frame.MaskingKey = randbytes(4)
+
+            data.extend(frame.MaskingKey)
+            payload = mask(payload, frame.MaskingKey)
 
-        if not frame.MaskingKey:
-            frame.MaskingKey = randbytes(4)
+        # The header is tiny, the payload is copied once into the result
+        return bytes(data) + payload
 
-        data.extend(bytearray(frame.MaskingKey))
+    @staticmethod
+    def pack_message(message: Union[str, bytes], mask_frames: int = 0, extension=None) -> bytes:
+        """Text frame for str, binary frame for anything else
+
+        With an extension, payloads of at least extension.threshold bytes are compressed
+        and sent with RSV1 set.
+        """
+        if isinstance(message, str):
+            opcode, payload = WebSocketOpcode.TextFrame, message.encode("utf-8")
+        else:
+            opcode, payload = WebSocketOpcode.BinaryFrame, message
 
-        payload_data = bytearray()
-        for i in range(len(frame.PayloadData)):
-            chunk = frame.PayloadData[i] ^ frame.MaskingKey[i % 4]
-            payload_data.append(chunk)
+        rsv1 = 0
+        if extension is not None and len(payload) >= extension.threshold:
+            payload, rsv1 = extension.compress(payload), 1
 
-        data.extend(bytearray(payload_data))
+        return WebSocketProtocol.pack_frame_to_data(
+            WebSocketFrame(RSV1=rsv1, Opcode=opcode, MASK=mask_frames, PayloadData=payload)
+        )
 
-        return bytes(data)
+    def send_message(self, message: Union[str, bytes]):
+        self._send(self.pack_message(message, self.mask_frames, self.extension))
 
     def handle_frame(self, frame: WebSocketFrame):
         if frame.Opcode == WebSocketOpcode.ConnectionCloseFrame:
@@ -143,12 +250,16 @@ class WebSocketProtocol(object):
 
     def ping(self):
         self._send(
-            self.pack_frame_to_data(WebSocketFrame(Opcode=WebSocketOpcode.PingFrame))
+            self.pack_frame_to_data(
+                WebSocketFrame(Opcode=WebSocketOpcode.PingFrame, MASK=self.mask_frames)
+            )
         )
 
     def pong(self):
         self._send(
-            self.pack_frame_to_data(WebSocketFrame(Opcode=WebSocketOpcode.PongFrame))
+            self.pack_frame_to_data(
+                WebSocketFrame(Opcode=WebSocketOpcode.PongFrame, MASK=self.mask_frames)
+            )
         )
 
     def _send(self, data):
@@ -156,3 +267,205 @@ class WebSocketProtocol(object):
 
     def close(self):
         raise NotImplementedError
+
+
+def _parse_header(data, offset: int, end: int):
+    """Parse the frame header at data[offset:end]
+
+    Returns (first byte, second byte, payload length, masking key, payload offset),
+    or None when the header itself is not complete yet.
+    """
+    if end - offset < 2:
+        return None
+
+    b0, b1 = data[offset], data[offset + 1]
+    length = b1 & 127
+    start = offset + 2
+
+    if length == 126:
+        if end - start < 2:
+            return None
+        (length,) = _UINT16.unpack_from(data, start)
+        start += 2
+    elif length == 127:
+        if end - start < 8:
+            return None
+        (length,) = _UINT64.unpack_from(data, start)
+        if length >> 63:
+            raise WebSocketError("the most significant bit of a 64-bit length must be 0")
+        start += 8
+
+    key = b""
+    if b1 & 128:
+        if end - start < 4:
+            return None
+        key = bytes(data[start : start + 4])
+        start += 4
+
+    return b0, b1, length, key, start
+
+
+class WebSocketDecoder(object):
+    """Incremental frame decoder
+
+    feed() takes whatever the socket returned and gives back every frame completed so far,
+    partial frames stay buffered until the next call. Fragmented messages are reassembled
+    and returned as one frame with FIN set, control frames in between are returned as they
+    arrive. Each payload is copied once out of the received data (unmasked on the way);
+    reassembly joins the fragments with one more copy.
+
+    A message longer than max_size is rejected from its header, before its payload is
+    buffered. masked is the MASK bit every frame must carry, True for frames sent by
+    clients, False for frames sent by servers, None to accept both.
+
+    extension is the negotiated permessage-deflate state, set after the handshake. With it
+    RSV1 is allowed on the first frame of a message, and such messages are decompressed
+    once complete.
+    """
+
+    def __init__(
+        self, max_size: int = MAX_MESSAGE_SIZE, masked: Optional[bool] = None, extension=None
+    ):
+        self.max_size = max_size
+        self.masked = masked
+        self.extension = extension
+
+        self._buffer = bytearray()
+        # Bytes the buffer needs before parsing can make progress
+        self._needed = 2
+
+        # Fragmented message in progress
+        self._opcode = None
+        self._compressed = 0
+        self._fragments: List[bytes] = []
+        self._size = 0
+
+    def __len__(self):
+        """Bytes buffered but not yet returned as a frame"""
+        return len(self._buffer) + self._size
+
+    def feed(self, data: bytes) -> List[WebSocketFrame]:
+        buffer = self._buffer
+
+        if not buffer:
+            # Usual case, parse straight from the received data and only keep the tail
+            frames, offset = self._parse(data)
+            if offset < len(data):
+                buffer.extend(memoryview(data)[offset:])
+            return frames
+
+        buffer.extend(data)
+        if len(buffer) < self._needed:
+            return []
+
+        frames, offset = self._parse(buffer)
+        del buffer[:offset]
+        return frames
+
+    def _parse(self, data):
+        frames = []
+        offset, end = 0, len(data)
+        self._needed = 2
+
+        with memoryview(data) as view:
+            while True:
+                header = _parse_header(data, offset, end)
+                if header is None:
+                    # Up to 14 header bytes, wait for at least one more
+                    self._needed = end - offset + 1
+                    break
+
+                b0, b1, length, key, start = header
+                self._check(b0, b1, length)
+
+                stop = start + length
+                if stop > end:
+                    self._needed = stop - offset
+                    break
+
+                if key:
+                    payload = mask(view[start:stop], key)
+                else:
+                    payload = bytes(view[start:stop])
+                offset = stop
+
+                frame = self._frame(b0, b1, key, payload)
+                if frame is not None:
+                    frames.append(frame)
+
+        return frames, offset
+
+    def _check(self, b0: int, b1: int, length: int):
+        """Validate a header before its payload arrives"""
+        if b0 & 0x70:
+            if b0 & 0x30 or self.extension is None:
+                raise WebSocketError("reserved bits set without a negotiated extension")
+            if not WebSocketOpcode.TextFrame <= b0 & 15 <= WebSocketOpcode.BinaryFrame:
+                raise WebSocketError("RSV1 is only allowed on the first frame of a message")
+
+        if self.masked is not None and bool(b1 & 128) != self.masked:
+            raise WebSocketError("frame masking does not match the sender")
+
+        opcode = b0 & 15
+        if opcode >= 8:
+            if opcode > WebSocketOpcode.PongFrame:
+                raise WebSocketError(f"reserved opcode {opcode}")
+            if not b0 & 128 or length > 125:
+                raise WebSocketError("control frames must not be fragmented or exceed 125 bytes")
+        elif opcode == WebSocketOpcode.ContinuationFrame:
+            if self._opcode is None:
+                raise WebSocketError("continuation frame without a message to continue")
+            if self._size + length > self.max_size:
+                raise WebSocketError(
+                    f"message exceeds {self.max_size} bytes", WebSocketStatusCode.MessageTooBig
+                )
+        elif opcode <= WebSocketOpcode.BinaryFrame:
+            if self._opcode is not None:
+                raise WebSocketError("new message before the fragmented one finished")
+            if length > self.max_size:
+                raise WebSocketError(
+                    f"message exceeds {self.max_size} bytes", WebSocketStatusCode.MessageTooBig
+                )
+        else:
+            raise WebSocketError(f"reserved opcode {opcode}")
+
+    def _frame(self, b0: int, b1: int, key: bytes, payload: bytes) -> Optional[WebSocketFrame]:
+        opcode = b0 & 15
+
+        if b0 & 128 and opcode:
+            # Unfragmented message or control frame
+            if b0 & 64:
+                payload = self.extension.decompress(payload, self.max_size)
+            return _frame(b0 >> 7, opcode, b1 >> 7, key, payload)
+
+        if opcode:
+            self._opcode = opcode
+            self._compressed = b0 & 64
+            self._fragments = [payload]
+            self._size = len(payload)
+            return None
+
+        self._fragments.append(payload)
+        self._size += len(payload)
+        if not b0 & 128:
+            return None
+
+        opcode, fragments = self._opcode, self._fragments
+        self._opcode, self._fragments, self._size = None, [], 0
+        payload = b"".join(fragments)
+        if self._compressed:
+            payload = self.extension.decompress(payload, self.max_size)
+        return _frame(1, opcode, b1 >> 7, b"", payload)
+
+
+def _frame(fin: int, opcode: int, masked: int, key: bytes, payload: bytes) -> WebSocketFrame:
+    length = len(payload)
+    return WebSocketFrame(
+        FIN=fin,
+        Opcode=opcode,
+        MASK=masked,
+        PayloadLength=length if length < 126 else 126 if length < 1 << 16 else 127,
+        ExtendedPayloadLength=length if length >= 126 else 0,
+        MaskingKey=key,
+        PayloadData=payload,
+    )
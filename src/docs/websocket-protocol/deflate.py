@@ -0,0 +1,276 @@
+"""
+Date: 2026.10.18 13:32
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:48
+"""
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from common import WebSocketError, WebSocketStatusCode
+
+# Messages shorter than this are sent uncompressed, deflate rarely pays off on them
+COMPRESSION_THRESHOLD = 128
+
+# Appended by a sync flush, stripped from every compressed message (RFC 7692, section 7.2.1)
+_TAIL = b"\x00\x00\xff\xff"
+
+_PARAMETERS = (
+    "server_no_context_takeover",
+    "client_no_context_takeover",
+    "server_max_window_bits",
+    "client_max_window_bits",
+)
+
+
+def parse_extensions(header: str) -> List[Tuple[str, Dict[str, Optional[str]]]]:
+    """Split a Sec-WebSocket-Extensions value into (name, {parameter: value or None})"""
+    extensions = []
+    for offer in header.split(","):
+        name, *parameters = [item.strip() for item in offer.split(";")]
+        if not name:
+            continue
+
+        values = {}
+        for parameter in parameters:
+            key, _, value = parameter.partition("=")
+            key = key.strip()
+            if key in values:
+                raise ValueError(f"duplicate parameter {key}")
+            values[key] = value.strip().strip('"') if value else None
+
+        extensions.append((name, values))
+
+    return extensions
+
+
+def _window_bits(value: Optional[str], default: int) -> int:
+    if value is None:
+        return default
+    if not value.isdigit() or not 8 <= int(value) <= 15:
+        raise ValueError(f"invalid window bits {value!r}")
+    return int(value)
+
+
+class PerMessageDeflate(object):
+    """permessage-deflate (RFC 7692) state of one connection
+
+    The compressor and decompressor live as long as the connection, so each message can
+    refer back to the ones before it (context takeover), unless the matching
+    *_no_context_takeover parameter was negotiated. Without context takeover the
+    compressor is still reused, a full flush after each message clears its history
+    instead of allocating a new zlib context per message. They are created on first use,
+    an idle connection costs nothing. window_bits is the base-2 log of the LZ77 window, a
+    smaller window saves memory per connection at some cost in ratio.
+
+    sent, sent_raw, received and received_raw count bytes on the wire and before
+    compression, compress_ns and decompress_ns the time spent in zlib.
+    """
+
+    name = "permessage-deflate"
+
+    def __init__(
+        self,
+        is_server: bool,
+        server_max_window_bits: int = 15,
+        client_max_window_bits: int = 15,
+        server_no_context_takeover: bool = False,
+        client_no_context_takeover: bool = False,
+        threshold: int = COMPRESSION_THRESHOLD,
+        level: int = 6,
+    ):
+        self.is_server = is_server
+        self.server_max_window_bits = server_max_window_bits
+        self.client_max_window_bits = client_max_window_bits
+        self.server_no_context_takeover = server_no_context_takeover
+        self.client_no_context_takeover = client_no_context_takeover
+        self.threshold = threshold
+        self.level = level
+
+        if is_server:
+            self.compress_bits, self.compress_reset = server_max_window_bits, server_no_context_takeover
+            self.decompress_bits, self.decompress_reset = client_max_window_bits, client_no_context_takeover
+        else:
+            self.compress_bits, self.compress_reset = client_max_window_bits, client_no_context_takeover
+            self.decompress_bits, self.decompress_reset = server_max_window_bits, server_no_context_takeover
+
+        # zlib cannot produce a raw deflate stream with a 256-byte window
+        if self.compress_bits < 9:
+            raise ValueError("window bits below 9 are not supported for compression")
+
+        self._compressor = None
+        self._decompressor = None
+
+        self.sent = self.sent_raw = 0
+        self.received = self.received_raw = 0
+        self.compress_ns = self.decompress_ns = 0
+
+    def __str__(self):
+        return self.parameters()
+
+    @property
+    def shared(self) -> Optional[tuple]:
+        """Connections with equal keys produce identical compressed frames, None when the
+        output depends on this connection's history"""
+        if not self.compress_reset:
+            return None
+        return self.compress_bits, self.level, self.threshold
+
+    def parameters(self) -> str:
+        """Header value describing what was agreed, sent back by the server"""
+        parameters = [self.name]
+        if self.server_no_context_takeover:
+            parameters.append("server_no_context_takeover")
+        if self.client_no_context_takeover:
+            parameters.append("client_no_context_takeover")
+        if self.server_max_window_bits < 15:
+            parameters.append(f"server_max_window_bits={self.server_max_window_bits}")
+        if self.client_max_window_bits < 15:
+            parameters.append(f"client_max_window_bits={self.client_max_window_bits}")
+        return "; ".join(parameters)
+
+    def compress(self, payload: bytes) -> bytes:
+        start = time.perf_counter_ns()
+
+        compressor = self._compressor
+        if compressor is None:
+            compressor = self._compressor = zlib.compressobj(
+                self.level, zlib.DEFLATED, -self.compress_bits
+            )
+
+        # A full flush also forgets everything compressed so far, the next message
+        # starts without history, as if from a new context
+        data = compressor.compress(payload) + compressor.flush(
+            zlib.Z_FULL_FLUSH if self.compress_reset else zlib.Z_SYNC_FLUSH
+        )
+        if data.endswith(_TAIL):
+            data = data[:-4]
+        # An empty message still needs one empty deflate block
+        data = data or b"\x00"
+
+        self.compress_ns += time.perf_counter_ns() - start
+        self.sent_raw += len(payload)
+        self.sent += len(data)
+        return data
+
+    def decompress(self, data: bytes, max_size: int) -> bytes:
+        start = time.perf_counter_ns()
+
+        # Reused even when the peer resets its context, a message that refers to no
+        # history inflates the same with or without one
+        decompressor = self._decompressor
+        if decompressor is None:
+            decompressor = self._decompressor = zlib.decompressobj(-self.decompress_bits)
+
+        try:
+            payload = decompressor.decompress(data + _TAIL, max_size + 1)
+        except zlib.error as e:
+            raise WebSocketError(f"invalid compressed message: {e}")
+
+        if len(payload) > max_size:
+            raise WebSocketError(
+                f"message exceeds {max_size} bytes", WebSocketStatusCode.MessageTooBig
+            )
+
+        self.decompress_ns += time.perf_counter_ns() - start
+        self.received += len(data)
+        self.received_raw += len(payload)
+        return payload
+
+    @staticmethod
+    def offer(window_bits: int = 15, context_takeover: bool = True) -> str:
+        """Header value a client sends, window_bits limits the client's own compressor"""
+        offer = PerMessageDeflate.name + "; client_max_window_bits"
+        if window_bits < 15:
+            offer += f"={window_bits}"
+        if not context_takeover:
+            offer += "; client_no_context_takeover"
+        return offer
+
+    @classmethod
+    def accept(
+        cls,
+        header: Optional[str],
+        window_bits: int = 15,
+        context_takeover: bool = True,
+        threshold: int = COMPRESSION_THRESHOLD,
+        level: int = 6,
+    ) -> Optional["PerMessageDeflate"]:
+        """Pick the first acceptable offer from a client's header, None to decline
+
+        context_takeover is the server's own, without it the server compresses every
+        message on its own so one compressed frame can go to many connections. The
+        client keeps its context unless it offered client_no_context_takeover.
+        """
+        try:
+            offers = parse_extensions(header or "")
+        except ValueError:
+            return None
+
+        for name, parameters in offers:
+            if name != cls.name or not set(parameters) <= set(_PARAMETERS):
+                continue
+
+            try:
+                server_bits = min(
+                    window_bits, _window_bits(parameters.get("server_max_window_bits"), 15)
+                )
+                client_bits = 15
+                if "client_max_window_bits" in parameters:
+                    # Only a client that offered the parameter may be asked to use a smaller window
+                    client_bits = min(
+                        window_bits, _window_bits(parameters["client_max_window_bits"], 15)
+                    )
+
+                return cls(
+                    True,
+                    server_bits,
+                    client_bits,
+                    "server_no_context_takeover" in parameters or not context_takeover,
+                    "client_no_context_takeover" in parameters,
+                    threshold,
+                    level,
+                )
+            except ValueError:
+                continue
+
+        return None
+
+    @classmethod
+    def from_response(
+        cls,
+        header: Optional[str],
+        window_bits: int = 15,
+        context_takeover: bool = True,
+        threshold: int = COMPRESSION_THRESHOLD,
+        level: int = 6,
+    ) -> Optional["PerMessageDeflate"]:
+        """Client side, the extension the server agreed to, None when it declined"""
+        if not header:
+            return None
+
+        try:
+            extensions = parse_extensions(header)
+            if len(extensions) != 1 or extensions[0][0] != cls.name:
+                raise ValueError(f"unexpected extensions {header!r}")
+
+            parameters = extensions[0][1]
+            if not set(parameters) <= set(_PARAMETERS):
+                raise ValueError(f"unknown parameters in {header!r}")
+
+            client_bits = _window_bits(parameters.get("client_max_window_bits"), window_bits)
+            if client_bits > window_bits:
+                raise ValueError("server raised client_max_window_bits above the offer")
+
+            return cls(
+                False,
+                _window_bits(parameters.get("server_max_window_bits"), 15),
+                client_bits,
+                "server_no_context_takeover" in parameters,
+                "client_no_context_takeover" in parameters or not context_takeover,
+                threshold,
+                level,
+            )
+        except ValueError as e:
+            raise WebSocketError(f"invalid permessage-deflate response: {e}")
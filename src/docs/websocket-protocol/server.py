@@ -4,12 +4,24 @@ Description: Omit
 LastEditors: Rustle Karl
 LastEditTime: 2022.03.11 19:04
 """
+import asyncio
 import base64
 import hashlib
-import socket
-from threading import Thread, Lock
-from typing import Union
-from common import log, WebSocketProtocol, parse_http_headers
+import struct
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Set, Union
+from common import (
+    log,
+    MAX_MESSAGE_SIZE,
+    WebSocketDecoder,
+    WebSocketError,
+    WebSocketFrame,
+    WebSocketOpcode,
+    WebSocketProtocol,
+    WebSocketStatusCode,
+    parse_http_headers,
+)
+from deflate import COMPRESSION_THRESHOLD, PerMessageDeflate
 
 log = log.getChild("server")
 
@@ -19,22 +31,51 @@ websocket_upgrade_template_server = (
     "Upgrade:websocket\r\n"
     "Connection:Upgrade\r\n"
     "Sec-WebSocket-Accept:{0}\r\n"
-    "WebSocket-Location:ws://{1}{2}\r\n\r\n"
+    "WebSocket-Location:ws://{1}{2}\r\n"
+    "{3}\r\n"
 )
 
+# Upper bound on the opening handshake, a client sending more is dropped
+MAX_HANDSHAKE_SIZE = 1 << 14
+
+# What to do when a slow consumer's queue is full: drop its oldest queued frame,
+# or disconnect it. Connections compressing with context takeover are always
+# disconnected, their frames cannot be dropped
+DROP, DISCONNECT = "drop", "disconnect"
+
+
+class WebSocketClientConnection(WebSocketProtocol, asyncio.Protocol):
+    """WebSocket Server's Client Connection
 
-class WebSocketClientConnection(WebSocketProtocol):
-    """WebSocket Server's Client Connection"""
+    Runs on the server's event loop, so there is no lock and no thread per client.
+    Bytes up to the end of the HTTP request go to the handshake, everything after
+    is fed to the frame decoder.
 
-    client: socket.socket = None
-    client_address: str = ""
+    Outgoing frames go straight to the transport until its write buffer passes the
+    server's write_limit, then wait in a queue of at most queue_size frames until the
+    client catches up. Queued frames are references to the encoded bytes, a broadcast
+    frame is shared by every queue it sits in.
+    """
 
-    lock = Lock()
-    closed = False
+    mask_frames = 0
 
-    def __init__(self, client: socket.socket, client_address: str):
-        self.client = client
-        self.client_address = client_address
+    def __init__(self, server: "WebSocketServer"):
+        self.server = server
+        self.transport: Optional[asyncio.Transport] = None
+        self.client_address = ("", 0)
+        self.closed = False
+        self.handshaken = False
+        # Keepalive sweeps since the last data from the client
+        self.idle = 0
+
+        self.paused = False
+        self.queue: Deque[bytes] = deque()
+        self.topics: Set[str] = set()
+        self.dropped = 0
+
+        self._request = bytearray()
+        # Frames sent by clients must be masked
+        self.decoder = WebSocketDecoder(max_size=server.max_message_size, masked=True)
 
     def __str__(self):
         return "<client:%s>" % self.address
@@ -43,57 +84,105 @@ class WebSocketClientConnection(WebSocketProtocol):
     def address(self):
         return f"%s:%d" % self.client_address
 
-    def close(self):
-        log.info(f"close {self}")
-
-        if not self.closed:
-            with self.lock:
-                self.closed = True
-                self.client.close()
-
-        log.info(f"{self} closed")
-
-    def serve(self):
-        if not self.handshake():
-            log.error(f"{self} handshake failed")
-            self.close()
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        self.client_address = transport.get_extra_info("peername")[:2]
+        transport.set_write_buffer_limits(high=self.server.write_limit)
+        self.server.connections.add(self)
+        log.debug("connected by %s", self)
+
+    def data_received(self, data: bytes):
+        self.idle = 0
+
+        if not self.handshaken:
+            self._request.extend(data)
+            end = self._request.find(b"\r\n\r\n")
+            if end == -1:
+                if len(self._request) > MAX_HANDSHAKE_SIZE:
+                    log.error(f"{self} handshake too large")
+                    self.close()
+                return
+
+            request, data = bytes(self._request[: end + 4]), bytes(self._request[end + 4 :])
+            self._request = None
+
+            if not self.handshake(request):
+                log.error(f"{self} handshake failed")
+                self.close()
+                return
+
+            self.handshaken = True
+            log.debug("%s handshake succeeded", self)
+
+            if not data:
+                return
+
+        # Logging every read is too costly with many connections, keep it at debug and
+        # let logging format the message only when debug is enabled
+        log.debug("%s recv %r", self, data)
+        try:
+            frames = self.decoder.feed(data)
+        except WebSocketError as e:
+            log.error(f"{self} {e}")
+            self.close(e.code)
             return
 
-        log.info(f"{self} handshake succeeded")
-
-        self.client.settimeout(1)
-        while True:
-            with self.lock:
-                if self.closed:
-                    break
-
-                try:
-                    try:
-                        data = self.client.recv(self.buffer_size)
-                    except socket.timeout:
-                        self.ping()
-                        continue
-                except (KeyboardInterrupt, ConnectionResetError):
-                    break
-
-            if data:
-                log.info(f"{self} recv {data!r}")
-                frame = self.unpack_data_to_frame(data)
+        for frame in frames:
+            if self.closed:
+                break
+            if frame.Opcode >= WebSocketOpcode.ConnectionCloseFrame:
                 self.handle_frame(frame)
+            else:
+                self.server.messages += 1
+                if self.server.handler is not None:
+                    self.server.handler(self, frame)
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        queue = self.queue
+        # transport.write calls pause_writing again once the buffer fills up
+        while queue and not self.paused:
+            self.transport.write(queue.popleft())
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self.queue.clear()
+        self.server.unsubscribe(self)
+        self.server.connections.discard(self)
+        log.debug("%s closed", self)
+
+    def handshake(self, request: bytes) -> bool:
+        log.debug("%s recv %r", self, request)
+
+        try:
+            headers = parse_http_headers(request.decode("utf-8"))
+            key = headers["Sec-WebSocket-Key"]
+        except (UnicodeDecodeError, ValueError, KeyError):
+            return False
+
+        extensions = ""
+        if self.server.compression:
+            self.extension = PerMessageDeflate.accept(
+                headers.get("Sec-WebSocket-Extensions"),
+                self.server.window_bits,
+                self.server.context_takeover,
+                self.server.compression_threshold,
+                self.server.compression_level,
+            )
+            if self.extension is not None:
+                self.decoder.extension = self.extension
+                extensions = f"Sec-WebSocket-Extensions: {self.extension.parameters()}\r\n"
 
-    def handshake(self) -> bool:
-        data = self.client.recv(self.buffer_size)
-        log.info(f"{self} recv {data!r}")
-
-        headers = parse_http_headers(data.decode("utf-8"))
         response = websocket_upgrade_template_server.format(
             base64.b64encode(
-                hashlib.sha1(
-                    (headers["Sec-WebSocket-Key"] + self.GUID).encode("utf-8")
-                ).digest()
+                hashlib.sha1((key + self.GUID).encode("utf-8")).digest()
             ).decode("utf-8"),
-            headers["Host"],
+            headers.get("Host", self.server.address),
             headers["Path"],
+            extensions,
         ).encode("utf-8")
 
         self._send(response)
@@ -101,21 +190,136 @@ class WebSocketClientConnection(WebSocketProtocol):
         return True
 
     def _send(self, data):
-        log.info(f"{self} will send {data!r}")
-        self.client.send(data)
+        self.write(data)
+
+    def write(self, data: bytes) -> bool:
+        """Write or queue an encoded frame, False when it was dropped"""
+        if self.closed:
+            return False
+
+        if not self.paused:
+            self.transport.write(data)
+            return True
+
+        if len(self.queue) < self.server.queue_size:
+            self.queue.append(data)
+            return True
+
+        # A frame compressed with context takeover cannot be dropped, the client's
+        # inflater would lose the history the next frames refer to
+        extension = self.extension
+        if self.server.slow_consumer == DISCONNECT or (
+            extension is not None and extension.shared is None
+        ):
+            log.warning(f"{self} is too slow, disconnecting")
+            self.server.disconnected += 1
+            self.abort()
+            return False
+
+        self.queue.popleft()
+        self.queue.append(data)
+        self.dropped += 1
+        self.server.dropped += 1
+        return False
+
+    def abort(self):
+        """Close without waiting for the client to read what is already buffered"""
+        self.closed = True
+        self.queue.clear()
+        self.transport.abort()
+
+    def close(self, code: int = WebSocketStatusCode.NormalClosure):
+        if self.closed:
+            return
 
-    def send_message(self, message):
-        pass
+        if self.handshaken:
+            # Frames still queued for a slow client are given up, the close frame is not
+            self.queue.clear()
+            self.transport.write(
+                self.pack_frame_to_data(
+                    WebSocketFrame(
+                        Opcode=WebSocketOpcode.ConnectionCloseFrame,
+                        MASK=self.mask_frames,
+                        PayloadData=struct.pack("!H", code),
+                    )
+                )
+            )
 
+        self.closed = True
+        # Pending writes, the close frame included, are flushed before the socket closes
+        self.transport.close()
 
-class WebSocketServer(object):
-    """WebSocket Protocol Implementation for Server."""
 
-    server: socket.socket = None
-    should_close: bool = False
+class WebSocketServer(object):
+    """WebSocket Protocol Implementation for Server.
+
+    handler(connection, frame) is called for every complete text or binary message.
+    Connections silent for ping_interval seconds are pinged, and closed after three
+    intervals without any data.
+
+    publish() and broadcast() encode the unmasked frame once and hand the same bytes
+    to every recipient. slow_consumer picks what happens to a connection whose queue
+    is full, DROP its oldest queued frame or DISCONNECT it.
+
+    With compression, permessage-deflate is accepted when a client offers it. window_bits
+    caps the LZ77 window on both sides. Messages under compression_threshold bytes are
+    sent uncompressed.
+
+    By default the server keeps its compression context across messages (context
+    takeover), which gives the best ratio, about 6x instead of 1.4x on the small JSON
+    updates in tests/bench_deflate.py. Each message then depends on the ones before it
+    on that connection, so publish() and broadcast() compress it once per subscriber,
+    and a slow consumer whose queue is full is disconnected instead of having frames
+    dropped. Broadcast-heavy deployments can pass context_takeover=False: the server
+    negotiates server_no_context_takeover, compresses each message on its own once for
+    all subscribers that share the same settings, and DROP works again.
+    """
+
+    server: asyncio.AbstractServer = None
+
+    def __init__(
+        self,
+        host: str = "localhost",
+        port: Union[str, int] = 8089,
+        handler: Callable[[WebSocketClientConnection, WebSocketFrame], None] = None,
+        max_message_size: int = MAX_MESSAGE_SIZE,
+        ping_interval: float = 30,
+        backlog: int = 1024,
+        queue_size: int = 256,
+        slow_consumer: str = DROP,
+        write_limit: int = 1 << 16,
+        compression: bool = True,
+        window_bits: int = 15,
+        context_takeover: bool = True,
+        compression_threshold: int = COMPRESSION_THRESHOLD,
+        compression_level: int = 6,
+    ):
+        if slow_consumer not in (DROP, DISCONNECT):
+            raise ValueError(f"unknown slow consumer policy {slow_consumer!r}")
+        if queue_size < 1:
+            # DROP replaces the oldest queued frame, there has to be one
+            raise ValueError(f"queue_size must be at least 1, got {queue_size}")
 
-    def __init__(self, host: str = "localhost", port: Union[str, int] = 8089):
         self._host, self._port = host, port
+        self.handler = handler
+        self.max_message_size = max_message_size
+        self.ping_interval = ping_interval
+        self.backlog = backlog
+        self.queue_size = queue_size
+        self.slow_consumer = slow_consumer
+        self.write_limit = write_limit
+        self.compression = compression
+        self.window_bits = window_bits
+        self.context_takeover = context_takeover
+        self.compression_threshold = compression_threshold
+        self.compression_level = compression_level
+
+        self.connections: Set[WebSocketClientConnection] = set()
+        self.topics: Dict[str, Set[WebSocketClientConnection]] = {}
+        self.messages = 0
+        self.dropped = 0
+        self.disconnected = 0
+        self._keeper: Optional[asyncio.Task] = None
 
     def __str__(self):
         return "<server:%s>" % self.address
@@ -124,47 +328,110 @@ class WebSocketServer(object):
     def address(self):
         return f"{self._host}:{self._port}"
 
-    def listen_and_serve(self):
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.bind((self._host, self._port))
-        self.server.listen(5)
+    def subscribe(self, connection: WebSocketClientConnection, topic: str):
+        self.topics.setdefault(topic, set()).add(connection)
+        connection.topics.add(topic)
+
+    def unsubscribe(self, connection: WebSocketClientConnection, topic: str = None):
+        """Leave one topic, or every topic when topic is None"""
+        for name in [topic] if topic is not None else list(connection.topics):
+            subscribers = self.topics.get(name)
+            if subscribers is not None:
+                subscribers.discard(connection)
+                if not subscribers:
+                    del self.topics[name]
+            connection.topics.discard(name)
+
+    def publish(self, topic: str, message: Union[str, bytes]) -> int:
+        """Send message to every subscriber of topic, returns how many took it"""
+        subscribers = self.topics.get(topic)
+        if not subscribers:
+            return 0
+        return self._fanout(subscribers, message)
+
+    def broadcast(self, message: Union[str, bytes]) -> int:
+        """Send message to every connection past its handshake"""
+        return self._fanout(
+            [connection for connection in self.connections if connection.handshaken], message
+        )
+
+    @staticmethod
+    def _fanout(connections, message: Union[str, bytes]) -> int:
+        # Encoded frames by compression settings, () for uncompressed connections
+        frames: Dict[tuple, bytes] = {}
+        sent = 0
+
+        # A slow consumer may be disconnected, and unsubscribed, in the middle of the loop
+        for connection in list(connections):
+            extension = connection.extension
+            key = () if extension is None else extension.shared
+            if key is None:
+                # Compressed against this connection's earlier messages, nothing to share
+                data = WebSocketProtocol.pack_message(message, 0, extension)
+            else:
+                data = frames.get(key)
+                if data is None:
+                    data = frames[key] = WebSocketProtocol.pack_message(message, 0, extension)
+            sent += connection.write(data)
+
+        return sent
+
+    async def keepalive(self):
+        # One sweep over all connections instead of a timer per connection
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            for connection in list(self.connections):
+                if not connection.handshaken:
+                    continue
+                connection.idle += 1
+                if connection.idle >= 3:
+                    connection.close(WebSocketStatusCode.GoingAway)
+                else:
+                    connection.ping()
+
+    async def start(self) -> asyncio.AbstractServer:
+        loop = asyncio.get_running_loop()
+        self.server = await loop.create_server(
+            lambda: WebSocketClientConnection(self),
+            self._host,
+            self._port,
+            backlog=self.backlog,
+        )
+        # Port 0 binds an ephemeral port
+        self._port = self.server.sockets[0].getsockname()[1]
+        if self.ping_interval and self._keeper is None:
+            self._keeper = loop.create_task(self.keepalive())
 
         log.info(f"listening on {self.address}")
 
-        ts: list[Thread] = []
-        clients: list[WebSocketClientConnection] = []
-
-        # If you do not set a timeout, it will block forever and no operation can be interrupted
-        self.server.settimeout(1)
-        while not self.should_close:
-            try:
-                try:
-                    client, client_address = self.server.accept()
-                except socket.timeout:
-                    continue
-            except KeyboardInterrupt:
-                break
+        return self.server
 
-            client_connection = WebSocketClientConnection(client, client_address)
-            clients.append(client_connection)
+    async def serve_forever(self):
+        try:
+            await self.start()
+            await self.server.serve_forever()
+        finally:
+            self.close()
 
-            log.info(f"connected by {client_connection}")
+    def listen_and_serve(self):
+        try:
+            asyncio.run(self.serve_forever())
+        except KeyboardInterrupt:
+            pass
 
-            t = Thread(target=client_connection.serve, daemon=True)
-            ts.append(t)
-            t.start()
+    def close(self):
+        log.info(f"close {self}")
 
-        for client in clients:
-            client.close()
+        if self._keeper is not None:
+            self._keeper.cancel()
+            self._keeper = None
 
-        for t in ts:
-            t.join()
+        for connection in list(self.connections):
+            connection.close(WebSocketStatusCode.GoingAway)
 
-        self.close()
+        if self.server is not None:
+            self.server.close()
 
-    def close(self):
-        log.info(f"close {self}")
-        self.server.close()
         log.info(f"{self} closed")
 
 
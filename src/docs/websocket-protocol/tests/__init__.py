@@ -0,0 +1,6 @@
+"""
+Date: 2026.10.18 13:23
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:23
+"""
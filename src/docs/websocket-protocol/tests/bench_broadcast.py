@@ -0,0 +1,257 @@
+"""
+Date: 2026.10.18 13:29
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 14:11
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import common
+from common import WebSocketDecoder, WebSocketProtocol
+from deflate import PerMessageDeflate
+from server import WebSocketServer
+from tests.bench_server import connect, rss, spawn
+
+TOPIC = "dashboard"
+
+
+def payload(size: int) -> bytes:
+    """Dashboard update of about size bytes, JSON compresses the way real updates do"""
+    rows, data = 0, b"[]"
+    while len(data) < size:
+        rows += 8
+        data = json.dumps([{"device": f"gw-{i:05d}", "temperature": round(36 + i % 17 / 7, 2),
+                            "status": "online" if i % 9 else "degraded"} for i in range(rows)]).encode()
+    return data[:size]
+
+
+def serve(queue_size: int, slow_consumer: str, write_limit: int, context_takeover: bool):
+    """Subscribers send "subscribe", the controller sends "publish <count> <size> <mode>"
+
+    mode "once" goes through publish(), which encodes the frame once for every subscriber,
+    mode "each" calls send_message() per subscriber and encodes it every time
+    """
+
+    def handle(connection, frame):
+        command = frame.PayloadData.decode().split()
+        if command[0] == "subscribe":
+            server.subscribe(connection, TOPIC)
+            return
+
+        count, size, mode = int(command[1]), int(command[2]), command[3]
+        message = payload(size)
+        dropped, disconnected = server.dropped, server.disconnected
+        cpu, start = time.process_time(), time.perf_counter()
+        for _ in range(count):
+            if mode == "once":
+                server.publish(TOPIC, message)
+            else:
+                for subscriber in list(server.topics.get(TOPIC, ())):
+                    subscriber.send_message(message)
+        connection.send_message(json.dumps({
+            "elapsed": time.perf_counter() - start,
+            "cpu": time.process_time() - cpu,
+            "subscribers": len(server.topics.get(TOPIC, ())),
+            "dropped": server.dropped - dropped,
+            "disconnected": server.disconnected - disconnected,
+        }))
+
+    async def main():
+        await server.start()
+        print(server.address.rsplit(":", 1)[1], flush=True)
+        await server.server.serve_forever()
+
+    server = WebSocketServer("127.0.0.1", 0, handler=handle, ping_interval=0, backlog=4096,
+                             queue_size=queue_size, slow_consumer=slow_consumer, write_limit=write_limit,
+                             context_takeover=context_takeover)
+    asyncio.run(main())
+
+
+def check():
+    """Encode-once fan-out, drop and disconnect policies, without sockets"""
+
+    class Transport(object):
+        def __init__(self):
+            self.written = []
+            self.aborted = False
+
+        def write(self, data):
+            self.written.append(data)
+
+        def abort(self):
+            self.aborted = True
+
+        def close(self):
+            pass
+
+        def set_write_buffer_limits(self, high):
+            pass
+
+        def get_extra_info(self, name):
+            return "127.0.0.1", 0
+
+    from server import WebSocketClientConnection
+
+    for policy in ("drop", "disconnect"):
+        server = WebSocketServer(queue_size=2, slow_consumer=policy)
+        connections = []
+        for _ in range(3):
+            connection = WebSocketClientConnection(server)
+            connection.connection_made(Transport())
+            connection.handshaken = True
+            server.subscribe(connection, TOPIC)
+            connections.append(connection)
+
+        slow = connections[0]
+        slow.pause_writing()
+        sent = [server.publish(TOPIC, f"update {i}") for i in range(4)]
+
+        fast = connections[1].transport.written
+        assert len(fast) == 4 and fast[0] is connections[2].transport.written[0]
+        assert fast[0] == WebSocketProtocol.pack_message("update 0")
+
+        if policy == "drop":
+            assert sent == [3, 3, 2, 2] and server.dropped == 2
+            # The newest frames are kept, and are the same objects the others got
+            assert list(slow.queue) == fast[2:] and slow.queue[0] is fast[2]
+            slow.resume_writing()
+            assert slow.transport.written == fast[2:] and not slow.queue
+        else:
+            assert sent == [3, 3, 2, 2] and server.disconnected == 1 and slow.transport.aborted
+            slow.connection_lost(None)
+            assert server.topics[TOPIC] == set(connections[1:])
+
+        for connection in connections:
+            connection.connection_lost(None)
+        assert not server.topics and not server.connections
+
+    try:
+        WebSocketServer(queue_size=0)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("queue_size=0 should be rejected")
+
+    # Context takeover by default, shared no-takeover frames only when the server opts in
+    from client import websocket_upgrade_template_client
+
+    request = websocket_upgrade_template_client.format(
+        "dGhlIHNhbXBsZSBub25jZQ==", "localhost", f"Sec-WebSocket-Extensions: {PerMessageDeflate.offer()}\r\n"
+    ).encode()
+    for kwargs, shared in (({}, False), ({"context_takeover": False}, True)):
+        connection = WebSocketClientConnection(WebSocketServer(**kwargs))
+        connection.connection_made(Transport())
+        assert connection.handshake(request)
+        assert (connection.extension.shared is not None) == shared, kwargs
+
+    # Compressed connections: a frame may only be dropped when it does not depend on the ones before
+    messages = [json.dumps({"update": i, "values": list(range(i, i + 40))}) for i in range(6)]
+    for context_takeover in (False, True):
+        server = WebSocketServer(queue_size=2, slow_consumer="drop")
+        offer = "permessage-deflate" + ("" if context_takeover else "; server_no_context_takeover")
+        connection = WebSocketClientConnection(server)
+        connection.connection_made(Transport())
+        connection.handshaken = True
+        connection.extension = PerMessageDeflate.accept(offer)
+        client = PerMessageDeflate.from_response(connection.extension.parameters())
+        server.subscribe(connection, TOPIC)
+
+        connection.pause_writing()
+        for message in messages[:4]:
+            server.publish(TOPIC, message)
+        if context_takeover:
+            assert connection.transport.aborted and server.disconnected == 1 and not server.dropped
+            continue
+
+        assert server.dropped == 2
+        connection.resume_writing()
+        server.publish(TOPIC, messages[4])
+        decoder = WebSocketDecoder(masked=False, extension=client)
+        frames = decoder.feed(b"".join(connection.transport.written))
+        assert [frame.PayloadData.decode() for frame in frames] == messages[2:5]
+
+
+async def main(args):
+    process, port = spawn(__file__, str(args.queue_size), args.policy, str(args.write_limit),
+                          str(int(args.context_takeover)))
+    # Subscribers offer permessage-deflate the way browsers do
+    extensions = f"Sec-WebSocket-Extensions: {PerMessageDeflate.offer()}\r\n" if args.compress else ""
+    try:
+        await asyncio.sleep(0.5)
+        before = rss(process.pid)
+
+        start = time.perf_counter()
+        subscribers = await connect("127.0.0.1", port, args.subscribers, extensions=extensions)
+        (controller,) = await connect("127.0.0.1", port, 1)
+        subscribe = WebSocketProtocol.pack_message("subscribe", 1)
+        for subscriber in subscribers:
+            subscriber.transport.write(subscribe)
+        await asyncio.sleep(1)
+        print(f"{args.subscribers} subscribers in {time.perf_counter() - start:.1f} s, "
+              f"server RSS {(rss(process.pid) - before) / args.subscribers / 1024:.1f} KiB per subscriber")
+
+        slow, fast = subscribers[: args.slow], subscribers[args.slow :]
+        for subscriber in slow:
+            subscriber.transport.pause_reading()
+
+        loop = asyncio.get_running_loop()
+        if args.compress:
+            print(f"subscribers negotiated {subscribers[0].extension}")
+        print(f'{"mode":<6} {"publish ms":>11} {"server cpu us/frame":>20} {"delivered s":>12} '
+              f'{"frames/s":>12} {"wire B/msg":>11} {"dropped":>8} {"disconnected":>13}')
+        for mode in ("each", "once"):
+            for subscriber in fast:
+                subscriber.expected = subscriber.received + args.count
+                subscriber.done = loop.create_future()
+            controller.expected = controller.received + 1
+            controller.done = loop.create_future()
+
+            start = time.perf_counter()
+            controller.transport.write(WebSocketProtocol.pack_message(f"publish {args.count} {args.size} {mode}", 1))
+            await asyncio.wait_for(asyncio.gather(controller.done, *(subscriber.done for subscriber in fast)), 120)
+            delivered = time.perf_counter() - start
+
+            report = json.loads(controller.last.PayloadData)
+            frames = args.count * report["subscribers"]
+            extension = fast[0].extension
+            wire = extension.received / extension.received_raw * args.size if extension else args.size
+            if extension:
+                extension.received = extension.received_raw = 0
+            print(f"{mode:<6} {report['elapsed'] * 1e3:>11.1f} {report['cpu'] / frames * 1e6:>20.2f} "
+                  f"{delivered:>12.2f} {args.count * len(fast) / delivered:>12,.0f} {wire:>11.0f} "
+                  f"{report['dropped']:>8} {report['disconnected']:>13}")
+
+        for subscriber in subscribers + [controller]:
+            subscriber.transport.close()
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--serve", nargs=4, metavar=("QUEUE_SIZE", "POLICY", "WRITE_LIMIT", "CONTEXT_TAKEOVER"),
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--subscribers", type=int, default=10000)
+    parser.add_argument("--count", type=int, default=20, help="messages published per mode")
+    parser.add_argument("--size", type=int, default=1024, help="bytes per message")
+    parser.add_argument("--slow", type=int, default=100, help="subscribers that stop reading")
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--policy", choices=("drop", "disconnect"), default="drop")
+    parser.add_argument("--write-limit", type=int, default=4096)
+    parser.add_argument("--compress", action="store_true", help="subscribers offer permessage-deflate")
+    parser.add_argument("--context-takeover", action="store_true",
+                        help="keep the server default, context takeover per subscriber, "
+                             "instead of opting into shared no-takeover frames")
+    args = parser.parse_args()
+
+    common.log.setLevel("INFO")
+    if args.serve:
+        serve(int(args.serve[0]), args.serve[1], int(args.serve[2]), bool(int(args.serve[3])))
+    else:
+        check()
+        asyncio.run(main(args))
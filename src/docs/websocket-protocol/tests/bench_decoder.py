@@ -0,0 +1,142 @@
+"""
+Date: 2026.10.18 13:25
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:25
+"""
+import argparse
+import os
+import random
+import time
+
+import common
+from common import (
+    WebSocketDecoder,
+    WebSocketError,
+    WebSocketFrame,
+    WebSocketOpcode,
+    WebSocketProtocol,
+    WebSocketStatusCode,
+)
+
+pack = WebSocketProtocol.pack_frame_to_data
+
+
+def fragments(opcode: int, payload: bytes, size: int, masked: int = 1):
+    """Split one message into frames of at most size bytes"""
+    chunks = [payload[i : i + size] for i in range(0, len(payload), size)] or [b""]
+    for i, chunk in enumerate(chunks):
+        yield pack(
+            WebSocketFrame(
+                FIN=int(i == len(chunks) - 1),
+                Opcode=opcode if i == 0 else WebSocketOpcode.ContinuationFrame,
+                MASK=masked,
+                PayloadData=chunk,
+            )
+        )
+
+
+def split(data: bytes, rng: random.Random):
+    offset = 0
+    while offset < len(data):
+        step = rng.choice((1, 2, 3, 7, 64, 1000, 70000))
+        yield data[offset : offset + step]
+        offset += step
+
+
+def rejected(data: bytes, code: int, **kwargs):
+    try:
+        WebSocketDecoder(**kwargs).feed(data)
+    except WebSocketError as e:
+        assert e.code == code, e
+    else:
+        raise AssertionError(f"{data[:16]!r} should be rejected")
+
+
+def check():
+    rng = random.Random(6455)
+
+    # Lengths around the 7-bit, 16-bit and 64-bit boundaries
+    messages = [rng.randbytes(n) for n in (0, 1, 125, 126, 127, 65535, 65536, 200000)]
+    messages += [rng.randbytes(rng.randrange(3000)) for _ in range(200)]
+
+    for masked in (1, 0):
+        expected, stream = [], bytearray()
+        for payload in messages:
+            opcode = rng.choice((WebSocketOpcode.TextFrame, WebSocketOpcode.BinaryFrame))
+            frames = list(fragments(opcode, payload, rng.choice((7, 100, 1 << 20)), masked))
+            # A ping between fragments is delivered right away
+            if len(frames) > 1:
+                ping = pack(WebSocketFrame(Opcode=WebSocketOpcode.PingFrame, MASK=masked, PayloadData=b"p"))
+                frames.insert(1, ping)
+                expected.append((WebSocketOpcode.PingFrame, b"p"))
+            expected.append((opcode, payload))
+            stream += b"".join(frames)
+
+        for chunks in ([bytes(stream)], list(split(bytes(stream), rng))):
+            decoder = WebSocketDecoder(max_size=1 << 18, masked=bool(masked))
+            received = []
+            for chunk in chunks:
+                for frame in decoder.feed(chunk):
+                    assert frame.FIN == 1
+                    received.append((frame.Opcode, frame.PayloadData))
+            assert received == expected
+            assert len(decoder) == 0
+
+    # One frame per call, the old entry point, with a 64-bit length
+    payload = rng.randbytes(70000)
+    frame = WebSocketProtocol.unpack_data_to_frame(pack(WebSocketFrame(Opcode=2, PayloadData=payload)))
+    assert frame.PayloadLength == 127 and frame.ExtendedPayloadLength == 70000
+    assert frame.PayloadData == payload
+
+    # Too large, rejected from the header before the payload arrives
+    header = pack(WebSocketFrame(Opcode=2, PayloadData=bytes(2000)))[:8]
+    rejected(header, WebSocketStatusCode.MessageTooBig, max_size=1000)
+    stream = b"".join(fragments(WebSocketOpcode.TextFrame, bytes(2000), 600))
+    rejected(stream, WebSocketStatusCode.MessageTooBig, max_size=1000)
+
+    # Protocol violations
+    continuation = pack(WebSocketFrame(Opcode=0, PayloadData=b"x"))
+    rejected(continuation, WebSocketStatusCode.ProtocolError)
+    unfinished = pack(WebSocketFrame(FIN=0, Opcode=1, PayloadData=b"x"))
+    rejected(unfinished + unfinished, WebSocketStatusCode.ProtocolError)
+    rejected(pack(WebSocketFrame(Opcode=9, PayloadData=bytes(126))), WebSocketStatusCode.ProtocolError)
+    rejected(pack(WebSocketFrame(FIN=0, Opcode=9)), WebSocketStatusCode.ProtocolError)
+    rejected(pack(WebSocketFrame(Opcode=3)), WebSocketStatusCode.ProtocolError)
+    rejected(pack(WebSocketFrame(Opcode=1, MASK=0)), WebSocketStatusCode.ProtocolError, masked=True)
+    rejected(b"\xc1\x00", WebSocketStatusCode.ProtocolError)
+
+
+def bench(stream: bytes, chunk: int, repeat: int = 3):
+    chunks = [stream[i : i + chunk] for i in range(0, len(stream), chunk)]
+    best, count = float("inf"), 0
+    for _ in range(repeat):
+        decoder = WebSocketDecoder(max_size=1 << 30, masked=True)
+        start = time.perf_counter()
+        count = 0
+        for data in chunks:
+            count += len(decoder.feed(data))
+        best = min(best, time.perf_counter() - start)
+    return count / best, len(stream) / best / 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunk", type=int, default=1 << 16, help="bytes per recv")
+    parser.add_argument("--small", type=int, default=100000, help="number of small frames")
+    parser.add_argument("--large", type=int, default=64 << 20, help="bytes of large messages")
+    args = parser.parse_args()
+
+    common.log.setLevel("INFO")
+    check()
+
+    print(f'{"workload":<36} {"msgs/s":>12} {"MB/s":>10}')
+    for name, stream in (
+        ("32 B frames", b"".join(pack(WebSocketFrame(Opcode=1, PayloadData=os.urandom(32))) for _ in range(args.small))),
+        ("1 KiB frames", b"".join(pack(WebSocketFrame(Opcode=2, PayloadData=os.urandom(1024))) for _ in range(args.small // 4))),
+        ("1 MiB frames", b"".join(pack(WebSocketFrame(Opcode=2, PayloadData=os.urandom(1 << 20))) for _ in range(args.large >> 20))),
+        ("16 MiB messages in 64 KiB fragments", b"".join(
+            b"".join(fragments(2, os.urandom(16 << 20), 1 << 16)) for _ in range(max(1, args.large >> 24)))),
+    ):
+        messages, throughput = bench(stream, args.chunk)
+        print(f"{name:<36} {messages:>12.0f} {throughput:>10.1f}")
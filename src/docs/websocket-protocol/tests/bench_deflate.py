@@ -0,0 +1,204 @@
+"""
+Date: 2026.10.18 13:32
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:58
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import common
+from common import (
+    WebSocketDecoder,
+    WebSocketError,
+    WebSocketFrame,
+    WebSocketProtocol,
+    WebSocketStatusCode,
+    parse_http_headers,
+)
+from deflate import PerMessageDeflate
+from server import WebSocketServer
+from tests.bench_server import Client
+
+pack = WebSocketProtocol.pack_frame_to_data
+
+
+def telemetry(count: int, seed: int = 7692):
+    """JSON telemetry as our devices send it"""
+    rng = random.Random(seed)
+    devices = [f"gw-{rng.getrandbits(32):08x}" for _ in range(50)]
+    timestamp = 1760000000.0
+    messages = []
+    for _ in range(count):
+        timestamp += rng.random()
+        messages.append(json.dumps({
+            "device": rng.choice(devices),
+            "timestamp": round(timestamp, 3),
+            "status": rng.choice(("online", "online", "online", "degraded")),
+            "location": {"latitude": round(rng.uniform(22, 23), 6), "longitude": round(rng.uniform(113, 114), 6)},
+            "metrics": {
+                "temperature": round(rng.gauss(36, 2), 2),
+                "humidity": round(rng.uniform(30, 70), 1),
+                "voltage": round(rng.gauss(12, 0.1), 3),
+                "rssi": rng.randrange(-100, -40),
+                "uptime": rng.randrange(1 << 20),
+            },
+            "tags": ["fleet-a", "region-south", "firmware-2.4.1"],
+        }))
+    return messages
+
+
+def negotiated(offer: str, **kwargs):
+    """Server and client ends of a negotiation, or None when the server declined"""
+    server = PerMessageDeflate.accept(offer, **kwargs)
+    if server is None:
+        return None
+    return server, PerMessageDeflate.from_response(server.parameters())
+
+
+def check():
+    # Negotiation
+    server, client = negotiated(PerMessageDeflate.offer())
+    assert server.parameters() == "permessage-deflate" and client.compress_bits == 15
+    server, client = negotiated("permessage-deflate; server_max_window_bits=10; client_max_window_bits", window_bits=12)
+    assert server.compress_bits == 10 == client.decompress_bits
+    assert server.decompress_bits == 12 == client.compress_bits
+    server, client = negotiated(PerMessageDeflate.offer(), context_takeover=False)
+    assert server.shared is not None and client.decompress_reset and not client.compress_reset
+    server, client = negotiated(PerMessageDeflate.offer(context_takeover=False))
+    assert server.shared is None and server.decompress_reset and client.compress_reset
+    assert negotiated("permessage-deflate; server_max_window_bits=8") is None
+    assert negotiated("permessage-deflate; unknown") is None
+    assert negotiated("x-webkit-deflate-frame") is None
+    assert negotiated("permessage-deflate; client_max_window_bits=99, permessage-deflate")[0].parameters() == "permessage-deflate"
+    try:
+        PerMessageDeflate.from_response("permessage-deflate; client_max_window_bits=12", window_bits=10)
+    except WebSocketError:
+        pass
+    else:
+        raise AssertionError("a larger client window than offered must fail the connection")
+
+    # Messages through the codec, with and without context takeover
+    messages = telemetry(300) + ["", "x" * 200, "short"]
+    for context_takeover in (True, False):
+        server, client = negotiated(PerMessageDeflate.offer(), context_takeover=context_takeover, threshold=0)
+        decoder = WebSocketDecoder(masked=True, extension=server)
+        stream = b"".join(WebSocketProtocol.pack_message(message, 1, client) for message in messages)
+        frames = decoder.feed(stream)
+        assert [frame.PayloadData.decode() for frame in frames] == messages
+        assert all(frame.RSV1 == 0 for frame in frames)
+        assert stream[0] & 0x40
+
+    # Compressed message split into fragments, RSV1 on the first only
+    server, client = negotiated(PerMessageDeflate.offer())
+    payload = "".join(telemetry(50)).encode()
+    compressed = client.compress(payload)
+    third = len(compressed) // 3
+    stream = pack(WebSocketFrame(FIN=0, RSV1=1, Opcode=1, PayloadData=compressed[:third]))
+    stream += pack(WebSocketFrame(Opcode=9, PayloadData=b"ping"))
+    stream += pack(WebSocketFrame(FIN=0, Opcode=0, PayloadData=compressed[third : 2 * third]))
+    stream += pack(WebSocketFrame(Opcode=0, PayloadData=compressed[2 * third :]))
+    frames = WebSocketDecoder(extension=server).feed(stream)
+    assert [frame.Opcode for frame in frames] == [9, 1] and frames[1].PayloadData == payload
+
+    # RSV1 where it does not belong, and a decompression bomb
+    for data, kwargs, code in (
+        (pack(WebSocketFrame(RSV1=1, Opcode=1, PayloadData=b"x")), {}, WebSocketStatusCode.ProtocolError),
+        (pack(WebSocketFrame(FIN=0, Opcode=1, PayloadData=b"x")) + pack(WebSocketFrame(RSV1=1, Opcode=0, PayloadData=b"x")),
+         {"extension": server}, WebSocketStatusCode.ProtocolError),
+        (pack(WebSocketFrame(RSV1=1, Opcode=9)), {"extension": server}, WebSocketStatusCode.ProtocolError),
+        (pack(WebSocketFrame(RSV1=1, Opcode=2, PayloadData=PerMessageDeflate(False).compress(bytes(1 << 20)))),
+         {"extension": PerMessageDeflate(True), "max_size": 1 << 16}, WebSocketStatusCode.MessageTooBig),
+    ):
+        try:
+            WebSocketDecoder(**kwargs).feed(data)
+        except WebSocketError as e:
+            assert e.code == code, e
+        else:
+            raise AssertionError(f"{data[:8]!r} should be rejected")
+
+    asyncio.run(check_server())
+
+
+async def check_server():
+    """Negotiate through the real handshake and echo compressed messages"""
+    messages = telemetry(20)
+    received = []
+
+    def echo(connection, frame: WebSocketFrame):
+        received.append(frame.PayloadData.decode())
+        connection.send_message(frame.PayloadData.decode())
+
+    server = WebSocketServer("127.0.0.1", 0, handler=echo, ping_interval=0, window_bits=11,
+                             context_takeover=True)
+    await server.start()
+    loop = asyncio.get_running_loop()
+    try:
+        for offer, expected in ((PerMessageDeflate.offer(10), "permessage-deflate; client_max_window_bits=10"),
+                                ("", None)):
+            _, client = await loop.create_connection(
+                lambda: Client(server.address, f"Sec-WebSocket-Extensions: {offer}\r\n" if offer else ""),
+                "127.0.0.1", int(server.address.rsplit(":", 1)[1]))
+            await client.handshaken
+
+            header = parse_http_headers(client.response.decode(), from_request=False).get("Sec-WebSocket-Extensions")
+            extension = PerMessageDeflate.from_response(header, window_bits=10)
+            assert header == (expected and "permessage-deflate; server_max_window_bits=11; client_max_window_bits=10")
+            client.decoder.extension = extension
+
+            del received[:]
+            client.expected, client.done = len(messages), loop.create_future()
+            frames = client.frames = []
+            client.transport.write(b"".join(WebSocketProtocol.pack_message(m, 1, extension) for m in messages))
+            await asyncio.wait_for(client.done, 5)
+
+            assert received == messages and [frame.PayloadData.decode() for frame in frames] == messages
+            connection = next(iter(server.connections))
+            assert (connection.extension is not None) == bool(offer)
+            if offer:
+                assert connection.extension.sent < connection.extension.sent_raw / 3
+            client.transport.close()
+            await asyncio.sleep(0.1)
+    finally:
+        server.close()
+
+
+def bench(messages, **kwargs):
+    server, client = negotiated(PerMessageDeflate.offer(), threshold=0, **kwargs)
+    payloads = [message.encode() for message in messages]
+    compressed = [server.compress(payload) for payload in payloads]
+    for data in compressed:
+        client.decompress(data, 1 << 20)
+    return server, client
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=20000)
+    args = parser.parse_args()
+
+    common.log.setLevel("INFO")
+    check()
+
+    messages = telemetry(args.count)
+    raw = sum(len(message) for message in messages)
+    print(f"{args.count} JSON telemetry messages, {raw / args.count:.0f} B on average")
+    print(f'{"settings":<34} {"ratio":>6} {"saved B/msg":>12} {"deflate us":>11} {"inflate us":>11} '
+          f'{"saved KB/cpu-ms":>16}')
+    for name, kwargs in (
+        ("level 1, 15 bits", {"level": 1}),
+        ("level 6, 15 bits", {"level": 6}),
+        ("level 9, 15 bits", {"level": 9}),
+        ("level 6, 10 bits", {"level": 6, "window_bits": 10}),
+        ("level 6, 15 bits, no takeover", {"level": 6, "context_takeover": False}),
+        ("level 1, 10 bits, no takeover", {"level": 1, "window_bits": 10, "context_takeover": False}),
+    ):
+        server, client = bench(messages, **kwargs)
+        saved = server.sent_raw - server.sent
+        cpu = server.compress_ns + client.decompress_ns
+        print(f"{name:<34} {server.sent_raw / server.sent:>6.1f} {saved / args.count:>12.0f} "
+              f"{server.compress_ns / args.count / 1e3:>11.1f} {client.decompress_ns / args.count / 1e3:>11.1f} "
+              f"{saved / 1e3 / (cpu / 1e6):>16.1f}")
@@ -0,0 +1,82 @@
+"""
+Date: 2026.10.18 13:23
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:23
+"""
+import argparse
+import os
+import random
+import time
+
+import common
+from common import WebSocketFrame, WebSocketProtocol, mask
+
+
+def loop(data: bytes, key: bytes) -> bytes:
+    """The per-byte loop pack_frame_to_data and unpack_data_to_frame used before"""
+    payload_data = bytearray()
+    for i in range(len(data)):
+        payload_data.append(data[i] ^ key[i % 4])
+    return bytes(payload_data)
+
+
+def engines():
+    yield "int", common._mask_int
+    if common.numpy is not None:
+        yield "numpy", common._mask_numpy
+
+
+def check():
+    rng = random.Random(6455)
+
+    for size in list(range(0, 70)) + [125, 126, 65535, 65536, 65537, 1 << 20 | 3]:
+        data = rng.randbytes(size)
+        key = rng.randbytes(4)
+        expected = loop(data, key)
+
+        assert mask(data, key) == expected, size
+        assert mask(expected, key) == data, size
+        assert mask(bytearray(data), key) == expected, size
+        assert mask(memoryview(data), key) == expected, size
+        for name, engine in engines():
+            assert engine(data, key) == expected, (name, size)
+
+    # Round trip through the frame codec
+    payload = b"Hello, WebSocket"
+    frame = WebSocketFrame(Opcode=1, PayloadLength=len(payload), PayloadData=payload)
+    data = WebSocketProtocol.pack_frame_to_data(frame)
+    assert data[6:] == loop(payload, data[2:6])
+    assert WebSocketProtocol.unpack_data_to_frame(data).PayloadData == payload
+
+
+def bench(function, data: bytes, key: bytes, budget: float = 0.2) -> float:
+    count, elapsed = 0, 0.0
+    while elapsed < budget:
+        start = time.perf_counter()
+        function(data, key)
+        elapsed += time.perf_counter() - start
+        count += 1
+    return len(data) * count / elapsed / 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max", type=int, default=16 << 20, help="largest payload")
+    parser.add_argument("--loop-max", type=int, default=1 << 20, help="skip the loop above this")
+    args = parser.parse_args()
+
+    common.log.setLevel("INFO")
+    check()
+
+    names = ["loop", "mask"] + [name for name, _ in engines()]
+    print(f'{"MB/s":>10}' + "".join(f"{name:>10}" for name in names))
+
+    key = os.urandom(4)
+    size = 16
+    while size <= args.max:
+        data = os.urandom(size)
+        row = [bench(loop, data, key) if size <= args.loop_max else float("nan"), bench(mask, data, key)]
+        row += [bench(engine, data, key) for _, engine in engines()]
+        print(f"{size:>10}" + "".join(f"{value:>10.1f}" for value in row))
+        size <<= 2
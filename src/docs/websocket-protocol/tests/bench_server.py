@@ -0,0 +1,186 @@
+"""
+Date: 2026.10.18 13:27
+Description: Omit
+LastEditors: Rustle Karl
+LastEditTime: 2026.10.18 13:58
+"""
+import argparse
+import asyncio
+import base64
+import os
+import subprocess
+import sys
+import time
+
+import common
+from client import websocket_upgrade_template_client
+from common import (
+    WebSocketDecoder,
+    WebSocketFrame,
+    WebSocketOpcode,
+    WebSocketProtocol,
+    parse_http_headers,
+)
+from deflate import PerMessageDeflate
+from server import WebSocketServer
+
+pack = WebSocketProtocol.pack_frame_to_data
+
+
+def echo(connection, frame: WebSocketFrame):
+    connection._send(pack(WebSocketFrame(Opcode=frame.Opcode, MASK=0, PayloadData=frame.PayloadData)))
+
+
+def serve():
+    """Run in a separate process, so its memory can be measured on its own"""
+
+    async def main():
+        server = WebSocketServer("127.0.0.1", 0, handler=echo, ping_interval=0, backlog=4096)
+        await server.start()
+        print(server.address.rsplit(":", 1)[1], flush=True)
+        await server.server.serve_forever()
+
+    asyncio.run(main())
+
+
+def rss(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as fp:
+        for line in fp:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) << 10
+    return 0
+
+
+class Client(asyncio.Protocol):
+    def __init__(self, host: str, extensions: str = ""):
+        self.host = host
+        self.extensions = extensions
+        self.response = b""
+        self.extension = None
+        self.transport = None
+        self.handshaken = asyncio.get_running_loop().create_future()
+        self.decoder = WebSocketDecoder(masked=False)
+        self.expected = 0
+        self.received = 0
+        self.last: WebSocketFrame = None
+        # Every frame received, only kept when set to a list
+        self.frames = None
+        self.done = None
+        self._response = bytearray()
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        key = base64.b64encode(os.urandom(16)).decode()
+        transport.write(websocket_upgrade_template_client.format(key, self.host, self.extensions).encode())
+
+    def data_received(self, data: bytes):
+        if not self.handshaken.done():
+            self._response.extend(data)
+            end = self._response.find(b"\r\n\r\n")
+            if end == -1:
+                return
+            self.response = bytes(self._response[:end])
+            assert b" 101 " in self.response, self.response
+            headers = parse_http_headers(self.response.decode(), from_request=False)
+            self.extension = PerMessageDeflate.from_response(headers.get("Sec-WebSocket-Extensions"))
+            self.decoder.extension = self.extension
+            data = bytes(self._response[end + 4 :])
+            self.handshaken.set_result(None)
+
+        frames = self.decoder.feed(data)
+        if frames:
+            self.received += len(frames)
+            self.last = frames[-1]
+            if self.frames is not None:
+                self.frames.extend(frames)
+        if self.done is not None and self.received >= self.expected and not self.done.done():
+            self.done.set_result(None)
+
+
+async def connect(host: str, port: int, count: int, concurrency: int = 256, extensions: str = ""):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            _, client = await loop.create_connection(lambda: Client(f"{host}:{port}", extensions), host, port)
+            await client.handshaken
+            return client
+
+    return await asyncio.gather(*(one() for _ in range(count)))
+
+
+def spawn(script: str, *args: str):
+    """Start script --serve in a subprocess, returns the process and the port it listens on
+
+    The benchmark runs as python -m tests.<name> from the directory above tests, like the
+    parent process, so the server modules and tests.bench_server import the same way.
+    """
+    module = "tests." + os.path.splitext(os.path.basename(script))[0]
+    process = subprocess.Popen(
+        [sys.executable, "-m", module, "--serve", *args],
+        stdout=subprocess.PIPE,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(script))),
+        env=dict(os.environ),
+    )
+    return process, int(process.stdout.readline())
+
+
+async def main(args):
+    process, port = spawn(__file__)
+    try:
+        # Let the server settle before taking the baseline
+        await asyncio.sleep(0.5)
+        before = rss(process.pid)
+
+        start = time.perf_counter()
+        clients = await connect("127.0.0.1", port, args.connections)
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(0.5)
+        after = rss(process.pid)
+
+        print(f"{args.connections} connections established in {elapsed:.2f} s "
+              f"({args.connections / elapsed:,.0f} handshakes/s)")
+        print(f"server RSS {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB, "
+              f"{(after - before) / args.connections / 1024:.1f} KiB per connection")
+
+        # Echo round trips spread over a subset of the connections
+        loop = asyncio.get_running_loop()
+        active = clients[: args.active]
+        frames = b"".join(pack(WebSocketFrame(Opcode=WebSocketOpcode.BinaryFrame, PayloadData=os.urandom(args.size)))
+                          for _ in range(args.messages))
+        for client in active:
+            client.expected = client.received + args.messages
+            client.done = loop.create_future()
+
+        start = time.perf_counter()
+        for client in active:
+            client.transport.write(frames)
+        await asyncio.gather(*(client.done for client in active))
+        elapsed = time.perf_counter() - start
+
+        total = args.messages * len(active)
+        print(f"{total} echoed {args.size} B messages over {len(active)} connections in {elapsed:.2f} s, "
+              f"{total / elapsed:,.0f} msgs/s")
+
+        for client in clients:
+            client.transport.close()
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--active", type=int, default=100, help="connections sending messages")
+    parser.add_argument("--messages", type=int, default=1000, help="messages per active connection")
+    parser.add_argument("--size", type=int, default=64)
+    args = parser.parse_args()
+
+    common.log.setLevel("INFO")
+    if args.serve:
+        serve()
+    else:
+        asyncio.run(main(args))